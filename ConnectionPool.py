@@ -0,0 +1,353 @@
+﻿'''Database connections shared by the dependency suites.
+
+Opening a connection to DB2 or SQL Server takes far longer than the catalog
+queries the suites run, so connections are kept open and reused instead of
+being opened for every query.  Connections are pooled by their formatted
+connection string, so every suite (and every region of a run) that uses the
+same database shares them:
+
+    with ConnectionPool.connection(connectionString) as sql:
+        rows = sql.select('SELECT ...')
+
+At most `maxSize` connections are open per connection string; once they are
+all in use, further callers wait for one to be returned.  A connection that
+has been idle too long is closed, and one that raised an error is never
+reused.  Before an idle connection is handed out it runs a trivial query (the
+first of PROBE_QUERIES that the server accepted when the pool first connected
+to it), and is replaced by a new connection if that fails.  If the server drops
+a connection between the probe and the first query, that query fails with
+OperationalError or InterfaceError; it is run again once on a new connection,
+after the other idle connections to the same server are closed, since they
+were most likely dropped too.
+
+By default the pooled connections are SqlDbConnection objects, so they
+connect exactly as the suites always have: each one is entered when it is
+opened, stays open while it is pooled, and is exited when it is closed.  Like
+SqlDbConnection.select(), their select() takes only the query.  A DB-API 2.0
+driver module can be given instead, which also accepts query parameters, and
+FakeDbApi provides one that needs no database, for local testing:
+
+    pool = ConnectionPool.ConnectionPool(driver='FakeDbApi')
+'''
+
+from collections import deque
+
+import importlib
+import threading
+import time
+
+
+# None opens SqlDbConnection objects; otherwise a DB-API driver module or its
+# name
+DEFAULT_DRIVER = None
+
+# Open connections per connection string
+DEFAULT_MAX_SIZE = 4
+
+# Seconds to wait for a free connection before giving up
+DEFAULT_TIMEOUT = 60
+
+# Connections idle for longer than this many seconds are closed rather than
+# reused
+MAX_IDLE = 600
+
+# DB-API exceptions raised when the connection itself has failed, rather than
+# the query.  They are matched by name, since every driver has its own classes
+CONNECTION_ERRORS = ('OperationalError', 'InterfaceError')
+
+# Cheap queries that show a connection still works, tried in order on the
+# first connection to each server: DB2, then SQL Server
+PROBE_QUERIES = ('SELECT 1 FROM sysibm.sysdummy1', 'SELECT 1')
+
+
+class PoolTimeout(Exception):
+    '''No connection became free within the pool's timeout'''
+
+
+def isConnectionError(ex):
+    '''Returns True if `ex` says that the connection, not the query, failed'''
+
+    return any(cls.__name__ in CONNECTION_ERRORS for cls in type(ex).__mro__)
+
+
+class _SqlDbSession(object):
+    '''A SqlDbConnection that is entered once and kept open while pooled'''
+
+    def __init__(self, connectionString):
+        from SqlDbConnection import SqlDbConnection
+
+        self._context = SqlDbConnection(connectionString)
+        self._sql = self._context.__enter__()
+
+    def select(self, query, params=None):
+        if params:
+            raise TypeError('SqlDbConnection.select() does not take query parameters')
+        return self._sql.select(query)
+
+    def reset(self):
+        # SqlDbConnection ends its own transactions
+        pass
+
+    def close(self):
+        self._context.__exit__(None, None, None)
+
+
+class _DbApiSession(object):
+    '''A connection opened with the connect() function of a DB-API driver'''
+
+    def __init__(self, driver, connectionString):
+        self._connection = driver.connect(connectionString)
+
+    def select(self, query, params=None):
+        cursor = self._connection.cursor()
+        try:
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def reset(self):
+        # Ending the (read-only) transaction is a round trip to the server
+        # that works the same on every database
+        self._connection.rollback()
+
+    def close(self):
+        self._connection.close()
+
+
+class PooledConnection(object):
+    '''A connection taken from a pool for the duration of a `with` block.
+    Provides the same select() as SqlDbConnection'''
+
+    def __init__(self, pool, connectionString):
+        self.pool = pool
+        self.connectionString = connectionString
+        self.connection = None
+        self.queries = 0
+
+    def __enter__(self):
+        self.connection = self.pool.acquire(self.connectionString)
+        self.queries = 0
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        # The state of a connection that raised an error is unknown, so it
+        # is closed rather than returned
+        if self.connection is not None:
+            self.pool.release(self.connectionString, self.connection, broken=excType is not None)
+        self.connection = None
+        return False
+
+    def select(self, query, params=None):
+        '''Runs `query` with the optional sequence of `params` and returns all rows'''
+
+        self.queries += 1
+        try:
+            return self.connection.select(query, params)
+        except Exception as ex:
+            # Only the first query is repeated: nothing else has run on the
+            # connection, so running it again elsewhere changes nothing
+            if self.queries > 1 or not isConnectionError(ex):
+                raise
+
+        self.pool.release(self.connectionString, self.connection, broken=True)
+        self.connection = None
+        self.pool.closeIdle(self.connectionString)
+        self.connection = self.pool.acquire(self.connectionString)
+        with self.pool._lock:
+            self.pool.stats['retried'] += 1
+        return self.connection.select(query, params)
+
+
+class ConnectionPool(object):
+    '''A thread-safe pool of database connections, keyed by connection string'''
+
+    def __init__(self, driver=DEFAULT_DRIVER, maxSize=DEFAULT_MAX_SIZE, timeout=DEFAULT_TIMEOUT, maxIdle=MAX_IDLE):
+        # None for SqlDbConnection, or a DB-API module with a connect()
+        # function, or the name of one
+        self.driver = driver
+        self.maxSize = maxSize
+        self.timeout = timeout
+        self.maxIdle = maxIdle
+
+        self._lock = threading.Condition()
+        # connection string -> deque of (connection, time returned)
+        self._idle = {}
+        # connection string -> number of open connections, idle or in use
+        self._open = {}
+        # connection string -> the query in PROBE_QUERIES that its server
+        # accepts, or None if it accepts none of them
+        self._probes = {}
+
+        self.stats = {'opened': 0, 'reused': 0, 'closed': 0, 'retried': 0}
+
+    def connection(self, connectionString):
+        return PooledConnection(self, connectionString)
+
+    def _connect(self, connectionString):
+        if self.driver is None:
+            return _SqlDbSession(connectionString)
+        if isinstance(self.driver, str):
+            self.driver = importlib.import_module(self.driver)
+        return _DbApiSession(self.driver, connectionString)
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _healthy(self, connection):
+        try:
+            connection.reset()
+            return True
+        except Exception:
+            return False
+
+    def _findProbe(self, connection):
+        '''Returns the first of PROBE_QUERIES that runs on the new `connection`'''
+
+        for query in PROBE_QUERIES:
+            try:
+                connection.select(query)
+                return query
+            except Exception:
+                # Most likely a table or syntax this server doesn't have
+                pass
+        return None
+
+    def _alive(self, connectionString, connection):
+        '''Returns True if the idle `connection` can still reach the server'''
+
+        probe = self._probes.get(connectionString)
+        if probe is None:
+            # Nothing to run on this server; at least make a round trip
+            return self._healthy(connection)
+        try:
+            connection.select(probe)
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, connectionString, connection):
+        self._close(connection)
+        with self._lock:
+            self._open[connectionString] -= 1
+            self.stats['closed'] += 1
+            self._lock.notify()
+
+    def acquire(self, connectionString):
+        '''Returns an open connection for `connectionString`, reusing an idle one
+        when possible.  Return it with release()'''
+
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            connection = None
+            with self._lock:
+                while True:
+                    idle = self._idle.get(connectionString)
+                    if idle:
+                        # The most recently used connection is the most
+                        # likely to still be alive
+                        connection, since = idle.pop()
+                        break
+                    if self._open.get(connectionString, 0) < self.maxSize:
+                        self._open[connectionString] = self._open.get(connectionString, 0) + 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout('no free connection after {}s (max {} per connection string)'.format(
+                            self.timeout, self.maxSize))
+                    self._lock.wait(remaining)
+
+            # Connecting and checking happen outside the lock, so other
+            # threads aren't held up by a slow server
+            if connection is None:
+                try:
+                    connection = self._connect(connectionString)
+                except Exception:
+                    with self._lock:
+                        self._open[connectionString] -= 1
+                        self._lock.notify()
+                    raise
+                if connectionString not in self._probes:
+                    # A new connection works, so a probe that fails on it
+                    # is one the server doesn't understand
+                    self._probes[connectionString] = self._findProbe(connection)
+                with self._lock:
+                    self.stats['opened'] += 1
+                return connection
+
+            if time.monotonic() - since > self.maxIdle or not self._alive(connectionString, connection):
+                self._discard(connectionString, connection)
+                continue
+
+            with self._lock:
+                self.stats['reused'] += 1
+            return connection
+
+    def release(self, connectionString, connection, broken=False):
+        '''Returns a connection from acquire() to the pool, or closes it if it
+        is `broken`'''
+
+        if not broken:
+            # End any transaction the queries started, so no locks are held
+            # while the connection is idle
+            broken = not self._healthy(connection)
+
+        if broken:
+            self._discard(connectionString, connection)
+            return
+
+        with self._lock:
+            self._idle.setdefault(connectionString, deque()).append((connection, time.monotonic()))
+            self._lock.notify()
+
+    def closeIdle(self, connectionString=None):
+        '''Closes every idle connection, or those for `connectionString`.
+        Connections in use are unaffected'''
+
+        with self._lock:
+            idle = [
+                (cs, c) for cs, connections in self._idle.items() for c, _ in connections
+                if connectionString is None or cs == connectionString]
+            for cs, _ in idle:
+                self._idle.pop(cs, None)
+            for cs, _ in idle:
+                self._open[cs] -= 1
+            self.stats['closed'] += len(idle)
+            self._lock.notify_all()
+
+        for _, connection in idle:
+            self._close(connection)
+
+
+# The pool shared by all suites in this process
+_defaultPool = None
+_defaultPoolLock = threading.Lock()
+
+
+def getPool():
+    global _defaultPool
+    with _defaultPoolLock:
+        if _defaultPool is None:
+            _defaultPool = ConnectionPool()
+        return _defaultPool
+
+
+def setPool(pool):
+    '''Replaces the shared pool, for example with one using FakeDbApi'''
+
+    global _defaultPool
+    with _defaultPoolLock:
+        _defaultPool = pool
+
+
+def connection(connectionString):
+    '''Returns a context manager holding a connection from the shared pool'''
+
+    return getPool().connection(connectionString)
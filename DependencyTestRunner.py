@@ -0,0 +1,139 @@
+﻿from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from DependencyTestResult import DependencyTestResult
+
+import time
+import traceback
+
+import DocumentTemplatesTest
+import LetterDataQueriesTest
+import RemoteCache
+import TablePermissionsTest
+import TableStructureTest
+import WorkflowMapsTest
+
+
+# Suite name -> (module, names of the target values passed to process()
+# after allConfigs and path). Suites that don't take db2Region give the
+# same answer for every region of an environment, so they are run once
+# per environment and their result is shared.
+SUITES = OrderedDict([
+    ('Document Templates', (DocumentTemplatesTest, ())),
+    ('Table Permissions', (TablePermissionsTest, ('db2Region', 'userId'))),
+    ('Table Structure', (TableStructureTest, ('db2Region',))),
+    ('Workflow Maps', (WorkflowMapsTest, ())),
+    ('Letter Data Queries', (LetterDataQueriesTest, ('db2Region',))),
+])
+
+DEFAULT_MAX_WORKERS = 16
+
+
+class TestTarget(object):
+    '''One region/environment to check: its configs, the path of the requested
+    dependencies, the DB2 region and the user id that the application runs as'''
+
+    def __init__(self, name, allConfigs, path, db2Region=None, userId=None):
+        self.name = name
+        self.allConfigs = allConfigs
+        self.path = path
+        self.db2Region = db2Region
+        self.userId = userId
+
+
+def _jobKey(suiteName, target, argNames):
+    # Targets that share the same configs object and path are the same
+    # environment, so only the region-specific arguments tell jobs apart
+    return (suiteName, id(target.allConfigs), target.path) + tuple(getattr(target, n) for n in argNames)
+
+
+def _runSuite(suiteName, module, args):
+    '''Runs one suite, turning any exception into a failed result so that the
+    other suites still finish'''
+
+    try:
+        return module.process(*args)
+    except Exception as ex:
+        result = DependencyTestResult()
+        result.Name = suiteName
+        result.Passed = False
+        result.FailureData = ex
+        result.OutputText = 'Error running {}: {}\n{}'.format(suiteName, ex, traceback.format_exc())
+        return result
+
+
+def run(targets, suites=None, maxWorkers=DEFAULT_MAX_WORKERS, useCache=True):
+    '''Runs the dependency suites for every target concurrently.
+
+    Returns an OrderedDict of target name -> list of DependencyTestResult,
+    in the order of `targets` and of SUITES. `suites` limits the run to
+    those suite names. With `useCache` False, every lookup asks the remote
+    systems again rather than using an answer from RemoteCache, and the
+    new answers are cached.'''
+
+    suiteNames = [name for name in SUITES.keys() if suites is None or name in suites]
+
+    cache = RemoteCache.getCache()
+    refresh = cache is not None and not useCache
+    if refresh:
+        cache.refresh = True
+    try:
+        return _run(targets, suiteNames, maxWorkers)
+    finally:
+        if refresh:
+            cache.refresh = False
+
+
+def _run(targets, suiteNames, maxWorkers):
+    # Every suite spends its time waiting on a database or API, so the
+    # jobs run in threads and the total time is close to that of the
+    # slowest job rather than the sum of all of them
+    futures = {}
+    plan = []
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        for target in targets:
+            for suiteName in suiteNames:
+                module, argNames = SUITES[suiteName]
+                key = _jobKey(suiteName, target, argNames)
+                if key not in futures:
+                    args = (target.allConfigs, target.path) + tuple(getattr(target, n) for n in argNames)
+                    futures[key] = executor.submit(_runSuite, suiteName, module, args)
+                plan.append((target.name, futures[key]))
+
+        results = OrderedDict((target.name, []) for target in targets)
+        for targetName, future in plan:
+            results[targetName].append(future.result())
+
+    return results
+
+
+def getOutputText(results: OrderedDict):
+    lines = []
+
+    for targetName, targetResults in results.items():
+        failed = [r for r in targetResults if not r.Passed]
+        lines.append('{}: {} of {} suites passed'.format(
+            targetName,
+            len(targetResults) - len(failed),
+            len(targetResults)))
+
+        for result in failed:
+            if result.OutputText:
+                lines.append(result.OutputText)
+
+    # How many of the remote lookups were answered from the local cache, and
+    # how old those answers were
+    cache = RemoteCache.getCache()
+    if cache is not None and cache.stats:
+        oldest = [s['oldest'] for s in cache.stats.values() if s.get('oldest') is not None]
+        if oldest:
+            lines.append('Some results are based on cached answers up to {} old; run with useCache=False to refresh them'.format(
+                RemoteCache.describeAge(time.time() - min(oldest))))
+        lines.append(RemoteCache.getOutputText(cache.stats))
+
+    txt = '\n'.join(lines)
+
+    return txt
+
+
+def allPassed(results: OrderedDict):
+    return all(r.Passed for targetResults in results.values() for r in targetResults)
@@ -0,0 +1,201 @@
+﻿'''A local stand-in for the ThunderheadNow and SmartCommunications APIs, for
+testing and benchmarking DocumentTemplatesTest without the real systems.
+
+The server answers, as JSON:
+    GET /thunderhead/documents                   [{"name", "id"}, ...]
+    GET /thunderhead/documents/<id>/versions     [{"versionMajor", "versionMinor", "versionRevision"}, ...]
+    GET /smartcomm/search?type=<type>            [{"itemName", "itemId"}, ...]
+    GET /smartcomm/items/<id>/versions           (as for thunderhead)
+after a simulated round-trip latency, and responds 429 with Retry-After once
+more than --rate-limit requests per second are made.
+
+ThunderheadClient and SmartCommClient have the same functions as the
+ThunderheadNowAPI and SmartCommAPI modules, so they can stand in for them.
+Run this module to compare loading the templates one request at a time
+(as before) with the concurrent loader:
+
+    python DocumentApiStub.py --documents 2000 --latency 0.02
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+
+
+class StubApiServer(ThreadingHTTPServer):
+    '''Serves `documents` templates from each system, with versions for every
+    other one'''
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), documents=1000, latency=0.02, rateLimit=None, seed=0):
+        super(StubApiServer, self).__init__(address, _StubHandler)
+        self.latency = latency
+        self.rateLimit = rateLimit
+        self.requests = 0
+        self.rateLimited = 0
+        self._lock = threading.Lock()
+        self._window = (0, 0)
+
+        rng = random.Random(seed)
+        self.documents = {}
+        self.versions = {}
+        for system in ('thunderhead', 'smartcomm'):
+            for i in range(documents):
+                id = '{}-{}'.format(system, i)
+                self.documents.setdefault(system, []).append(('DOC{:05d}'.format(i), id))
+                self.versions[id] = [
+                    {'versionMajor': rng.randrange(4), 'versionMinor': rng.randrange(12), 'versionRevision': rng.randrange(30)}
+                    for _ in range(rng.randrange(1, 6))]
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    def _admit(self):
+        '''Counts a request and returns False if it is over the rate limit'''
+
+        with self._lock:
+            self.requests += 1
+            if not self.rateLimit:
+                return True
+            second = int(time.monotonic())
+            start, count = self._window
+            if start != second:
+                start, count = second, 0
+            self._window = (start, count + 1)
+            if count < self.rateLimit:
+                return True
+            self.rateLimited += 1
+            return False
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, headers=()):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        if not server._admit():
+            self._send(429, {'error': 'rate limited'}, [('Retry-After', '1')])
+            return
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        parts = urlparse(self.path).path.strip('/').split('/')
+        if parts == ['thunderhead', 'documents']:
+            self._send(200, [{'name': name, 'id': id} for name, id in server.documents['thunderhead']])
+        elif parts == ['smartcomm', 'search']:
+            self._send(200, [{'itemName': name, 'itemId': id} for name, id in server.documents['smartcomm']])
+        elif len(parts) == 4 and parts[3] == 'versions' and parts[2] in server.versions:
+            self._send(200, server.versions[parts[2]])
+        else:
+            self._send(404, {'error': 'not found'})
+
+
+def _get(url):
+    with urlopen(url) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+class ThunderheadClient(object):
+    '''Calls the stub server with the functions of ThunderheadNowAPI'''
+
+    def __init__(self, url):
+        self.url = url
+
+    def searchForDocuments(self, configs):
+        return [SimpleNamespace(**doc) for doc in _get(self.url + '/thunderhead/documents')]
+
+    def getVersions(self, configs, id):
+        return _get('{}/thunderhead/documents/{}/versions'.format(self.url, id))
+
+
+class SmartCommClient(object):
+    '''Calls the stub server with the functions of SmartCommAPI'''
+
+    def __init__(self, url):
+        self.url = url
+
+    def searchByType(self, configs, type):
+        return _get('{}/smartcomm/search?type={}'.format(self.url, type))
+
+    def getVersions(self, configs, id):
+        return _get('{}/smartcomm/items/{}/versions'.format(self.url, id))
+
+
+def main(argv=None):
+    import DocumentTemplatesTest
+    import RemoteCache
+
+    parser = argparse.ArgumentParser(description='Benchmark DocumentTemplatesTest against a stub API server')
+    parser.add_argument('--documents', type=int, default=1000, help='templates in each system')
+    parser.add_argument('--versioned', type=float, default=0.5, help='share of the templates requested with a version')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per request')
+    parser.add_argument('--rate-limit', type=int, help='requests per second before the server responds 429')
+    parser.add_argument('--workers', type=int, default=DocumentTemplatesTest.MAX_WORKERS)
+    args = parser.parse_args(argv)
+
+    server = StubApiServer(documents=args.documents, latency=args.latency, rateLimit=args.rate_limit)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    DocumentTemplatesTest.ThunderheadNowAPI = ThunderheadClient(server.url)
+    DocumentTemplatesTest.SmartCommAPI = SmartCommClient(server.url)
+    DocumentTemplatesTest.MAX_WORKERS = args.workers
+
+    # Every lookup should reach the server
+    RemoteCache.setCache(None)
+
+    rng = random.Random(1)
+    versionedDocCodes = set(
+        'DOC{:05d}'.format(i) for i in range(args.documents) if rng.random() < args.versioned)
+    print('{} templates in each system, {} with versions requested, {:.0f} ms per request'.format(
+        args.documents, len(versionedDocCodes), args.latency * 1000))
+
+    # One request at a time, one system after the other, as before
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=1) as one:
+        serial = DocumentTemplatesTest.get_thunderheadNow_templates({}, versionedDocCodes, one)
+        serial.update(DocumentTemplatesTest.get_smartCommunications_templates({}, versionedDocCodes, one))
+    serialTime = time.perf_counter() - start
+    print('  serial:     {:.2f}s'.format(serialTime))
+
+    server.requests = server.rateLimited = 0
+    start = time.perf_counter()
+    concurrent = DocumentTemplatesTest.get_loaded_templates({}, {}, versionedDocCodes)
+    concurrentTime = time.perf_counter() - start
+    print('  concurrent: {:.2f}s with {} workers ({:.1f}x faster, {} requests rate limited)'.format(
+        concurrentTime, args.workers, serialTime / concurrentTime, server.rateLimited))
+
+    server.shutdown()
+
+    if serial != concurrent:
+        print('  MISMATCH: the serial and concurrent loaders found different templates')
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
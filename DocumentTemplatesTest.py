@@ -1,10 +1,14 @@
 ﻿from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from DependencyTestResult import DependencyTestResult
 from SqlDbConnection import SqlDbConnection
 from packaging import version as pkgVersion
 
 import ConfigMapper
 import ListUtilities
+import random
+import RemoteCache
+import time
 import xmltodict
 import XMLDataCrawler
 import SmartCommAPI
@@ -12,6 +16,90 @@ import ThunderheadNowAPI
 import FormattedText
 
 
+# Version lookups run this many at a time, shared between ThunderheadNow and
+# SmartCommunications
+MAX_WORKERS = 8
+
+# Requests that are rate limited (HTTP 429) are retried up to this many times,
+# waiting for the server's Retry-After or an exponential backoff with jitter
+RATE_LIMIT_RETRIES = 6
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+
+def _rate_limit_delay(ex):
+    '''Returns the seconds to wait if `ex` is an HTTP 429 response (from
+    requests or urllib), 0 if the server didn't say, or None for other errors'''
+
+    response = getattr(ex, 'response', None)
+    status = getattr(response, 'status_code', None) or getattr(ex, 'code', None) or getattr(ex, 'status', None)
+    if status != 429:
+        return None
+
+    headers = getattr(response, 'headers', None) or getattr(ex, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After', 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def call_with_backoff(func, *args):
+    '''Calls func(*args), retrying while the API reports that it is rate limited'''
+
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        try:
+            return func(*args)
+        except Exception as ex:
+            delay = _rate_limit_delay(ex)
+            if delay is None or attempt == RATE_LIMIT_RETRIES:
+                raise
+            backoff = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+            time.sleep(max(delay, random.uniform(backoff / 2, backoff)))
+
+
+def max_version(versionResults):
+    '''Returns the highest of the major.minor.revision versions in
+    `versionResults` as a string, or '0.0.0' if there are none'''
+
+    versions = [(v['versionMajor'], v['versionMinor'], v['versionRevision']) for v in versionResults]
+
+    if all(_is_plain_int(part) for version in versions for part in version):
+        # Comparing tuples of ints orders versions the same way as parsing each
+        # one with packaging.version, without building a Version object per
+        # result
+        maxVersion = max((tuple(int(part) for part in version) for version in versions), default=(0, 0, 0))
+        return '{}.{}.{}'.format(*maxVersion)
+
+    # Anything else (such as '2rc1') is left to packaging.version
+    maxVersion = max(
+        (pkgVersion.parse('{}.{}.{}'.format(*version)) for version in versions), default=pkgVersion.parse('0.0.0'))
+    return maxVersion.base_version
+
+
+def _is_plain_int(value):
+    '''Returns True if `value` is an int, or a string of decimal digits'''
+
+    if isinstance(value, int) and not isinstance(value, bool):
+        return True
+    return isinstance(value, str) and value.strip().isdigit()
+
+
+def _cached_call(source, func, *args):
+    '''Calls func(*args) with backoff, or returns its cached answer'''
+
+    return RemoteCache.cached(source, (func.__name__,) + args, lambda: call_with_backoff(func, *args))
+
+
+def _fetch_versions(executor, source, getVersions, configs, ids):
+    '''Fetches the versions of every docCode -> id in `ids` with `executor`
+    and returns a dict of docCode -> max version'''
+
+    futures = OrderedDict(
+        (docCode, executor.submit(_cached_call, source, getVersions, configs, id)) for docCode, id in ids.items())
+
+    return {docCode: max_version(future.result()) for docCode, future in futures.items()}
+
+
 def parse_xml(xml_path):
     '''Parse XML files in path for <documentTemplate> nodes'''
 
@@ -30,41 +118,57 @@ def parse_xml(xml_path):
     return requestedTemplates
 
 
-def get_thunderheadNow_templates(thunderheadConfigs:dict, versionedDocCodes:list):
+class OwnedExecutor(object):
+    '''Uses the given executor, or a new one that is shut down afterwards'''
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.owned = None
+
+    def __enter__(self):
+        if self.executor is not None:
+            return self.executor
+        self.owned = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+        return self.owned
+
+    def __exit__(self, *exc):
+        if self.owned is not None:
+            self.owned.shutdown()
+        return False
+
+
+def get_thunderheadNow_templates(thunderheadConfigs:dict, versionedDocCodes:set, executor=None):
     
-    documents = ThunderheadNowAPI.searchForDocuments(thunderheadConfigs)
+    # Only the names and ids are kept, so the search can be cached
+    documents = RemoteCache.cached(
+        'ThunderheadNow',
+        ('searchForDocuments', thunderheadConfigs),
+        lambda: [(doc.name, doc.id) for doc in call_with_backoff(ThunderheadNowAPI.searchForDocuments, thunderheadConfigs)])
     
     loadedTemplates = {}
+    versionedIds = OrderedDict()
 
-    for doc in documents:
-        docCode = doc.name
-        id = doc.id
+    for docCode, id in documents:
 
         loadedTemplates[docCode] = {}
         loadedTemplates[docCode]['id'] = id
         
         if docCode in versionedDocCodes:
-            maxVersion = pkgVersion.parse('0.0.0')
-
-            versionResults = ThunderheadNowAPI.getVersions(thunderheadConfigs, id)
-            for version in versionResults:
-                thisVersion = pkgVersion.parse('{}.{}.{}'.format(
-                    version['versionMajor'],
-                    version['versionMinor'],
-                    version['versionRevision']))
-                if thisVersion > maxVersion:
-                    maxVersion = thisVersion
-            
-            loadedTemplates[docCode]['version'] = maxVersion.base_version
+            versionedIds[docCode] = id
+
+    with OwnedExecutor(executor) as pool:
+        for docCode, version in _fetch_versions(pool, 'ThunderheadNow', ThunderheadNowAPI.getVersions, thunderheadConfigs, versionedIds).items():
+            loadedTemplates[docCode]['version'] = version
 
     return loadedTemplates
 
 
-def get_smartCommunications_templates(smartCommConfigs:dict, versionedDocCodes:list):
+def get_smartCommunications_templates(smartCommConfigs:dict, versionedDocCodes:set, executor=None):
     
-    searchResults = SmartCommAPI.searchByType(smartCommConfigs, 'application/x-thunderhead-ddv')
+    searchResults = _cached_call('SmartCommunications', SmartCommAPI.searchByType, smartCommConfigs, 'application/x-thunderhead-ddv')
     
     loadedTemplates = {}
+    versionedIds = OrderedDict()
 
     for doc in searchResults:
         docCode = doc['itemName']
@@ -74,18 +178,29 @@ def get_smartCommunications_templates(smartCommConfigs:dict, versionedDocCodes:l
         loadedTemplates[docCode]['id'] = id
                 
         if docCode in versionedDocCodes:
-            maxVersion = pkgVersion.parse('0.0.0')
+            versionedIds[docCode] = id
+
+    with OwnedExecutor(executor) as pool:
+        for docCode, version in _fetch_versions(pool, 'SmartCommunications', SmartCommAPI.getVersions, smartCommConfigs, versionedIds).items():
+            loadedTemplates[docCode]['version'] = version
+
+    return loadedTemplates
 
-            versionResults = SmartCommAPI.getVersions(smartCommConfigs, id)
-            for version in versionResults:
-                thisVersion = pkgVersion.parse('{}.{}.{}'.format(
-                    version['versionMajor'],
-                    version['versionMinor'],
-                    version['versionRevision']))
-                if thisVersion > maxVersion:
-                    maxVersion = thisVersion
 
-            loadedTemplates[docCode]['version'] = maxVersion.base_version
+def get_loaded_templates(thunderheadConfigs:dict, smartCommConfigs:dict, versionedDocCodes:set):
+    '''Returns the templates loaded in ThunderheadNow and SmartCommunications,
+    with SmartCommunications taking precedence'''
+
+    # Both systems are searched at the same time, and their version lookups
+    # share one bounded pool.  The searches get their own threads so they never
+    # wait behind the lookups they start.
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as versionPool, ThreadPoolExecutor(max_workers=2) as searchPool:
+        thFuture = searchPool.submit(get_thunderheadNow_templates, thunderheadConfigs, versionedDocCodes, versionPool)
+        scFuture = searchPool.submit(get_smartCommunications_templates, smartCommConfigs, versionedDocCodes, versionPool)
+
+        loadedTemplates = thFuture.result()
+
+        loadedTemplates.update(scFuture.result())
 
     return loadedTemplates
 
@@ -145,14 +260,13 @@ def process(allConfigs, path):
     requestedTemplates = parse_xml(path)
     result.Count = len(requestedTemplates)
     
-    versionedDocCodes = []
-    for docCode, version in requestedTemplates.items():
-        if version is not None:
-            versionedDocCodes.append(docCode)
-
-    loadedTemplates = get_thunderheadNow_templates(thConfigs, versionedDocCodes)
+    # Only templates with a minimum version need their versions looked up
+    versionedDocCodes = set()
+    for docCode, template in requestedTemplates.items():
+        if 'version' in template:
+            versionedDocCodes.add(docCode)
 
-    loadedTemplates.update(get_smartCommunications_templates(scConfigs, versionedDocCodes))
+    loadedTemplates = get_loaded_templates(thConfigs, scConfigs, versionedDocCodes)
 
     result.FailureData = compare_results(requestedTemplates, loadedTemplates)
 
@@ -0,0 +1,159 @@
+﻿'''A DB-API 2.0 driver that needs no database, for testing the suites locally.
+
+Queries are answered from canned results registered with setResult(), by
+regular expression:
+
+    import ConnectionPool, FakeDbApi
+
+    FakeDbApi.setResult(r'FROM sysibm\.systables', [('DBA', 'ACCOUNT', 'ID')])
+    FakeDbApi.CONNECT_DELAY = 0.5
+    ConnectionPool.setPool(ConnectionPool.ConnectionPool(driver=FakeDbApi))
+
+CONNECT_DELAY and QUERY_DELAY simulate the latency of a real server, stats
+counts the connections and queries made, and breakConnections() makes every
+open connection fail as if the server had dropped it.
+'''
+
+import re
+import threading
+import time
+
+
+apilevel = '2.0'
+threadsafety = 1
+paramstyle = 'qmark'
+
+# Seconds taken to open a connection and to run a query
+CONNECT_DELAY = 0.0
+QUERY_DELAY = 0.0
+
+
+class Error(Exception):
+    pass
+
+
+class InterfaceError(Error):
+    pass
+
+
+class DatabaseError(Error):
+    pass
+
+
+class OperationalError(DatabaseError):
+    pass
+
+
+class ProgrammingError(DatabaseError):
+    pass
+
+
+_lock = threading.Lock()
+_results = []
+_generation = 0
+
+stats = {'connects': 0, 'queries': 0}
+
+
+def setResult(pattern, rows):
+    '''Answers queries matching the regular expression `pattern` with `rows`,
+    or with rows(query, params) if `rows` is callable'''
+
+    with _lock:
+        _results.insert(0, (re.compile(pattern, re.IGNORECASE | re.DOTALL), rows))
+
+
+def reset():
+    '''Forgets all results and statistics'''
+
+    global _generation
+    with _lock:
+        del _results[:]
+        _generation += 1
+        stats['connects'] = 0
+        stats['queries'] = 0
+
+
+def breakConnections():
+    '''Makes every connection opened so far fail on its next use'''
+
+    global _generation
+    with _lock:
+        _generation += 1
+
+
+def connect(connectionString):
+    if CONNECT_DELAY:
+        time.sleep(CONNECT_DELAY)
+    with _lock:
+        stats['connects'] += 1
+    return Connection(connectionString)
+
+
+class Connection(object):
+
+    def __init__(self, connectionString):
+        self.connectionString = connectionString
+        self.closed = False
+        self._generation = _generation
+
+    def _check(self):
+        if self.closed:
+            raise InterfaceError('connection is closed')
+        if self._generation != _generation:
+            raise OperationalError('communication link failure')
+
+    def cursor(self):
+        self._check()
+        return Cursor(self)
+
+    def commit(self):
+        self._check()
+
+    def rollback(self):
+        self._check()
+
+    def close(self):
+        self.closed = True
+
+
+class Cursor(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rowcount = -1
+        self._rows = []
+
+    def execute(self, query, params=None):
+        self.connection._check()
+        if params is not None and query.count('?') != len(params):
+            raise ProgrammingError('query has {} parameter markers but {} parameters were given'.format(
+                query.count('?'), len(params)))
+
+        if QUERY_DELAY:
+            time.sleep(QUERY_DELAY)
+
+        with _lock:
+            stats['queries'] += 1
+            results = list(_results)
+
+        for pattern, rows in results:
+            if pattern.search(query):
+                self._rows = list(rows(query, params) if callable(rows) else rows)
+                break
+        else:
+            raise ProgrammingError('no result registered for query: {}'.format(query))
+
+        self.rowcount = len(self._rows)
+        return self
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        self._rows = []
@@ -3,10 +3,10 @@ import os
 
 from collections import OrderedDict
 from DependencyTestResult import DependencyTestResult
-from SqlDbConnection import SqlDbConnection
 
 import ConfigMapper
 import ListUtilities
+import RemoteCache
 import xmltodict
 import XMLDataCrawler
 
@@ -30,8 +30,7 @@ def get_loaded_data_queries(db2Configs):
 
     results = None
 
-    with SqlDbConnection(connection_string) as sql:
-        results = sql.select('SELECT DOC_ID from dba.CORT_LETTER_QUERY_seq')
+    results = RemoteCache.cachedSelect('Letter Data Queries', connection_string, 'SELECT DOC_ID from dba.CORT_LETTER_QUERY_seq')
 
     givenDocs = []
 
@@ -0,0 +1,466 @@
+﻿'''A local cache of the remote lookups made by the dependency suites.
+
+The suites ask ThunderheadNow, SmartCommunications and the DB2 and SQL Server
+catalogs the same questions every time they run, and a region is often checked
+many times an hour from different pipelines.  Each answer is kept in a SQLite
+database on local disk for the TTL of its source (TTLS), so repeated runs read
+it locally instead of asking again:
+
+    rows = RemoteCache.cachedSelect('DB2 Catalog', connectionString, query)
+    docs = RemoteCache.cached('ThunderheadNow', ('search', configs), fetch)
+
+Every process on the machine shares the database.  When several processes or
+threads miss on the same key at once, a lock file makes all but one of them
+wait for its answer rather than asking the remote system themselves.
+
+Keys are stored as hashes, so connection strings and credentials never reach
+the cache file.  Values are stored as JSON, so reading the cache never runs
+code: tuples come back as lists, dates and decimals are tagged (see
+_encodeValue), and answers that can't be stored as JSON are not cached.  The
+database is kept in a directory of the user's own cache directory that only
+they can open, and its files are only readable by them.
+
+Set the APP_DEPENDENCY_CACHE environment variable to the path of the database,
+or to 'off' to disable caching.  DependencyTestRunner.run(useCache=False) asks
+every remote system again and replaces the cached answers, and its output says
+how old the cached answers it used were.  From the command line:
+
+    python RemoteCache.py stats
+    python RemoteCache.py invalidate [--source "DB2 Catalog"]
+    python RemoteCache.py purge
+'''
+
+from contextlib import contextmanager
+from decimal import Decimal
+
+import argparse
+import ConnectionPool
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+
+def _userCacheDirectory():
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'app_dependency_cache')
+
+
+DEFAULT_PATH = os.path.join(_userCacheDirectory(), 'cache.sqlite')
+
+# Permissions of the default cache directory and of every cache file
+DIRECTORY_MODE = 0o700
+FILE_MODE = 0o600
+
+# Seconds that an answer from each source stays fresh.  Sources that aren't
+# listed use DEFAULT_TTL, and a TTL of 0 turns off caching for that source.
+TTLS = {
+    'ThunderheadNow': 15 * 60,
+    'SmartCommunications': 15 * 60,
+    'DB2 Catalog': 60 * 60,
+    'RACF Permissions': 10 * 60,
+    'Workflow Maps': 10 * 60,
+    'Letter Data Queries': 10 * 60,
+}
+DEFAULT_TTL = 5 * 60
+
+# Keys are spread over this many locks, so misses on different keys rarely
+# wait for each other
+LOCK_SLOTS = 64
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    source TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    created REAL NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (source, key)
+);
+CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires);
+
+CREATE TABLE IF NOT EXISTS stats (
+    source TEXT PRIMARY KEY,
+    hits INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0
+);
+'''
+
+
+def makeKey(keyParts):
+    '''Returns a hash of `keyParts`, which may hold any JSON-like values'''
+
+    text = json.dumps(keyParts, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+# Types that database rows commonly hold besides JSON's own, tagged so they
+# come back as the same type
+_TAGGED = {
+    'datetime': (datetime.datetime, datetime.datetime.isoformat, datetime.datetime.fromisoformat),
+    'date': (datetime.date, datetime.date.isoformat, datetime.date.fromisoformat),
+    'decimal': (Decimal, str, Decimal),
+}
+
+
+def _encodeValue(value):
+    # datetime is a subclass of date, so it is checked first
+    for tag, (cls, encode, _) in _TAGGED.items():
+        if isinstance(value, cls):
+            return {'__cached__': tag, 'value': encode(value)}
+    raise TypeError('{} values are not cached'.format(type(value).__name__))
+
+
+def _decodeValue(obj):
+    tag = obj.get('__cached__')
+    if tag in _TAGGED and len(obj) == 2:
+        return _TAGGED[tag][2](obj['value'])
+    return obj
+
+
+def dumpValue(value):
+    '''Returns `value` as JSON text.  Raises TypeError or ValueError if it
+    can't be stored'''
+
+    return json.dumps(value, default=_encodeValue, allow_nan=False)
+
+
+def loadValue(text):
+    return json.loads(text, object_hook=_decodeValue)
+
+
+def _createPrivate(path):
+    '''Creates the file at `path` if it doesn't exist, readable only by this
+    user, and returns an open descriptor for it'''
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, FILE_MODE)
+    if os.name != 'nt':
+        # A file created by an older version may be readable by others
+        os.fchmod(fd, FILE_MODE)
+    return fd
+
+
+class _LockFile(object):
+    '''Exclusive locks on single bytes of a file, held by one thread of one
+    process at a time'''
+
+    def __init__(self, path, slots):
+        self.fd = _createPrivate(path)
+        self.threadLocks = [threading.Lock() for _ in range(slots)]
+        # msvcrt locks at the file position, which is shared by all threads
+        self.seekLock = threading.Lock()
+
+    def _lock(self, slot):
+        if os.name == 'nt':
+            import msvcrt
+            while True:
+                with self.seekLock:
+                    os.lseek(self.fd, slot, os.SEEK_SET)
+                    try:
+                        msvcrt.locking(self.fd, msvcrt.LK_NBLCK, 1)
+                        return
+                    except OSError:
+                        pass
+                time.sleep(0.05)
+        else:
+            import fcntl
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, slot, os.SEEK_SET)
+
+    def _unlock(self, slot):
+        if os.name == 'nt':
+            import msvcrt
+            with self.seekLock:
+                os.lseek(self.fd, slot, os.SEEK_SET)
+                msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, slot, os.SEEK_SET)
+
+    @contextmanager
+    def locked(self, slot):
+        # Locks on a file belong to the process, so threads of this process
+        # are kept apart by a thread lock first
+        with self.threadLocks[slot]:
+            self._lock(slot)
+            try:
+                yield
+            finally:
+                self._unlock(slot)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class RemoteCache(object):
+    '''A TTL cache of remote lookups in the SQLite database at `path`'''
+
+    def __init__(self, path=DEFAULT_PATH, ttls=None, defaultTtl=DEFAULT_TTL):
+        self.path = path
+        self.ttls = dict(TTLS if ttls is None else ttls)
+        self.defaultTtl = defaultTtl
+
+        if os.path.abspath(path) == os.path.abspath(DEFAULT_PATH):
+            directory = os.path.dirname(path)
+            os.makedirs(directory, DIRECTORY_MODE, exist_ok=True)
+            if os.name != 'nt':
+                os.chmod(directory, DIRECTORY_MODE)
+
+        # SQLite gives its -wal and -shm files the permissions of the
+        # database file, so creating that one privately is enough
+        os.close(_createPrivate(path))
+
+        self._local = threading.local()
+        self._lockFile = _LockFile(path + '.lock', LOCK_SLOTS)
+        self._statsLock = threading.Lock()
+
+        # While set, every lookup asks the remote system again and caches
+        # the new answer
+        self.refresh = False
+
+        # Hits and misses in this process, by source, and the time the
+        # oldest answer that was used was cached
+        self.stats = {}
+
+        with self._db() as db:
+            db.executescript(SCHEMA)
+
+    def _db(self):
+        # sqlite3 connections can't be shared between threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            # A crash may lose the last few answers, which are simply fetched
+            # again, but commits don't wait for the disk
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def ttl(self, source):
+        return self.ttls.get(source, self.defaultTtl)
+
+    def _count(self, source, hit, created=None):
+        column = 'hits' if hit else 'misses'
+        with self._statsLock:
+            counts = self.stats.setdefault(source, {'hits': 0, 'misses': 0, 'oldest': None})
+            counts[column] += 1
+            if created is not None and (counts['oldest'] is None or created < counts['oldest']):
+                counts['oldest'] = created
+        with self._db() as db:
+            db.execute(
+                'INSERT INTO stats (source, {0}) VALUES (?, 1) '
+                'ON CONFLICT (source) DO UPDATE SET {0} = {0} + 1'.format(column),
+                (source,))
+
+    def _lookup(self, source, key):
+        if self.refresh:
+            return None
+        row = self._db().execute(
+            'SELECT value, created FROM entries WHERE source = ? AND key = ? AND expires > ?',
+            (source, key, time.time())).fetchone()
+        if row is None:
+            return None
+        try:
+            return loadValue(row[0]), row[1]
+        except ValueError:
+            # Written by an older version that pickled its answers
+            return None
+
+    def getOrFetch(self, source, keyParts, fetch):
+        '''Returns the cached answer for `keyParts` from `source`, or calls
+        fetch() and caches what it returns'''
+
+        ttl = self.ttl(source)
+        if not ttl:
+            return fetch()
+
+        key = makeKey(keyParts)
+        found = self._lookup(source, key)
+        if found is None:
+            with self._lockFile.locked(int(key[:8], 16) % LOCK_SLOTS):
+                # Another thread or process may have fetched it while this
+                # one waited for the lock
+                found = self._lookup(source, key)
+                if found is None:
+                    value = fetch()
+                    self._count(source, False)
+                    try:
+                        text = dumpValue(value)
+                    except (TypeError, ValueError):
+                        return value
+                    now = time.time()
+                    with self._db() as db:
+                        db.execute(
+                            'INSERT OR REPLACE INTO entries (source, key, value, created, expires) VALUES (?, ?, ?, ?, ?)',
+                            (source, key, text, now, now + ttl))
+                    return value
+
+        self._count(source, True, found[1])
+        return found[0]
+
+    def invalidate(self, source=None, keyParts=None):
+        '''Removes the answer for `keyParts` from `source`, every answer from
+        `source`, or everything.  Returns the number of answers removed'''
+
+        if keyParts is not None and source is None:
+            raise ValueError('a source is needed to invalidate a single key')
+
+        with self._db() as db:
+            if keyParts is not None:
+                cursor = db.execute('DELETE FROM entries WHERE source = ? AND key = ?', (source, makeKey(keyParts)))
+            elif source is not None:
+                cursor = db.execute('DELETE FROM entries WHERE source = ?', (source,))
+            else:
+                cursor = db.execute('DELETE FROM entries')
+        return cursor.rowcount
+
+    def purgeExpired(self):
+        '''Removes expired answers and returns how many there were'''
+
+        with self._db() as db:
+            return db.execute('DELETE FROM entries WHERE expires <= ?', (time.time(),)).rowcount
+
+    def summary(self):
+        '''Returns a list of (source, live entries, expired entries, hits, misses)
+        for every source, with hits and misses counted across all processes'''
+
+        now = time.time()
+        db = self._db()
+        entries = {
+            source: (live, expired) for source, live, expired in db.execute(
+                'SELECT source, SUM(expires > ?), SUM(expires <= ?) FROM entries GROUP BY source', (now, now))}
+        counts = {source: (hits, misses) for source, hits, misses in db.execute('SELECT source, hits, misses FROM stats')}
+
+        return [
+            (source,) + entries.get(source, (0, 0)) + counts.get(source, (0, 0))
+            for source in sorted(set(entries) | set(counts))]
+
+    def resetStats(self):
+        with self._statsLock:
+            self.stats = {}
+        with self._db() as db:
+            db.execute('DELETE FROM stats')
+
+    def close(self):
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+        self._lockFile.close()
+
+
+def describeAge(seconds):
+    '''Returns a rough description of a number of seconds, such as 5 min'''
+
+    if seconds < 60:
+        return '{:.0f} s'.format(seconds)
+    if seconds < 2 * 60 * 60:
+        return '{:.0f} min'.format(seconds / 60)
+    return '{:.1f} h'.format(seconds / 3600)
+
+
+def getOutputText(stats: dict):
+    '''Describes the hits and misses in `stats` (RemoteCache.stats), and the
+    age of the oldest cached answer used from each source'''
+
+    lines = []
+    now = time.time()
+
+    for source in sorted(stats.keys()):
+        hits = stats[source]['hits']
+        misses = stats[source]['misses']
+        oldest = stats[source].get('oldest')
+        lines.append('{}: {} of {} lookups cached ({:.0%}){}'.format(
+            source,
+            hits,
+            hits + misses,
+            hits / float(hits + misses),
+            ', up to {} old'.format(describeAge(now - oldest)) if oldest is not None else ''))
+
+    txt = '\n'.join(lines)
+
+    return txt
+
+
+# The cache shared by all suites in this process, created on first use
+_UNSET = object()
+_defaultCache = _UNSET
+_defaultCacheLock = threading.Lock()
+
+
+def getCache():
+    '''Returns the shared cache, or None if caching is off'''
+
+    global _defaultCache
+    with _defaultCacheLock:
+        if _defaultCache is _UNSET:
+            path = os.environ.get('APP_DEPENDENCY_CACHE', DEFAULT_PATH)
+            _defaultCache = None if path.lower() == 'off' else RemoteCache(path)
+        return _defaultCache
+
+
+def setCache(cache):
+    '''Replaces the shared cache.  None turns caching off'''
+
+    global _defaultCache
+    with _defaultCacheLock:
+        _defaultCache = cache
+
+
+def cached(source, keyParts, fetch):
+    '''Returns fetch(), cached in the shared cache for the TTL of `source`'''
+
+    cache = getCache()
+    if cache is None:
+        return fetch()
+    return cache.getOrFetch(source, keyParts, fetch)
+
+
+def cachedSelect(source, connectionString, query, params=None):
+    '''Runs `query` on a pooled connection, or returns its cached rows'''
+
+    def select():
+        with ConnectionPool.connection(connectionString) as sql:
+            rows = sql.select(query, params)
+        # Driver rows are not JSON, but tuples of their values are
+        return [tuple(row) for row in rows] if rows is not None else None
+
+    return cached(source, (connectionString, query, params), select)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect or clear the cache of remote dependency lookups')
+    parser.add_argument('--path', default=os.environ.get('APP_DEPENDENCY_CACHE', DEFAULT_PATH))
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    commands.add_parser('stats', help='show the entries, hits and misses of each source')
+    invalidate = commands.add_parser('invalidate', help='remove cached answers')
+    invalidate.add_argument('--source', help='only remove answers from this source')
+    commands.add_parser('purge', help='remove expired answers')
+    args = parser.parse_args(argv)
+
+    cache = RemoteCache(args.path)
+    try:
+        if args.command == 'stats':
+            print('{:<24} {:>8} {:>8} {:>8} {:>8}'.format('source', 'live', 'expired', 'hits', 'misses'))
+            for row in cache.summary():
+                print('{:<24} {:>8} {:>8} {:>8} {:>8}'.format(*row))
+        elif args.command == 'invalidate':
+            print('Removed {} cached answers'.format(cache.invalidate(args.source)))
+        else:
+            print('Removed {} expired answers'.format(cache.purgeExpired()))
+    finally:
+        cache.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,152 @@
+﻿'''Benchmark of TablePermissionsTest.compare_results on large synthetic grant sets.
+
+Compares the permission index with the original loop, which tests every
+requested permission against every grant with fnmatch, and checks that both
+report the same failures.
+
+    python TablePermissionsBenchmark.py --grants 20000 --requests 500
+'''
+
+from TablePermissions import TablePermissions
+
+import argparse
+import fnmatch
+import random
+import sys
+import time
+
+import TablePermissionsTest
+
+
+SCHEMAS = ['DBA', 'OPERS', 'APP', 'ARCH', 'STAGE']
+ACTIONS = ['SELECT', 'INSERT', 'UPDATE', 'DELETE', 'IUD']
+
+
+def compare_results_loop(req_perm_list, given_perm_list):
+    '''The original O(requested x granted) comparison, kept as the reference'''
+
+    failures = []
+
+    for req in req_perm_list:
+        aggGivenRead = False
+        aggGivenCreate = False
+        aggGivenDelete = False
+        aggGivenUpdate = False
+
+        for given in given_perm_list:
+            if fnmatch.fnmatch(req.Schema, given.Schema):
+                if fnmatch.fnmatch(req.Table, given.Table):
+                    if given.Read is True:
+                        aggGivenRead = True
+                    if given.Update is True:
+                        aggGivenUpdate = True
+                    if given.Create is True:
+                        aggGivenCreate = True
+                    if given.Delete is True:
+                        aggGivenDelete = True
+
+        if req.Read is True:
+            if aggGivenRead is False:
+                failures.append(req)
+        if req.Update is True:
+            if aggGivenUpdate is False:
+                failures.append(req)
+        if req.Create is True:
+            if aggGivenCreate is False:
+                failures.append(req)
+        if req.Delete is True:
+            if aggGivenDelete is False:
+                failures.append(req)
+
+    return failures
+
+
+def make_permission(schema, table, action):
+    '''Builds a TablePermissions the same way get_db_permissions does'''
+
+    a = TablePermissions()
+    a.Schema = schema
+    a.Table = table
+    if action == 'SELECT':
+        a.Read = True
+    if action == 'INSERT':
+        a.Create = True
+    if action == 'UPDATE':
+        a.Update = True
+    if action == 'DELETE':
+        a.Delete = True
+    if action == 'IUD':
+        a.Create = True
+        a.Delete = True
+        a.Update = True
+    return a
+
+
+def make_grants(count, tables, wildcardShare, rng):
+    '''Returns `count` grants on tables T0000..T<tables>, of which about
+    `wildcardShare` use wildcards in the table or schema name'''
+
+    grants = []
+    for _ in range(count):
+        schema = rng.choice(SCHEMAS)
+        table = 'T{:04d}'.format(rng.randrange(tables))
+        if rng.random() < wildcardShare:
+            kind = rng.randrange(4)
+            if kind == 0:
+                table = table[:3] + '*'
+            elif kind == 1:
+                table = table[:4] + '?'
+            elif kind == 2:
+                table = table[:3] + '[0-4]*'
+            else:
+                schema = schema[0] + '*'
+        grants.append(make_permission(schema, table, rng.choice(ACTIONS)))
+    return grants
+
+
+def make_requests(count, tables, rng):
+    return [
+        make_permission(rng.choice(SCHEMAS), 'T{:04d}'.format(rng.randrange(tables)), rng.choice(ACTIONS))
+        for _ in range(count)]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the table permission comparison')
+    parser.add_argument('--grants', type=int, default=20000, help='number of granted permissions')
+    parser.add_argument('--requests', type=int, default=500, help='number of requested permissions')
+    parser.add_argument('--tables', type=int, default=5000, help='number of distinct table names')
+    parser.add_argument('--wildcards', type=float, default=0.05, help='share of grants that use wildcards')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-loop', action='store_true', help="don't time (or check against) the original loop")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    grants = make_grants(args.grants, args.tables, args.wildcards, rng)
+    requests = make_requests(args.requests, args.tables, rng)
+
+    print('{} requested permissions, {} grants ({:.0%} with wildcards)'.format(
+        len(requests), len(grants), args.wildcards))
+
+    indexed, indexedTime = timed(TablePermissionsTest.compare_results, requests, grants)
+    print('  index: {:.3f}s, {} failures'.format(indexedTime, len(indexed)))
+
+    if not args.skip_loop:
+        looped, loopTime = timed(compare_results_loop, requests, grants)
+        print('  loop:  {:.3f}s, {} failures ({:.0f}x slower)'.format(
+            loopTime, len(looped), loopTime / max(indexedTime, 1e-9)))
+
+        if [id(r) for r in indexed] != [id(r) for r in looped]:
+            print('  MISMATCH: the index and the loop report different failures')
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,27 @@
 ﻿from collections import OrderedDict
 from DependencyTestResult import DependencyTestResult
 from TablePermissions import TablePermissions
-from SqlDbConnection import SqlDbConnection
 
 import ConfigMapper
 import fnmatch
+import os
+import re
+import RemoteCache
 import XMLDataCrawler
 
 
+# Permission flags.  They are combined as bits so that all of the grants that
+# match a table can be merged with | and checked against a request with &
+READ = 1
+CREATE = 2
+UPDATE = 4
+DELETE = 8
+ALL_PERMISSIONS = READ | CREATE | UPDATE | DELETE
+
+# The order in which compare_results reports each missing permission
+PERMISSION_FLAGS = ((READ, 'Read'), (UPDATE, 'Update'), (CREATE, 'Create'), (DELETE, 'Delete'))
+
+
 def parse_xml(xml_path):
     '''Parse XML files in path for <tablePermissions> nodes'''
 
@@ -46,8 +60,7 @@ def get_db_permissions(sqlServerConfigs, db2Region, userId):
         #print('cs: {}'.format(connectionString))
         
         db_data = None
-        with SqlDbConnection(connectionString) as connection:
-            db_data = connection.select(query)
+        db_data = RemoteCache.cachedSelect('RACF Permissions', connectionString, query)
         
         givenPermissions = []
         db_permissions = []
@@ -78,39 +91,112 @@ def get_db_permissions(sqlServerConfigs, db2Region, userId):
         return givenPermissions
 
 
+def permission_mask(perm):
+    '''Returns the flags set on a TablePermissions object as a bitmask'''
+
+    mask = 0
+    for flag, name in PERMISSION_FLAGS:
+        if getattr(perm, name) is True:
+            mask |= flag
+    return mask
+
+
+def _is_pattern(name):
+    return '*' in name or '?' in name or '[' in name
+
+
+def _compile_patterns(patterns):
+    '''Compiles fnmatch patterns into a single function that matches any of them'''
+
+    return re.compile('|'.join('(?:{})'.format(fnmatch.translate(p)) for p in sorted(patterns))).match
+
+
+class PermissionIndex(object):
+    '''The granted permissions, indexed by schema and table.
+
+    lookup() gives the same answer as testing fnmatch.fnmatch(schema, grant.Schema)
+    and fnmatch.fnmatch(table, grant.Table) for every grant, but:
+      - grants without wildcards are found in a dict keyed by (schema, table)
+      - grants with wildcards are translated to regular expressions once, and
+        the table patterns that grant the same flags are combined into one
+        regular expression
+      - the flags of every grant are kept as a bitmask, so grants that add
+        nothing new are skipped'''
+
+    def __init__(self, given_perm_list):
+        # (schema, table) -> flags
+        self.exact = {}
+        # schema -> flags -> table patterns, for grants on an exact schema
+        tablePatterns = {}
+        # schema pattern -> flags -> table patterns (which may be exact names)
+        schemaPatterns = {}
+
+        for given in given_perm_list:
+            mask = permission_mask(given)
+            if not mask:
+                continue
+
+            # fnmatch ignores case on case-insensitive platforms, so do the same
+            schema = os.path.normcase(given.Schema)
+            table = os.path.normcase(given.Table)
+
+            if _is_pattern(schema):
+                schemaPatterns.setdefault(schema, {}).setdefault(mask, set()).add(table)
+            elif _is_pattern(table):
+                tablePatterns.setdefault(schema, {}).setdefault(mask, set()).add(table)
+            else:
+                self.exact[(schema, table)] = self.exact.get((schema, table), 0) | mask
+
+        self.tablePatterns = {
+            schema: [(mask, _compile_patterns(tables)) for mask, tables in byMask.items()]
+            for schema, byMask in tablePatterns.items()}
+
+        self.schemaPatterns = [
+            (_compile_patterns([schema]), [(mask, _compile_patterns(tables)) for mask, tables in byMask.items()])
+            for schema, byMask in schemaPatterns.items()]
+
+    def lookup(self, schema, table):
+        '''Returns the flags granted on schema.table by all matching grants'''
+
+        schema = os.path.normcase(schema)
+        table = os.path.normcase(table)
+
+        mask = self.exact.get((schema, table), 0)
+
+        for flags, match in self.tablePatterns.get(schema, ()):
+            if mask == ALL_PERMISSIONS:
+                return mask
+            if flags & ~mask and match(table):
+                mask |= flags
+
+        for matchSchema, tables in self.schemaPatterns:
+            if mask == ALL_PERMISSIONS:
+                return mask
+            if matchSchema(schema):
+                for flags, match in tables:
+                    if flags & ~mask and match(table):
+                        mask |= flags
+
+        return mask
+
+
 def compare_results(req_perm_list, given_perm_list):
+    '''Compare requested table permissions with what's been granted.  A request
+    is listed once for each permission that is missing'''
+
     failures = []
-    failure_results = []
+
+    index = PermissionIndex(given_perm_list)
+    granted = {}
 
     for req in req_perm_list:
-        aggGivenRead = False
-        aggGivenCreate = False
-        aggGivenDelete = False
-        aggGivenUpdate = False
+        key = (req.Schema, req.Table)
+        if key not in granted:
+            granted[key] = index.lookup(req.Schema, req.Table)
 
-        for given in given_perm_list:
-            if fnmatch.fnmatch(req.Schema, given.Schema):
-                if fnmatch.fnmatch(req.Table, given.Table):
-                    if given.Read is True:
-                        aggGivenRead = True
-                    if given.Update is True:
-                        aggGivenUpdate = True
-                    if given.Create is True:
-                        aggGivenCreate = True
-                    if given.Delete is True:
-                        aggGivenDelete = True
-
-        if req.Read is True:
-            if aggGivenRead is False:
-                failures.append(req)
-        if req.Update is True:
-            if aggGivenUpdate is False:
-                failures.append(req)
-        if req.Create is True:
-            if aggGivenCreate is False:
-                failures.append(req)
-        if req.Delete is True:
-            if aggGivenDelete is False:
+        missing = permission_mask(req) & ~granted[key]
+        for flag, name in PERMISSION_FLAGS:
+            if missing & flag:
                 failures.append(req)
 
     return failures
@@ -1,10 +1,11 @@
 ﻿from collections import OrderedDict
 from DependencyTestResult import DependencyTestResult
-from SqlDbConnection import SqlDbConnection
 from TableStructure import TableStructure
 
 import ConfigMapper
+import ConnectionPool
 import ListUtilities
+import RemoteCache
 import xmltodict
 import XMLDataCrawler
 
@@ -28,49 +29,103 @@ def parse_xml(xml_path):
     return requestedStructure
 
 
-def get_db_structure(db2Configs):
-    
-    connection_string = db2Configs['connection_string'].format_map(db2Configs)
-    
-    # TODO:  Convert to debug
-    #print('cs: {}'.format(connection_string))
+# Only tables in these schemas are checked; requests for any other schema fail
+CATALOG_SCHEMAS = ('DBA', 'OPERS')
+
+# Requested tables are looked up this many at a time, which keeps each query
+# well below DB2's limit on statement length
+TABLE_BATCH_SIZE = 200
+
+# Every table with its columns.  Tables without any columns are still
+# returned (with a NULL column) so that they count as present.
+STRUCTURE_QUERY = """SELECT t.Creator, t.Name, c.Name
+                     FROM sysibm.systables t
+                     LEFT JOIN sysibm.syscolumns c ON c.TBCreator = t.Creator AND c.TBName = t.Name
+                     WHERE {} WITH UR;"""
 
-    # Get all columns & convert to dictionary for in-memory lookup
-    c_results = None
-    with SqlDbConnection(connection_string) as sql:
-        c_results = sql.select('SELECT TBCreator, TBName, Name from sysibm.syscolumns where TBCreator IN (\'DBA\', \'OPERS\') WITH UR;')
 
-    columns = {}
-    for schema, table, column in c_results:
+def _structure_from_rows(rows, structure):
+    '''Adds (schema, table, column) catalog rows to `structure`, a dict of
+    'schema.table' -> TableStructure whose Columns are sets'''
+
+    for schema, table, column in rows:
         schema = schema.strip()
         table = table.strip()
-        column = column.strip()
-
         st = '{}.{}'.format(schema, table)
-        
-        if st not in columns.keys():
-            columns[st] = []
 
-        columns[st].append(column)
+        a = structure.get(st)
+        if a is None:
+            a = TableStructure()
+            a.Table = table
+            a.Schema = schema
+            a.Columns = set()
+            structure[st] = a
 
-    # Get list of all relevant tables and assign found columns from above
-    givenStructure = []
+        if column is not None:
+            a.Columns.add(column.strip())
 
-    t_results = None
-    with SqlDbConnection(connection_string) as sql:
-        t_results = sql.select('SELECT Creator, Name from sysibm.systables WHERE Creator IN (\'DBA\', \'OPERS\');')
 
-    for schema, table in t_results:
-        schema = schema.strip()
-        table = table.strip()
-        st = '{}.{}'.format(schema, table)
+def _sql_string(value):
+    '''Returns `value` as an SQL string literal'''
 
-        a = TableStructure()
-        a.Table = table
-        a.Schema = schema
-        a.Columns = columns.get(st, [])
-        givenStructure.append(a)
-        
+    return "'{}'".format(value.replace("'", "''"))
+
+
+def _select_all(connection_string, queries):
+    '''Runs each query in `queries` in turn on one pooled connection and
+    returns all of their rows'''
+
+    rows = []
+    with ConnectionPool.connection(connection_string) as sql:
+        for query in queries:
+            rows.extend(tuple(row) for row in sql.select(query))
+    return rows
+
+
+def get_db_structure(db2Configs, requestedStructure=None):
+    '''Returns the structure of the tables in CATALOG_SCHEMAS, with the columns
+    of each table as a set.  When `requestedStructure` is given, only those
+    tables are read from the catalog, so the work done scales with the request
+    rather than with the size of the catalog'''
+    
+    connection_string = db2Configs['connection_string'].format_map(db2Configs)
+    
+    # TODO:  Convert to debug
+    #print('cs: {}'.format(connection_string))
+
+    queries = []
+    if requestedStructure is None:
+        where = 't.Creator IN ({})'.format(', '.join("'{}'".format(s) for s in CATALOG_SCHEMAS))
+        queries.append(STRUCTURE_QUERY.format(where))
+
+    else:
+        # Group the requested tables by schema, so each batch is a single
+        # IN-list that can use the catalog's index.  The names are written
+        # into the query as literals, since SqlDbConnection.select() takes
+        # only the query
+        tablesBySchema = OrderedDict()
+        for struct in requestedStructure:
+            if struct.Schema in CATALOG_SCHEMAS:
+                tablesBySchema.setdefault(struct.Schema, set()).add(struct.Table)
+
+        for schema, tables in tablesBySchema.items():
+            # Sorted, so the same request makes the same batches every time
+            tables = sorted(tables)
+            for start in range(0, len(tables), TABLE_BATCH_SIZE):
+                batch = tables[start:start + TABLE_BATCH_SIZE]
+                where = 't.Creator = {} AND t.Name IN ({})'.format(
+                    _sql_string(schema), ', '.join(_sql_string(table) for table in batch))
+                queries.append(STRUCTURE_QUERY.format(where))
+
+    # The queries run one after another on one pooled connection, and the
+    # answer to the whole request is cached (see RemoteCache)
+    rows = RemoteCache.cached(
+        'DB2 Catalog', (connection_string, queries), lambda: _select_all(connection_string, queries))
+
+    structure = OrderedDict()
+    _structure_from_rows(rows, structure)
+
+    givenStructure = list(structure.values())
 
     return givenStructure
 
@@ -83,19 +138,20 @@ def compare_results(req_structure, given_structure):
     for struct in req_structure:
         reqStructDict['{}.{}'.format(struct.Schema, struct.Table)] = struct
 
-    givenStructDict = {}
+    # Columns are compared as sets, so each check is a single lookup
+    givenColumns = {}
     for struct in given_structure:
-        givenStructDict['{}.{}'.format(struct.Schema, struct.Table)] = struct
+        givenColumns['{}.{}'.format(struct.Schema, struct.Table)] = set(struct.Columns)
 
 
     failedStructure = []
 
     for table in reqStructDict.keys():
-        if table in givenStructDict.keys():
+        if table in givenColumns:
 
             missingColumns = False
             for column in ListUtilities.ensureIsList(reqStructDict[table].Columns):
-                if column not in givenStructDict[table].Columns:
+                if column not in givenColumns[table]:
                     missingColumns = True
 
             # Fail if any columns are missing
@@ -140,7 +196,7 @@ def process(allConfigs, path, db2Region):
     requestedStructure = parse_xml(path)
     result.Count = len(requestedStructure)
 
-    givenStructure = get_db_structure(db2Configs)
+    givenStructure = get_db_structure(db2Configs, requestedStructure)
     result.FailureData = compare_results(requestedStructure, givenStructure)
 
     if len(result.FailureData) == 0:
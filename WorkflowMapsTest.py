@@ -1,8 +1,8 @@
 ﻿from collections import OrderedDict
 from DependencyTestResult import DependencyTestResult
-from SqlDbConnection import SqlDbConnection
 
 import ConfigMapper
+import RemoteCache
 from datetime import datetime as dt
 import XMLDataCrawler
 
@@ -37,8 +37,7 @@ def get_loaded_maps(sqlServerConfigs):
     #print('cs: {}'.format(connectionString))
     
     db_data = None
-    with SqlDbConnection(connectionString) as connection:
-        db_data = connection.select(query)
+    db_data = RemoteCache.cachedSelect('Workflow Maps', connectionString, query)
         
     loadedWorkflowMaps = {}
     
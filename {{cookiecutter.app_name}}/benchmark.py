@@ -0,0 +1,528 @@
+'''
+Benchmarks each stage of classifier.py against synthetic data.
+
+The data has the same shape as the spambase example (57 non-negative
+attributes followed by a 0/1 label) and can be scaled to any number of
+rows, so the benchmark runs offline and without the original data set.
+
+For every data set size, the stages
+   1. download_data
+   2. get_features_and_labels
+   3. evaluate_classifier (one entry per classifier)
+   4. plot (rendered off-screen to PNG bytes, see plotting.py)
+are run in turn, recording wall time, CPU time, peak resident memory and
+throughput (rows per second). The results are written to a JSON file.
+Stages 2 and 3 are then run a second time while tracing allocations to
+record the peak memory allocated by Python and numpy; tracing slows
+every allocation down, so the times always come from the first run.
+
+With --sparse, stages 2 and 3 are repeated with the attributes in a
+sparse matrix (see classifier.SPARSE), and the time and memory of each
+are printed relative to the dense arrays.
+
+Before the stages, the time to import classifier.py in a new
+interpreter is measured with `python -X importtime`. The script exits
+with status 1 if the import takes longer than --import-budget
+milliseconds or loads any of HEAVY_MODULES, which must only be imported
+by the stages that use them. Use --imports to run only this check.
+
+Pass --compare with a previous results file to report the change in
+each measurement; the script exits with status 1 if any stage became
+slower or larger by more than --threshold, so it can be used as a check
+before changes are deployed.
+
+Examples:
+    python benchmark.py --rows 4601 100000 --output bench.json
+    python benchmark.py --rows 100000 --classifiers "Linear SVC" --compare bench.json
+    python benchmark.py --rows 100000 --sparse
+    python benchmark.py --imports
+'''
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import classifier
+
+# Importing classifier.py must take less than this many milliseconds and
+# must not import any of these modules
+IMPORT_BUDGET_MS = 150
+HEAVY_MODULES = ('matplotlib', 'numpy', 'pandas', 'scipy', 'seaborn', 'sklearn')
+
+# Number of attributes in each group of the spambase data
+WORD_FREQ_COLUMNS = 48
+CHAR_FREQ_COLUMNS = 6
+CAPITAL_RUN_COLUMNS = 3
+
+# Rows generated at a time when writing synthetic data
+GENERATE_CHUNK_ROWS = 100000
+
+
+# =====================================================================
+
+
+def generate_data(path, rows, seed=0):
+    '''
+    Writes `rows` rows of spambase-shaped synthetic data to `path`.
+
+    Most attributes are zero, as in the real data, and the non-zero
+    values are more likely for one class than the other so that the
+    classifiers have something to learn.
+    '''
+    import numpy as np
+
+    rng = np.random.RandomState(seed)
+    n_features = WORD_FREQ_COLUMNS + CHAR_FREQ_COLUMNS + CAPITAL_RUN_COLUMNS
+
+    # How much more likely each attribute is to be present in spam
+    spam_bias = rng.uniform(0.5, 2.0, n_features)
+
+    with open(path, 'w') as f:
+        for start in range(0, rows, GENERATE_CHUNK_ROWS):
+            n = min(GENERATE_CHUNK_ROWS, rows - start)
+            y = (rng.random_sample(n) < 0.394).astype(np.float64)
+
+            present_p = 0.2 * np.where(y[:, None] == 1, spam_bias, 1 / spam_bias)
+            present = rng.random_sample((n, n_features)) < np.clip(present_p, 0, 1)
+
+            X = np.zeros((n, n_features))
+            freq = slice(0, WORD_FREQ_COLUMNS + CHAR_FREQ_COLUMNS)
+            X[:, freq] = rng.exponential(0.5, (n, WORD_FREQ_COLUMNS + CHAR_FREQ_COLUMNS))
+            X[:, WORD_FREQ_COLUMNS + CHAR_FREQ_COLUMNS:] = 1 + rng.exponential(
+                50, (n, CAPITAL_RUN_COLUMNS)).round()
+            X[:, freq] *= present[:, freq]
+
+            np.savetxt(f, np.column_stack([X, y]), fmt='%.4g', delimiter=',')
+
+    return path
+
+
+def get_data_file(data_dir, rows, seed):
+    '''
+    Returns the path of a synthetic data file, generating it if it does
+    not already exist.
+    '''
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, 'synthetic_{}_{}.csv'.format(rows, seed))
+    if not os.path.isfile(path):
+        print('Generating {} rows of synthetic data in {}'.format(rows, path))
+        generate_data(path + '.tmp', rows, seed)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+# =====================================================================
+
+
+def _reset_peak_rss():
+    '''
+    Resets the peak resident set size of this process where the
+    platform allows it (Linux), so each stage reports its own peak.
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        pass
+
+
+def _peak_rss():
+    '''
+    Returns the peak resident set size of this process in bytes, or
+    None if it cannot be determined.
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    except (ImportError, AttributeError):
+        return None
+
+
+class Measurement(object):
+    '''
+    Context manager that measures wall time, CPU time and peak memory
+    for the code it wraps. With `suppress`, an exception is recorded
+    rather than raised so the remaining stages can still be measured.
+    Use trace_allocations() afterwards to add the peak memory allocated
+    by the stage.
+    '''
+
+    def __init__(self, rows, stage, classifier=None, suppress=False):
+        self.suppress = suppress
+        self.record = {
+            'rows': rows,
+            'stage': stage,
+            'classifier': classifier,
+        }
+
+    def __enter__(self):
+        _reset_peak_rss()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        times = os.times()
+        self._children = times.children_user + times.children_system
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        wall = time.perf_counter() - self._wall
+        times = os.times()
+        cpu = time.process_time() - self._cpu
+        cpu += times.children_user + times.children_system - self._children
+
+        self.record.update({
+            'wall_time': wall,
+            'cpu_time': cpu,
+            'peak_rss': _peak_rss(),
+            'rows_per_sec': self.record['rows'] / wall if wall > 0 else None,
+        })
+        if exc_type is not None:
+            self.record['error'] = '{}: {}'.format(exc_type.__name__, exc_value)
+            print('  {} failed: {}'.format(self.record['stage'], self.record['error']))
+            return self.suppress
+        return False
+
+    def trace_allocations(self, func, *args, **kwargs):
+        '''
+        Runs the stage again as func(*args, **kwargs) while tracing
+        allocations and records the peak memory allocated by Python and
+        numpy, which unlike the peak RSS does not include memory used
+        before the stage started. Stages that failed are not repeated.
+        '''
+        from engine import trace_peak
+
+        if 'error' not in self.record:
+            _, self.record['peak_alloc'] = trace_peak(func, *args, **kwargs)
+
+
+def _nbytes(X):
+    if hasattr(X, 'tocsr'):
+        return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    return X.nbytes
+
+
+def _preprocessing_record(record, X_train, X_test):
+    '''
+    Adds the size of the feature matrix to the preprocessing `record`
+    and prints the peak memory allocated relative to it.
+    '''
+    record['feature_bytes'] = _nbytes(X_train) + _nbytes(X_test)
+    record['dtype'] = str(X_train.dtype)
+    print('  {} preprocessing peak {:.1f} MB, {:.2f}x the {:.1f} MB {} feature matrix'.format(
+        record.get('layout', 'dense'), record['peak_alloc'] / 2**20,
+        record['peak_alloc'] / record['feature_bytes'], record['feature_bytes'] / 2**20, record['dtype']))
+    return record
+
+
+def _evaluate_stage(rows, specs, X_train, X_test, y_train, y_test, layout='dense'):
+    '''
+    Measures each classifier in `specs` and returns a tuple containing:
+        (measurement records, results)
+    '''
+    from engine import evaluate_one
+    from metrics import score_results
+
+    results = []
+    per_classifier = []
+    for spec in specs:
+        with Measurement(rows, 'evaluate_classifier', spec.name, suppress=True) as m:
+            m.record['layout'] = layout
+            result = evaluate_one(spec.name, spec.create(), X_train, X_test, y_train, y_test)
+            score_results([result], y_test)
+            results.append(result)
+            m.record['score'] = result.score
+        m.trace_allocations(evaluate_one, spec.name, spec.create(), X_train, X_test, y_train, y_test)
+        per_classifier.append(m.record)
+
+    # The whole stage is the sum of its classifiers
+    wall = sum(r['wall_time'] for r in per_classifier)
+    peaks = [r['peak_rss'] for r in per_classifier if r['peak_rss'] is not None]
+    total = {
+        'rows': rows,
+        'stage': 'evaluate_classifier',
+        'classifier': None,
+        'layout': layout,
+        'wall_time': wall,
+        'cpu_time': sum(r['cpu_time'] for r in per_classifier),
+        'peak_rss': max(peaks) if peaks else None,
+        'rows_per_sec': rows / wall if wall > 0 else None,
+    }
+    return per_classifier + [total], results
+
+
+def _print_layouts(records):
+    '''
+    Prints the time and memory of each sparse measurement relative to
+    the dense one.
+    '''
+    dense = {_key(r): r for r in records if r.get('layout', 'dense') == 'dense'}
+    print('  {:<24} {:<24} {:>12} {:>12}'.format('sparse vs dense', 'classifier', 'wall', 'peak alloc'))
+    for record in records:
+        if record.get('layout') != 'sparse':
+            continue
+        base = dense.get(_key(dict(record, layout='dense')))
+        if base is None:
+            continue
+        changes = []
+        for field in ('wall_time', 'peak_alloc'):
+            if base.get(field) and record.get(field) is not None:
+                changes.append('{:.2f}x'.format(record[field] / base[field]))
+            else:
+                changes.append('-')
+        print('  {:<24} {:<24} {:>12} {:>12}'.format(
+            record['stage'], record.get('classifier') or '', changes[0], changes[1]))
+
+
+# =====================================================================
+
+
+def run_benchmark(rows, data_dir, seed=0, classifiers=None, chunk_size=None, use_cache=False, sparse=False):
+    '''
+    Runs each stage of classifier.py against `rows` rows of synthetic
+    data and returns a list of measurement records. With `sparse`, the
+    preprocessing and evaluation are measured again with sparse inputs.
+    '''
+    from plotting import render
+    from registry import load_registry
+
+    records = []
+
+    # Load the libraries before measuring, so that each stage measures
+    # the work on the data rather than the imports (which are measured
+    # by check_imports)
+    import pandas
+    import sklearn.model_selection
+    import sklearn.preprocessing
+
+    classifier.URL = get_data_file(data_dir, rows, seed)
+    if not use_cache:
+        classifier.CACHE_DIR = None
+
+    print('Benchmarking {} rows'.format(rows))
+
+    frame = None
+    if chunk_size:
+        with Measurement(rows, 'download_data') as m:
+            max_rows, chunks = classifier.download_data(chunk_size)
+        records.append(m.record)
+
+        with Measurement(rows, 'get_features_and_labels') as m:
+            X_train, X_test, y_train, y_test = classifier.get_features_and_labels_chunked(chunks, max_rows)
+        # The chunks have been consumed, so they are read again
+        max_rows, chunks = classifier.download_data(chunk_size)
+        m.trace_allocations(classifier.get_features_and_labels_chunked, chunks, max_rows)
+        records.append(_preprocessing_record(m.record, X_train, X_test))
+
+    else:
+        with Measurement(rows, 'download_data') as m:
+            frame = classifier.download_data()
+        records.append(m.record)
+
+        with Measurement(rows, 'get_features_and_labels') as m:
+            X_train, X_test, y_train, y_test = classifier.get_features_and_labels(frame, sparse=False)
+        m.trace_allocations(classifier.get_features_and_labels, frame, sparse=False)
+        records.append(_preprocessing_record(m.record, X_train, X_test))
+
+    specs = load_registry(classifier.REGISTRY_FILE)
+    if classifiers:
+        specs = [s for s in specs if s.name in classifiers]
+
+    stage_records, results = _evaluate_stage(rows, specs, X_train, X_test, y_train, y_test)
+    records.extend(stage_records)
+    del X_train, X_test
+
+    # Plots are rendered off-screen, in memory, while benchmarking
+    with Measurement(rows, 'plot', suppress=True) as m:
+        m.record['bytes'] = len(render(results, 'png'))
+    records.append(m.record)
+
+    if sparse and frame is not None:
+        with Measurement(rows, 'get_features_and_labels') as m:
+            m.record['layout'] = 'sparse'
+            X_train, X_test, y_train, y_test = classifier.get_features_and_labels(frame, sparse=True)
+        m.trace_allocations(classifier.get_features_and_labels, frame, sparse=True)
+        records.append(_preprocessing_record(m.record, X_train, X_test))
+
+        stage_records, _ = _evaluate_stage(
+            rows, [s for s in specs if s.sparse], X_train, X_test, y_train, y_test, 'sparse')
+        records.extend(stage_records)
+        _print_layouts(records)
+
+    return records
+
+
+def measure_import(module='classifier', repeats=5):
+    '''
+    Imports `module` in `repeats` new interpreters and returns a tuple
+    containing:
+        (fastest import time in seconds, heavy modules that were loaded)
+    '''
+    import subprocess
+
+    code = 'import sys, {0}; print(",".join(m for m in {1!r} if m in sys.modules))'.format(
+        module, HEAVY_MODULES)
+    best = None
+    loaded = []
+    for _ in range(repeats):
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True,
+        )
+        # Each line of stderr is "import time: self [us] | cumulative | name"
+        for line in proc.stderr.splitlines():
+            parts = [p.strip() for p in line.partition(':')[2].split('|')]
+            if len(parts) == 3 and parts[2] == module:
+                seconds = int(parts[1]) / 1e6
+                best = seconds if best is None else min(best, seconds)
+        loaded = [m for m in proc.stdout.strip().split(',') if m]
+
+    return best, loaded
+
+
+def check_imports(budget_ms=IMPORT_BUDGET_MS):
+    '''
+    Measures the import time of classifier.py and returns a tuple
+    containing:
+        (measurement record, True if the import is within budget)
+    '''
+    seconds, loaded = measure_import()
+    ok = seconds is not None and seconds * 1000 <= budget_ms and not loaded
+
+    print('Importing classifier took {:.1f} ms (budget {} ms)'.format((seconds or 0) * 1000, budget_ms))
+    if loaded:
+        print('  but loaded {}; import them inside the functions that use them'.format(', '.join(loaded)))
+
+    record = {
+        'rows': 0,
+        'stage': 'import',
+        'classifier': None,
+        'wall_time': seconds,
+        'cpu_time': None,
+        'peak_rss': None,
+        'rows_per_sec': None,
+        'heavy_modules': loaded,
+    }
+    return record, ok
+
+
+# =====================================================================
+
+
+def _key(record):
+    return record['rows'], record['stage'], record.get('classifier'), record.get('layout', 'dense')
+
+
+def compare(baseline, current, threshold):
+    '''
+    Prints the change in each measurement between two result lists and
+    returns the number of regressions larger than `threshold`.
+    '''
+    previous = {_key(r): r for r in baseline}
+    regressions = 0
+
+    print('{:>10} {:<24} {:<24} {:>10} {:>10} {:>10}'.format(
+        'rows', 'stage', 'classifier', 'wall', 'peak rss', 'peak alloc'))
+    for record in current:
+        old = previous.get(_key(record))
+        if old is None:
+            continue
+
+        changes = []
+        regressed = False
+        for field in ('wall_time', 'peak_rss', 'peak_alloc'):
+            if old.get(field) and record.get(field) is not None:
+                ratio = record[field] / old[field] - 1
+                changes.append('{:+.1%}'.format(ratio))
+                if ratio > threshold:
+                    regressed = True
+            else:
+                changes.append('-')
+
+        if regressed:
+            regressions += 1
+        print('{:>10} {:<24} {:<24} {:>10} {:>10} {:>10}{}'.format(
+            record['rows'], record['stage'] + (' (sparse)' if record.get('layout') == 'sparse' else ''),
+            record.get('classifier') or '',
+            changes[0], changes[1], changes[2], '  REGRESSION' if regressed else ''))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the stages of classifier.py on synthetic data')
+    parser.add_argument('--rows', type=int, nargs='+', default=[4601],
+                        help='data set sizes to benchmark (default: 4601, the size of spambase)')
+    parser.add_argument('--classifiers', nargs='+',
+                        help='names of the classifiers to benchmark (default: all enabled in the registry)')
+    parser.add_argument('--chunk-size', type=int,
+                        help='benchmark the streaming path with this many rows per chunk')
+    parser.add_argument('--cache', action='store_true',
+                        help='load data through the local data cache')
+    parser.add_argument('--sparse', action='store_true',
+                        help='also benchmark sparse inputs and compare them with dense arrays')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the synthetic data')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'classifier-benchmark'),
+                        help='where synthetic data files are stored')
+    parser.add_argument('--output', default='benchmark.json', help='file to write the results to')
+    parser.add_argument('--compare', metavar='BASELINE', help='results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative increase treated as a regression (default: 0.1)')
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET_MS,
+                        help='milliseconds allowed to import classifier.py (default: {})'.format(IMPORT_BUDGET_MS))
+    parser.add_argument('--imports', action='store_true', help='only check the import time of classifier.py')
+    args = parser.parse_args(argv)
+    if args.sparse and args.chunk_size:
+        parser.error('--sparse cannot be used with --chunk-size')
+
+    record, imports_ok = check_imports(args.import_budget)
+    if args.imports:
+        return 0 if imports_ok else 1
+
+    records = [record]
+    for rows in args.rows:
+        records.extend(run_benchmark(
+            rows, args.data_dir, args.seed, args.classifiers, args.chunk_size, args.cache, args.sparse))
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'created': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': records,
+        }, f, indent=2)
+    print('Results written to {}'.format(args.output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(baseline, records, args.threshold)
+        if regressions:
+            print('{} measurement(s) regressed by more than {:.0%}'.format(regressions, args.threshold))
+            return 1
+
+    return 0 if imports_ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
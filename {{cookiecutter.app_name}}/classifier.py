@@ -29,35 +29,187 @@ based on the metrics. These are not representative of modern spam
 detection systems.
 '''
 
+import os
+
 # Remember to update the script for the new data when you change this URL
 URL = "http://mlr.cs.umass.edu/ml/machine-learning-databases/spambase/spambase.data"
 
-# Uncomment this call when using matplotlib to generate images
-# rather than displaying interactive UI.
-#import matplotlib
-#matplotlib.use('Agg')
-
-from pandas import read_table
-import numpy as np
-import matplotlib.pyplot as plt
-
-try:
-    # [OPTIONAL] Seaborn makes plots nicer
-    import seaborn
-except ImportError:
-    pass
+# URL may also name several files (shards), which are read in parallel
+# threads and combined: a directory, a glob pattern such as
+# 'data/*.csv.gz', or 'store://bucket/prefix' for the objects under a
+# prefix in the object store kept in OBJECT_STORE_DIR. Files are read
+# according to their extension (see loaders.py), so Parquet and Excel
+# files can be used as well as delimited text. LOAD_WORKERS is the
+# number of threads reading shards (None chooses from the CPU count).
+OBJECT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'object_store')
+LOAD_WORKERS = None
+
+# Parsed data is cached in this directory so that later runs do not
+# download and parse URL again unless it has changed. URL may also be a
+# local path or a file:// URL. Set to None to disable the cache.
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data_cache')
+
+# To process data sets that are larger than memory, set CHUNK_SIZE to a
+# number of rows. The data is then read and converted in chunks of this
+# size, and the feature arrays are filled in place. Set ARRAY_DIR to a
+# directory to store those arrays as memory-mapped .npy files instead of
+# holding them in memory.
+CHUNK_SIZE = None
+#CHUNK_SIZE = 100000
+ARRAY_DIR = None
+#ARRAY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'arrays')
+
+# Classifiers are evaluated in parallel worker processes that share the
+# data through memory-mapped files. Use 'serial' to run them one after
+# another in this process, which is easier to debug.
+EVALUATION_ENGINE = 'process'
+#EVALUATION_ENGINE = 'serial'
+
+# Tracing allocations slows the classifiers down, so the peak memory of
+# each one is only measured (in a second pass, after it has been timed)
+# when this is set.
+TRACE_MEMORY = False
+#TRACE_MEMORY = True
+
+# The classifiers to evaluate and their parameters are read from this
+# file. Edit it to add, remove or tune candidates.
+REGISTRY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'classifiers.json')
+
+# Fitted classifiers and their scaler are saved in this directory and
+# reused by later runs that train on the same data with the same
+# parameters. Set to None to always train from scratch.
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+
+# The attribute values are converted to this type. float32 halves the
+# memory needed compared to float64 and is precise enough for most
+# data, but some learners convert their input to float64 anyway.
+DTYPE = 'float32'
+#DTYPE = 'float64'
+
+# Set SPARSE to True to keep the attributes in a scipy.sparse CSR matrix
+# rather than a dense array. Only the non-zero values are stored, which
+# suits data that is mostly zeros, such as word counts. The scaler then
+# only scales each attribute (see create_scaler), since centering would
+# make the data dense, and classifiers marked `"sparse": false` in the
+# registry are skipped. Name an svmlight/libsvm file (.svm or .libsvm)
+# in URL to read it without ever making a dense copy. Sparse data cannot
+# be streamed with CHUNK_SIZE.
+SPARSE = False
+#SPARSE = True
+
+# Rows are scaled in blocks of this many rows at a time, so scaling
+# needs only a little memory beyond the feature arrays themselves.
+SCALE_BLOCK_ROWS = 16384
+
+# The seed used to split the data into training and test sets. Stored
+# models can only be reused when the split is the same, so set this to
+# None only if you want a different split on every run.
+RANDOM_STATE = 0
+
+# To save the plot as images rather than displaying interactive UI,
+# set PLOT_FILES to a list of file names. The format is taken from each
+# extension (.png, .svg or .pdf). The images are rendered with the Agg
+# backend without importing any GUI toolkit (see plotting.py), so this
+# works on servers without a display.
+PLOT_FILES = None
+#PLOT_FILES = ['plot.png', 'plot.svg']
+
+# The scores, timings and parameters of every run are recorded in this
+# SQLite database, so that runs can be listed and compared later with
+# runstore.py. Set to None to keep no history.
+RUN_STORE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runs.sqlite')
+#RUN_STORE = None
+
+# pandas, numpy, scikit-learn and matplotlib take most of the time
+# needed to start this script, and every worker process of the
+# evaluation engine imports this module again. They are only imported
+# inside the functions that use them, so a stage that does not need a
+# library does not pay for loading it. `python benchmark.py --imports`
+# checks that importing this module stays within its time budget.
+
+# Set CLASSIFIER_TRACE=stdout to print timings for each stage, or see
+# instrument.py for the other options.
+from instrument import traced
 
 # =====================================================================
 
-def download_data():
+@traced()
+def download_data(chunksize=None):
     '''
     Downloads the data for this script into a pandas DataFrame.
+
+    When CACHE_DIR is set, the parsed frame is stored there in a binary
+    columnar format and reused by later runs, which skips both the
+    download and the parsing unless the source has changed. Sources
+    with several shards are always read from the shards.
+
+    When `chunksize` is given, returns a tuple containing:
+        (max_rows, chunks)
+    where `chunks` yields DataFrames of at most `chunksize` rows of DTYPE
+    and `max_rows` is an upper bound on the total number of rows.
+
+    svmlight/libsvm files (see loaders.SvmlightLoader) are read straight
+    into a tuple of (CSR matrix of inputs, array of targets) instead of
+    a DataFrame, and cannot be read in chunks.
     '''
+    from loaders import find_shards, get_loader, iter_chunks, read_shards
+
+    shards = find_shards(URL, OBJECT_STORE_DIR)
+
+    # The loader for the format is chosen from the name of the shard,
+    # which for remote data is URL itself. It is chosen before the
+    # download, since local copies of downloaded data do not keep the
+    # name.
+    loader = get_loader(shards[0], DTYPE)
+    if loader.sparse and chunksize:
+        raise ValueError('{} is read as a sparse matrix, which cannot be streamed in chunks'.format(URL))
+
+    if len(shards) > 1:
+        if loader.sparse:
+            return loader.read_files(shards)
+        if chunksize:
+            return iter_chunks(shards, chunksize, DTYPE)
+        return read_shards(shards, DTYPE, LOAD_WORKERS)
+
+    if chunksize or loader.sparse:
+        # Streaming needs a local file so that the rows can be counted
+        # before any arrays are allocated, and sparse files are parsed
+        # from disk. Remote data is downloaded to disk without being
+        # loaded into memory.
+        from datacache import local_copy
+        from tempfile import gettempdir
+        source = local_copy(shards[0], CACHE_DIR or os.path.join(gettempdir(), 'data_cache'))
+        if loader.sparse:
+            return loader.read(source)
+        return iter_chunks([source], chunksize, loader=loader)
+
+    if CACHE_DIR:
+        from datacache import load_cached
+        frame = load_cached(shards[0], loader, CACHE_DIR)
+    else:
+        frame = loader.read(shards[0])
+
+    # Return a subset of the columns
+    #return frame[['col1', 'col4', ...]]
+
+    # Return the entire frame
+    return frame
+
+
+def read_data(source, chunksize=None, dtype=None, sep=',', compression='infer'):
+    '''
+    Parses the data at `source` (a URL or local path) into a pandas
+    DataFrame, or into an iterator of DataFrames if `chunksize` is given.
+
+    This reads delimited text files; loaders.py also reads Parquet and
+    Excel files based on their extension.
+    '''
+    from pandas import read_table
 
     # If your data is in an Excel file, install 'xlrd' and use
     # pandas.read_excel instead of read_table
     #from pandas import read_excel
-    #frame = read_excel(URL)
+    #frame = read_excel(source)
 
     # If your data is in a private Azure blob, install 'azure-storage' and use
     # BlockBlobService.get_blob_to_path() with read_table() or read_excel()
@@ -67,9 +219,10 @@ def download_data():
     #frame = read_table('my_data.csv', ...
 
     frame = read_table(
-        URL,
+        source,
         
-        # Uncomment if the file needs to be decompressed
+        # Decompress files based on their extension (.gz or .bz2)
+        compression=compression,
         #compression='gzip',
         #compression='bz2',
 
@@ -79,7 +232,8 @@ def download_data():
         #encoding='utf-8',  # UTF-8 is also common
 
         # Specify the separator in the data
-        sep=',',            # comma separated values
+        sep=sep,            # comma separated values by default
+        #sep=',',           # comma separated values
         #sep='\t',          # tab separated values
         #sep=' ',           # space separated values
 
@@ -98,39 +252,67 @@ def download_data():
         # Use manual headers and skip the first row in the file
         #header=0,
         #names=['col1', 'col2', ...],
-    )
 
-    # Return a subset of the columns
-    #return frame[['col1', 'col4', ...]]
+        # Read the file in blocks of this many rows (None reads it all)
+        chunksize=chunksize,
+
+        # Convert all columns to this type while parsing (None infers
+        # the type of each column)
+        dtype=dtype,
+        #dtype={0: np.float32, 1: np.float32, ...},
+    )
 
-    # Return the entire frame
     return frame
 
 
+def count_rows(path, compression='infer'):
+    '''
+    Returns an upper bound on the number of rows in a local text file by
+    counting line breaks, without parsing the file.
+    '''
+    if compression == 'infer':
+        compression = {'.gz': 'gzip', '.bz2': 'bz2'}.get(os.path.splitext(path)[1].lower())
+    if compression == 'gzip':
+        from gzip import open as open_file
+    elif compression == 'bz2':
+        from bz2 import open as open_file
+    else:
+        open_file = open
+
+    rows = 0
+    last = b'\n'
+    with open_file(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            rows += block.count(b'\n')
+            last = block[-1:]
+
+    # Count a final line without a line break
+    if last != b'\n':
+        rows += 1
+    return rows
+
+
 # =====================================================================
 
 
-def get_features_and_labels(frame):
+@traced()
+def get_features_and_labels(frame, return_scaler=False, sparse=None):
     '''
     Transforms and scales the input data and returns numpy arrays for
     training and testing inputs and targets.
-    '''
 
-    # Replace missing values with 0.0, or we can use
-    # scikit-learn to calculate missing values (below)
-    #frame[frame.isnull()] = 0.0
+    If `sparse` (SPARSE by default) is True, the inputs are scipy.sparse
+    CSR matrices. `frame` may also be a tuple of an input matrix and a
+    target array, such as the result of load_svmlight_file(), which are
+    split without converting them.
 
-    # Convert values to floats
-    arr = np.array(frame, dtype=np.float)
+    If `return_scaler` is True, the fitted scaler is returned as a fifth
+    item so that it can be saved with the trained models.
+    '''
+    if sparse is None:
+        sparse = SPARSE
 
-    # Use the last column as the target value
-    X, y = arr[:, :-1], arr[:, -1]
-    # To use the first column instead, change the index value
-    #X, y = arr[:, 1:], arr[:, 0]
-    
-    # Use 80% of the data for training; test against the rest
-    from sklearn.model_selection import train_test_split
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2)
+    X_train, X_test, y_train, y_test = split_features_and_labels(frame, sparse=sparse)
 
     # sklearn.pipeline.make_pipeline could also be used to chain 
     # processing and classification into a black box, but here we do
@@ -143,83 +325,365 @@ def get_features_and_labels(frame):
     #X_train = imputer.transform(X_train)
     #X_test = imputer.transform(X_test)
     
+    scaler = create_scaler(sparse)
+    
+    # Fit the scaler based on the training data, then apply the same
+    # scaling to both training and test sets. The arrays are scaled in
+    # place rather than copied.
+    fit_scaler(scaler, X_train)
+    X_train = scale_in_place(scaler, X_train)
+    X_test = scale_in_place(scaler, X_test)
+
+    # Return the training and test sets
+    if return_scaler:
+        return X_train, X_test, y_train, y_test, scaler
+    return X_train, X_test, y_train, y_test
+
+
+def split_features_and_labels(frame, dtype=None, sparse=False):
+    '''
+    Converts the input data to numpy arrays of `dtype` (DTYPE by default)
+    and splits it into training and testing inputs and targets, without
+    scaling.
+
+    The rows are written straight to their final positions in a single
+    C-contiguous array, one column at a time, so the feature values are
+    only held once. The training and test sets are views of that array.
+
+    If `sparse` is True, the inputs are returned as scipy.sparse CSR
+    matrices, which are built from the non-zero values of each column
+    without making a dense copy. If `frame` is an (inputs, targets)
+    tuple, such as the result of download_data() for an svmlight file,
+    the inputs are only converted to or from a sparse matrix when
+    `sparse` does not match them.
+    '''
+    import numpy as np
+
+    if isinstance(frame, tuple):
+        X, y = frame
+        if sparse:
+            from scipy.sparse import csr_matrix
+            X = csr_matrix(X, dtype=dtype or DTYPE)
+        elif hasattr(X, 'toarray'):
+            X = X.toarray()
+        X = X.astype(dtype or DTYPE, copy=False)
+        y = np.asarray(y).astype(dtype or DTYPE, copy=False)
+        from sklearn.model_selection import train_test_split
+        return train_test_split(X, y, test_size=0.2, random_state=RANDOM_STATE)
+
+    # Replace missing values with 0.0, or we can use
+    # scikit-learn to calculate missing values (below)
+    #frame[frame.isnull()] = 0.0
+
+    n_rows, n_columns = frame.shape
+
+    # Use the last column as the target value
+    X_columns, y_column = list(range(n_columns - 1)), n_columns - 1
+    # To use the first column instead, change the index values
+    #X_columns, y_column = list(range(1, n_columns)), 0
+
+    # Use 80% of the data for training; test against the rest.
+    # ShuffleSplit chooses the same rows as train_test_split, but
+    # returns their indices instead of copies of the data.
+    from sklearn.model_selection import ShuffleSplit
+    splitter = ShuffleSplit(n_splits=1, test_size=0.2, random_state=RANDOM_STATE)
+    train_idx, test_idx = next(splitter.split(np.empty((n_rows, 0))))
+    order = np.concatenate([train_idx, test_idx])
+    n_train = len(train_idx)
+
+    y = frame.iloc[:, y_column].to_numpy().astype(dtype or DTYPE)[order]
+    if sparse:
+        X_train, X_test = _split_sparse(frame, X_columns, order, n_train, dtype or DTYPE)
+        return X_train, X_test, y[:n_train], y[n_train:]
+
+    # Convert values to floats, with the training rows first
+    X = np.empty((n_rows, len(X_columns)), dtype=dtype or DTYPE)
+    for i, column in enumerate(X_columns):
+        X[:, i] = frame.iloc[:, column].to_numpy()[order]
+
+    return X[:n_train], X[n_train:], y[:n_train], y[n_train:]
+
+
+def _split_sparse(frame, columns, order, n_train, dtype):
+    '''
+    Returns CSR matrices of the `columns` of `frame` for the rows
+    order[:n_train] and order[n_train:], storing only non-zero values.
+    '''
+    import numpy as np
+    from scipy import sparse
+
+    # The position of each row of the frame in the combined output
+    index_dtype = np.int32 if len(order) < 2**31 else np.int64
+    position = np.empty(len(order), dtype=index_dtype)
+    position[order] = np.arange(len(order), dtype=index_dtype)
+
+    # Collect the non-zero values of each column, in row order, for the
+    # training and the test matrix, as compressed columns
+    parts = ([], []), ([], [])
+    indptr = np.zeros((2, len(columns) + 1), dtype=np.int64)
+    for i, column in enumerate(columns):
+        values = frame.iloc[:, column].to_numpy()
+        nonzero = np.flatnonzero(values)
+        rows = position[nonzero]
+        sort = np.argsort(rows, kind='stable')
+        rows, values = rows[sort], values[nonzero[sort]].astype(dtype)
+
+        is_test = rows >= n_train
+        for j, (keep, offset) in enumerate(((~is_test, 0), (is_test, n_train))):
+            parts[j][0].append(values[keep])
+            parts[j][1].append(rows[keep] - offset)
+            indptr[j, i + 1] = indptr[j, i] + int(keep.sum())
+
+    matrices = []
+    for j, n in enumerate((n_train, len(order) - n_train)):
+        data = np.concatenate(parts[j][0]) if columns else np.empty(0, dtype=dtype)
+        indices = np.concatenate(parts[j][1]) if columns else np.empty(0, dtype=index_dtype)
+        del parts[j][0][:], parts[j][1][:]
+        # Converting to rows is the only other copy of the values
+        by_column = sparse.csc_matrix((data, indices, indptr[j]), shape=(n, len(columns)))
+        del data, indices
+        matrices.append(by_column.tocsr())
+        del by_column
+    return matrices
+
+
+def create_scaler(sparse=False):
+    '''
+    Returns the unfitted scaler used to prepare the attribute values, or
+    one that keeps sparse data sparse if `sparse` is True.
+    '''
+
+    if sparse:
+        # Centering would replace the zeros with other values, so divide
+        # each attribute by its largest absolute value instead
+        from sklearn.preprocessing import MaxAbsScaler
+        return MaxAbsScaler()
+        # Or scale to unit variance without centering
+        #from sklearn.preprocessing import StandardScaler
+        #return StandardScaler(with_mean=False)
+
     # Normalize the attribute values to mean=0 and variance=1
     from sklearn.preprocessing import StandardScaler
-    scaler = StandardScaler()
+    return StandardScaler()
     # To scale to a specified range, use MinMaxScaler
     #from sklearn.preprocessing import MinMaxScaler
-    #scaler = MinMaxScaler(feature_range=(0, 1))
-    
-    # Fit the scaler based on the training data, then apply the same
-    # scaling to both training and test sets.
-    scaler.fit(X_train)
-    X_train = scaler.transform(X_train)
-    X_test = scaler.transform(X_test)
+    #return MinMaxScaler(feature_range=(0, 1))
 
-    # Return the training and test sets
+
+def fit_scaler(scaler, X, block_rows=None):
+    '''
+    Fits `scaler` to `X`, a block of rows at a time when the scaler
+    supports partial_fit, which avoids temporary copies of all of `X`.
+    '''
+    block_rows = block_rows or SCALE_BLOCK_ROWS
+    if not hasattr(scaler, 'partial_fit') or X.shape[0] <= block_rows:
+        return scaler.fit(X)
+    for start in range(0, X.shape[0], block_rows):
+        scaler.partial_fit(X[start:start + block_rows])
+    return scaler
+
+
+def scale_in_place(scaler, X, block_rows=None):
+    '''
+    Applies the fitted `scaler` to the rows of `X` in place, a block of
+    rows at a time. Returns `X`, or for sparse matrices the scaled
+    matrix, which shares its values with `X` when the scaler allows it.
+    '''
+    import numpy as np
+
+    block_rows = block_rows or SCALE_BLOCK_ROWS
+    params = scaler.get_params()
+    if 'copy' in params:
+        scaler.set_params(copy=False)
+    try:
+        if hasattr(X, 'tocsr'):
+            # Sparse scalers only change the stored values, so the whole
+            # matrix is scaled at once
+            return scaler.transform(X)
+        for start in range(0, len(X), block_rows):
+            block = X[start:start + block_rows]
+            scaled = scaler.transform(block)
+            # Scalers that cannot work in place return a new array
+            if not np.shares_memory(scaled, block):
+                block[...] = scaled
+    finally:
+        if 'copy' in params:
+            scaler.set_params(copy=params['copy'])
+    return X
+
+
+def _allocate(array_dir, name, shape, dtype):
+    '''
+    Returns an uninitialized array, stored in a memory-mapped .npy file
+    in `array_dir` if it is not None.
+    '''
+    import numpy as np
+
+    if array_dir is None:
+        return np.empty(shape, dtype=dtype)
+    os.makedirs(array_dir, exist_ok=True)
+    return np.lib.format.open_memmap(
+        os.path.join(array_dir, name + '.npy'), mode='w+', dtype=dtype, shape=shape
+    )
+
+
+@traced()
+def get_features_and_labels_chunked(chunks, max_rows, array_dir=None, test_size=0.2, return_scaler=False):
+    '''
+    Streaming version of get_features_and_labels() for data returned by
+    download_data(chunksize=...).
+
+    Each chunk is copied straight into preallocated training and test
+    arrays, so peak memory depends on the chunk size rather than the
+    size of the data set. When `array_dir` is given the arrays are
+    memory-mapped .npy files in that directory.
+    '''
+    import numpy as np
+
+    # Decide up front which rows will be used for testing so that every
+    # row can be written to its final position as soon as it is read.
+    is_test = np.random.RandomState(RANDOM_STATE).random_sample(max_rows) < test_size
+    n_test = int(is_test.sum())
+    n_train = max_rows - n_test
+
+    # The scaler is fitted incrementally as the training rows arrive
+    scaler = create_scaler()
+
+    X_train = X_test = y_train = y_test = None
+    row = i_train = i_test = 0
+
+    for chunk in chunks:
+        arr = chunk.to_numpy(dtype=DTYPE)
+        # Use the last column as the target value
+        X, y = arr[:, :-1], arr[:, -1]
+        # To use the first column instead, change the index value
+        #X, y = arr[:, 1:], arr[:, 0]
+
+        if X_train is None:
+            n_features = X.shape[1]
+            X_train = _allocate(array_dir, 'X_train', (n_train, n_features), DTYPE)
+            X_test = _allocate(array_dir, 'X_test', (n_test, n_features), DTYPE)
+            y_train = _allocate(array_dir, 'y_train', (n_train,), DTYPE)
+            y_test = _allocate(array_dir, 'y_test', (n_test,), DTYPE)
+
+        if row + len(arr) > max_rows:
+            raise ValueError('data has more than the expected {} rows'.format(max_rows))
+
+        mask = is_test[row:row + len(arr)]
+        row += len(arr)
+
+        train_count = len(arr) - int(mask.sum())
+        X_train[i_train:i_train + train_count] = X[~mask]
+        y_train[i_train:i_train + train_count] = y[~mask]
+        scaler.partial_fit(X_train[i_train:i_train + train_count])
+        i_train += train_count
+
+        X_test[i_test:i_test + len(arr) - train_count] = X[mask]
+        y_test[i_test:i_test + len(arr) - train_count] = y[mask]
+        i_test += len(arr) - train_count
+
+    if X_train is None:
+        raise ValueError('no data was read')
+
+    # max_rows is only an upper bound, so trim to the rows actually read
+    X_train, y_train = X_train[:i_train], y_train[:i_train]
+    X_test, y_test = X_test[:i_test], y_test[:i_test]
+
+    # Apply the scaling in place, one block at a time
+    scale_in_place(scaler, X_train)
+    scale_in_place(scaler, X_test)
+
+    if return_scaler:
+        return X_train, X_test, y_train, y_test, scaler
     return X_train, X_test, y_train, y_test
 
 
 # =====================================================================
 
 
-def evaluate_classifier(X_train, X_test, y_train, y_test):
+@traced()
+def evaluate_classifier(X_train, X_test, y_train, y_test, engine=None, scaler=None):
     '''
     Run multiple times with different classifiers to get an idea of the
     relative performance of each configuration.
 
+    `engine` selects how the classifiers are run (see engine.py) and
+    defaults to EVALUATION_ENGINE. Results are returned in the order the
+    classifiers finish, which may differ between runs. Each result is
+    scored (see metrics.py) and returned as soon as its classifier
+    finishes, so the scores and predictions of only one classifier are
+    held at a time.
+
+    When MODEL_DIR is set and the fitted `scaler` is given, classifiers
+    that were already trained on this data are loaded from MODEL_DIR
+    rather than fitted again, and new ones are saved there.
+
     Returns a sequence of tuples containing:
         (title, precision, recall)
-    for each learner.
+    for each learner. Each item is an engine.EvaluationResult, which
+    also records the fit time, predict time, peak memory, average
+    precision and ROC AUC.
     '''
 
-    # Import some classifiers to test
-    from sklearn.svm import LinearSVC, NuSVC
-    from sklearn.ensemble import AdaBoostClassifier
+    from engine import get_engine
+    from metrics import score_results
+    from registry import load_registry
+
+    # The classifiers and their parameters are listed in REGISTRY_FILE.
+    # The defaults there need to be adjusted to obtain optimal
+    # performance on your data set.
+    specs = load_registry(REGISTRY_FILE)
+    if hasattr(X_train, 'tocsr'):
+        # Skip classifiers that only accept dense inputs
+        specs = [spec for spec in specs if spec.sparse]
+    candidates = [(spec.name, spec.create()) for spec in specs]
+
+    models = None
+    if MODEL_DIR and scaler is not None:
+        from modelstore import ModelStore
+        models = ModelStore(MODEL_DIR).for_data(X_train, y_train, scaler)
+
+    # Fit each classifier and collect its scores for the test set
+    engine = get_engine(engine or EVALUATION_ENGINE, trace_memory=TRACE_MEMORY)
+    for result in engine.run(candidates, X_train, X_test, y_train, y_test, models):
+        # Calculate the F1 score and P-R curve, then release the scores
+        score_results([result], y_test)
+        yield result
+
+
+def record_run(results, X_train, X_test, y_train, y_test, note=None):
+    '''
+    Saves the scored `results` of evaluate_classifier() to RUN_STORE,
+    together with the classifier parameters and a hash of the data, and
+    returns the id of the new run.
+    '''
 
-    # We will calculate the P-R curve for each classifier
-    from sklearn.metrics import precision_recall_curve, f1_score
-    
-    # Here we create classifiers with default parameters. These need
-    # to be adjusted to obtain optimal performance on your data set.
-    
-    # Test the linear support vector classifier
-    classifier = LinearSVC(C=1)
-    # Fit the classifier
-    classifier.fit(X_train, y_train)
-    score = f1_score(y_test, classifier.predict(X_test))
-    # Generate the P-R curve
-    y_prob = classifier.decision_function(X_test)
-    precision, recall, _ = precision_recall_curve(y_test, y_prob)
-    # Include the score in the title
-    yield 'Linear SVC (F1 score={:.3f})'.format(score), precision, recall
-
-    # Test the Nu support vector classifier
-    classifier = NuSVC(kernel='rbf', nu=0.5, gamma=1e-3)
-    # Fit the classifier
-    classifier.fit(X_train, y_train)
-    score = f1_score(y_test, classifier.predict(X_test))
-    # Generate the P-R curve
-    y_prob = classifier.decision_function(X_test)
-    precision, recall, _ = precision_recall_curve(y_test, y_prob)
-    # Include the score in the title
-    yield 'NuSVC (F1 score={:.3f})'.format(score), precision, recall
-
-    # Test the Ada boost classifier
-    classifier = AdaBoostClassifier(n_estimators=50, learning_rate=1.0, algorithm='SAMME.R')
-    # Fit the classifier
-    classifier.fit(X_train, y_train)
-    score = f1_score(y_test, classifier.predict(X_test))
-    # Generate the P-R curve
-    y_prob = classifier.decision_function(X_test)
-    precision, recall, _ = precision_recall_curve(y_test, y_prob)
-    # Include the score in the title
-    yield 'Ada Boost (F1 score={:.3f})'.format(score), precision, recall
+    from modelstore import data_key
+    from registry import load_registry
+    from runstore import RunStore
+
+    specs = load_registry(REGISTRY_FILE, include_disabled=True)
+    store = RunStore(RUN_STORE)
+    try:
+        return store.record(
+            results,
+            source=URL,
+            data_key=data_key(X_train, y_train, X_test, y_test),
+            n_train=X_train.shape[0],
+            n_test=X_test.shape[0],
+            n_features=X_train.shape[1],
+            engine=EVALUATION_ENGINE,
+            params={spec.name: (spec.class_path, spec.params) for spec in specs},
+            note=note,
+        )
+    finally:
+        store.close()
 
 # =====================================================================
 
 
-def plot(results):
+@traced()
+def plot(results, filenames=None):
     '''
     Create a plot comparing multiple learners.
 
@@ -227,19 +691,51 @@ def plot(results):
         (title, precision, recall)
     
     All the elements in results will be plotted.
+
+    When `filenames` (or PLOT_FILES) is set, the plot is saved to each
+    of those image files instead of being displayed.
     '''
 
+    filenames = filenames or PLOT_FILES
+    if filenames:
+        # Render without a display. Curves are reduced to the resolution
+        # of the image before plotting, and the files are written
+        # concurrently. Anything that imports pyplot later in this
+        # process (such as seaborn) also gets the headless backend.
+        from plotting import use_headless_backend, write_reports
+        use_headless_backend()
+        results = list(results)
+        write_reports([(filename, results) for filename in filenames])
+        return
+
+    # pyplot is only imported when the plot is displayed, since it loads
+    # the interactive backend and its GUI toolkit
+    import matplotlib.pyplot as plt
+    from plotting import decimate
+
+    try:
+        # [OPTIONAL] Seaborn makes plots nicer
+        import seaborn
+    except ImportError:
+        pass
+
     # Plot the precision-recall curves
 
     fig = plt.figure(figsize=(6, 6))
-    fig.canvas.set_window_title('Classifying data from ' + URL)
-
+    # FigureCanvas.set_window_title was removed in matplotlib 3.6; the
+    # window belongs to the figure manager, which is None when there is
+    # no window.
+    if fig.canvas.manager is not None:
+        fig.canvas.manager.set_window_title('Classifying data from ' + URL)
+
+    # There is no point plotting more points than there are pixels
+    width = int(fig.get_figwidth() * fig.dpi)
     for label, precision, recall in results:
-        plt.plot(recall, precision, label=label)
+        plt.plot(*decimate(recall, precision, width), label=label)
 
     plt.title('Precision-Recall Curves')
-    plt.xlabel('Precision')
-    plt.ylabel('Recall')
+    plt.xlabel('Recall')
+    plt.ylabel('Precision')
     plt.legend(loc='lower left')
 
     # Let matplotlib improve the layout
@@ -256,13 +752,11 @@ def plot(results):
     #import subprocess
     #subprocess.Popen('plot.png', shell=True)
 
-    # To save the plot to an image in memory, use BytesIO and savefig()
-    # This can then be written to any stream-like object, such as a
-    # file or HTTP response.
-    #from io import BytesIO
-    #img_stream = BytesIO()
-    #plt.savefig(img_stream, fmt='png')
-    #img_bytes = img_stream.getvalue()
+    # To save the plot to an image in memory, use plotting.render(),
+    # which returns the image bytes. These can then be written to any
+    # stream-like object, such as a file or HTTP response.
+    #from plotting import render
+    #img_bytes = render(results, 'png')
     #print('Image is {} bytes - {!r}'.format(len(img_bytes), img_bytes[:8] + b'...'))
 
     # Closing the figure allows matplotlib to release the memory used.
@@ -273,18 +767,51 @@ def plot(results):
 
 
 if __name__ == '__main__':
-    # Download the data set from URL
-    print("Downloading data from {}".format(URL))
-    frame = download_data()
-
-    # Process data into feature and label arrays
-    print("Processing {} samples with {} attributes".format(len(frame.index), len(frame.columns)))
-    X_train, X_test, y_train, y_test = get_features_and_labels(frame)
+    if CHUNK_SIZE:
+        # The chunks are written into preallocated dense arrays
+        if SPARSE:
+            raise ValueError('SPARSE cannot be combined with CHUNK_SIZE; set one of them to None or False')
+
+        # Stream the data set from URL in chunks
+        print("Streaming data from {} in chunks of {} rows".format(URL, CHUNK_SIZE))
+        max_rows, chunks = download_data(CHUNK_SIZE)
+
+        # Process each chunk into the feature and label arrays
+        X_train, X_test, y_train, y_test, scaler = get_features_and_labels_chunked(
+            chunks, max_rows, ARRAY_DIR, return_scaler=True)
+        print("Processed {} samples with {} attributes".format(len(X_train) + len(X_test), X_train.shape[1]))
+
+    else:
+        # Download the data set from URL
+        print("Downloading data from {}".format(URL))
+        frame = download_data()
+
+        # Process data into feature and label arrays
+        print("Processing {} samples with {} attributes".format(*(
+            frame[0].shape if isinstance(frame, tuple) else (len(frame.index), len(frame.columns)))))
+        X_train, X_test, y_train, y_test, scaler = get_features_and_labels(frame, return_scaler=True)
+        if SPARSE:
+            print("Stored {} non-zero values ({:.1%} of the attributes)".format(
+                X_train.nnz + X_test.nnz,
+                (X_train.nnz + X_test.nnz) / float(X_train.shape[1] * (X_train.shape[0] + X_test.shape[0]))))
 
     # Evaluate multiple classifiers on the data
     print("Evaluating classifiers")
-    results = list(evaluate_classifier(X_train, X_test, y_train, y_test))
+    results = []
+    for result in evaluate_classifier(X_train, X_test, y_train, y_test, scaler=scaler):
+        results.append(result)
+        print("  {}: {} {:.2f}s, predict {:.2f}s{}".format(
+            result.title, 'loaded' if result.reused else 'fit', result.fit_time, result.predict_time,
+            '' if result.peak_memory is None else ", peak memory {:.1f} MB".format(result.peak_memory / 2**20)))
+
+    # Keep the results so that later runs can be compared with this one
+    if RUN_STORE:
+        run_id = record_run(results, X_train, X_test, y_train, y_test)
+        print("Recorded as run {} (see runstore.py)".format(run_id))
 
     # Display the results
-    print("Plotting the results")
+    if PLOT_FILES:
+        print("Saving the plot to {}".format(', '.join(PLOT_FILES)))
+    else:
+        print("Plotting the results")
     plot(results)
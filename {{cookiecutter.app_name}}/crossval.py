@@ -0,0 +1,263 @@
+'''
+Cross-validation of the classifiers in the registry.
+
+classifier.py measures each classifier on a single test split, so its
+scores depend on which rows happened to be chosen for testing. This
+script instead splits the training data into --folds folds, trains each
+classifier on all but one fold and scores it on the remaining one, and
+reports the mean and standard deviation over the folds:
+   1. the fold indices are computed once
+   2. each fold is scaled once and saved as .npy files, which are reused
+      by every classifier (and by later runs, and by tuning.py); saved
+      folds that have not been used for FOLD_CACHE_MAX_AGE are deleted
+      whenever new ones are saved
+   3. every (classifier, fold) pair is fitted in parallel worker
+      processes that memory-map the fold arrays rather than copying them
+   4. the metrics of all classifiers on a fold are computed in one pass
+
+Only the training split from classifier.py is used, so the test set
+stays unseen.
+
+Examples:
+    python crossval.py --folds 5
+    python crossval.py --folds 10 --no-stratify --classifiers "Linear SVC" NuSVC
+'''
+
+import argparse
+import os
+import shutil
+import sys
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cv_cache')
+DEFAULT_FOLDS = 5
+
+# Saved folds that have not been used for this many seconds are deleted
+FOLD_CACHE_MAX_AGE = 7 * 24 * 3600
+
+
+# =====================================================================
+
+
+def prepare_folds(X, y, n_folds, cache_dir, seed=0, stratify=True, scale=True):
+    '''
+    Splits `X` and `y` into folds (stratified by class if `stratify`),
+    scales each fold with a scaler fitted on its training part (unless
+    `scale` is False), and saves the arrays under `cache_dir`. Returns a
+    list of (X_train, y_train, X_valid, y_valid) path tuples. Folds that
+    were already saved are reused.
+    '''
+    import numpy as np
+    from sklearn.model_selection import KFold, StratifiedKFold
+    from classifier import create_scaler, fit_scaler, scale_in_place
+    from modelstore import data_key
+
+    fold_dir = os.path.join(cache_dir, 'folds', '{}-{}-{}{}{}'.format(
+        data_key(X, y)[:16], n_folds, seed, '' if stratify else '-kfold', '' if scale else '-unscaled'))
+    names = ('X_train', 'y_train', 'X_valid', 'y_valid')
+    folds = [
+        tuple(os.path.join(fold_dir, 'fold{}_{}.npy'.format(i, name)) for name in names)
+        for i in range(n_folds)
+    ]
+    if all(os.path.isfile(p) for paths in folds for p in paths):
+        # Record the use, so that prune_folds() keeps these folds
+        os.utime(fold_dir)
+        return folds
+
+    # Every change to the data or the options saves another set of
+    # folds, so clear out the ones nobody has used for a while
+    prune_folds(cache_dir)
+    os.makedirs(fold_dir, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    splitter = (StratifiedKFold if stratify else KFold)(n_splits=n_folds, shuffle=True, random_state=seed)
+    for paths, (train_idx, valid_idx) in zip(folds, splitter.split(X, y)):
+        # Shuffle the training rows so that any prefix is a random
+        # sample; successive halving in tuning.py trains on growing
+        # prefixes.
+        train_idx = rng.permutation(train_idx)
+
+        # Indexing makes the only copy of each fold, which is then
+        # scaled in place
+        arrays = (X[train_idx], y[train_idx], X[valid_idx], y[valid_idx])
+        if scale:
+            scaler = fit_scaler(create_scaler(), arrays[0])
+            scale_in_place(scaler, arrays[0])
+            scale_in_place(scaler, arrays[2])
+        for path, arr in zip(paths, arrays):
+            np.save(path + '.tmp.npy', arr)
+            os.replace(path + '.tmp.npy', path)
+
+    return folds
+
+
+def prune_folds(cache_dir, max_age=FOLD_CACHE_MAX_AGE):
+    '''
+    Deletes the folds saved under `cache_dir` that have not been used
+    for `max_age` seconds, and returns how many sets were deleted.
+    '''
+    root = os.path.join(cache_dir, 'folds')
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return 0
+
+    cutoff = time.time() - max_age
+    removed = 0
+    for name in names:
+        path = os.path.join(root, name)
+        try:
+            if os.path.getmtime(path) >= cutoff:
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+    return removed
+
+
+def _evaluate_fold(title, classifier, paths):
+    '''
+    Worker entry point. Opens the fold arrays at `paths` read-only with
+    memory-mapping and evaluates `classifier` on them.
+    '''
+    import numpy as np
+    from engine import evaluate_one
+    X_train, y_train, X_valid, y_valid = [np.load(p, mmap_mode='r') for p in paths]
+    return evaluate_one(title, classifier, X_train, X_valid, y_train, y_valid)
+
+
+# =====================================================================
+
+
+class CrossValidationResult(object):
+    '''
+    The scores and timings of one classifier on every fold. Each
+    attribute is a numpy array with one value per fold.
+    '''
+
+    def __init__(self, name, n_folds):
+        import numpy as np
+        self.name = name
+        self.f1 = np.full(n_folds, np.nan)
+        self.average_precision = np.full(n_folds, np.nan)
+        self.roc_auc = np.full(n_folds, np.nan)
+        self.fit_time = np.full(n_folds, np.nan)
+        self.predict_time = np.full(n_folds, np.nan)
+        self.peak_memory = np.full(n_folds, np.nan)
+
+    def summary(self):
+        '''
+        Returns a one line description of the mean and standard
+        deviation of each measurement.
+        '''
+        import numpy as np
+
+        def mean_std(values, fmt):
+            return (fmt + ' +/- ' + fmt).format(values.mean(), values.std(ddof=1) if len(values) > 1 else 0.0)
+
+        # Peak memory is only known when it was traced (see engine.py)
+        return '{}: F1 {}, AP {}, ROC AUC {}, fit {}s, predict {}s{}'.format(
+            self.name,
+            mean_std(self.f1, '{:.3f}'),
+            mean_std(self.average_precision, '{:.3f}'),
+            mean_std(self.roc_auc, '{:.3f}'),
+            mean_std(self.fit_time, '{:.2f}'),
+            mean_std(self.predict_time, '{:.2f}'),
+            '' if np.isnan(self.peak_memory).all() else
+            ', peak memory {:.1f} MB'.format(np.nanmax(self.peak_memory) / 2**20))
+
+
+def cross_validate(specs, X, y, n_folds=DEFAULT_FOLDS, cache_dir=DEFAULT_CACHE_DIR, seed=0,
+                   stratify=True, max_workers=None):
+    '''
+    Cross-validates the registry.ClassifierSpec objects in `specs` on
+    `X` and `y`, and returns a list of CrossValidationResult in the same
+    order. Set `max_workers` to 1 to evaluate in this process.
+    '''
+    import numpy as np
+    from concurrent.futures import ProcessPoolExecutor
+    from metrics import compute_metrics
+
+    # Every classifier shares the same folds; only classifiers that need
+    # unscaled data cause a second set to be prepared
+    folds = {}
+    for scale in sorted(set(spec.scale for spec in specs)):
+        folds[scale] = prepare_folds(X, y, n_folds, cache_dir, seed, stratify, scale)
+
+    jobs = [(i, k) for i in range(len(specs)) for k in range(n_folds)]
+    max_workers = max_workers or min(len(jobs), os.cpu_count() or 1)
+
+    if max_workers == 1:
+        evaluated = [
+            _evaluate_fold(specs[i].name, specs[i].create(), folds[specs[i].scale][k]) for i, k in jobs
+        ]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_evaluate_fold, specs[i].name, specs[i].create(), folds[specs[i].scale][k])
+                for i, k in jobs
+            ]
+            evaluated = [f.result() for f in futures]
+
+    results = [CrossValidationResult(spec.name, n_folds) for spec in specs]
+    for (i, k), result in zip(jobs, evaluated):
+        results[i].fit_time[k] = result.fit_time
+        results[i].predict_time[k] = result.predict_time
+        if result.peak_memory is not None:
+            results[i].peak_memory[k] = result.peak_memory
+
+    # Score every classifier on each fold in one pass. The validation
+    # labels are the same for scaled and unscaled folds.
+    for k in range(n_folds):
+        fold_results = [evaluated[i * n_folds + k] for i in range(len(specs))]
+        y_valid = np.load(next(iter(folds.values()))[k][3], mmap_mode='r')
+        metrics = compute_metrics(
+            y_valid,
+            np.column_stack([r.scores for r in fold_results]),
+            np.column_stack([r.predictions for r in fold_results]),
+            curve_points=2,
+        )
+        for i in range(len(specs)):
+            results[i].f1[k] = metrics.f1[i]
+            results[i].average_precision[k] = metrics.average_precision[i]
+            results[i].roc_auc[k] = metrics.roc_auc[i]
+
+    return results
+
+
+# =====================================================================
+
+
+def main(argv=None):
+    import classifier
+    from registry import load_registry
+
+    parser = argparse.ArgumentParser(description='Cross-validate the registry classifiers')
+    parser.add_argument('--classifiers', nargs='+', help='names of the classifiers to evaluate (default: all enabled)')
+    parser.add_argument('--folds', type=int, default=DEFAULT_FOLDS, help='number of folds')
+    parser.add_argument('--no-stratify', action='store_true',
+                        help='split into folds at random rather than keeping the class balance of each fold')
+    parser.add_argument('--jobs', type=int, help='worker processes (default: one per CPU; 1 runs in this process)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='where the scaled folds are kept')
+    args = parser.parse_args(argv)
+
+    specs = load_registry(classifier.REGISTRY_FILE, include_disabled=bool(args.classifiers))
+    if args.classifiers:
+        specs = [s for s in specs if s.name in args.classifiers]
+
+    print("Downloading data from {}".format(classifier.URL))
+    frame = classifier.download_data()
+    X_train, _, y_train, _ = classifier.split_features_and_labels(frame)
+    del frame
+
+    print("Cross-validating {} classifiers on {} rows with {} {}folds".format(
+        len(specs), len(X_train), args.folds, '' if args.no_stratify else 'stratified '))
+    for result in cross_validate(specs, X_train, y_train, args.folds, args.cache_dir, args.seed,
+                                 not args.no_stratify, args.jobs):
+        print("  " + result.summary())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
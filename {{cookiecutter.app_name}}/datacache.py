@@ -0,0 +1,404 @@
+'''
+A local, content-addressed cache for the data set used by classifier.py.
+
+The first time a URL is requested the raw file is downloaded and hashed,
+parsed once, and each column of the resulting DataFrame is stored as its
+own .npy file. Later runs load those columns with numpy memory-mapping,
+so no text parsing happens at all and only the pages that are actually
+used are read from disk.
+
+Before the cached copy is used, its freshness is checked:
+   * http(s) URLs send a conditional HEAD request using the ETag and
+     Last-Modified headers that were recorded at download time; if the
+     server cannot be reached or refuses the request (for example with
+     405 Method Not Allowed), the cached copy is used
+   * local paths and file:// URLs compare the file size and modified
+     time, then fall back to a SHA-256 checksum if those have changed
+
+Cached objects are named by the SHA-256 of the raw data and of the
+parsing function, so editing the read options in classifier.py or
+pointing two URLs at identical data both behave as you would expect.
+
+When a URL's data or parsing changes, the objects and raw downloads that
+no URL refers to any more are deleted (see DataCache.prune()), so the
+cache holds one version of each source. The cache directory can also be
+deleted at any time.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlparse
+from urllib.request import Request, url2pathname, urlopen
+
+# Size of the blocks used when copying and hashing the raw data
+BLOCK_SIZE = 1 << 20
+
+INDEX_FILE = 'index.json'
+COLUMNS_FILE = 'columns.json'
+
+# Unreferenced files younger than this many seconds are kept by prune(),
+# since another run may have stored them and not yet updated the index
+PRUNE_MIN_AGE = 3600
+
+
+# =====================================================================
+
+
+def _local_path(url):
+    '''
+    Returns the filesystem path for a local path or file:// URL, or
+    None if the URL refers to a remote resource.
+    '''
+    parts = urlparse(url)
+    if parts.scheme == 'file':
+        return url2pathname(parts.netloc + parts.path if parts.netloc else parts.path)
+    # Single letter schemes are Windows drive letters, not URLs
+    if len(parts.scheme) <= 1:
+        return url
+    return None
+
+
+def _hash_stream(stream, digest, out=None):
+    '''
+    Feeds `stream` through `digest` block by block, optionally copying
+    the data to the `out` file as it goes.
+    '''
+    while True:
+        block = stream.read(BLOCK_SIZE)
+        if not block:
+            break
+        digest.update(block)
+        if out is not None:
+            out.write(block)
+    return digest.hexdigest()
+
+
+def _parser_key(parse):
+    '''
+    Returns a short string that changes whenever the parsing function
+    is edited, so that changing read options invalidates the cache.
+    '''
+    # Loaders (see loaders.py) describe their own code and options
+    if hasattr(parse, 'cache_key'):
+        return hashlib.sha256(parse.cache_key().encode('utf-8')).hexdigest()[:16]
+    code = getattr(parse, '__code__', None)
+    if code is None:
+        return repr(parse)
+    key = hashlib.sha256(code.co_code)
+    key.update(repr(code.co_consts).encode('utf-8'))
+    key.update(repr(code.co_names).encode('utf-8'))
+    return key.hexdigest()[:16]
+
+
+# =====================================================================
+
+
+class DataCache(object):
+    '''
+    Maps source URLs to parsed frames stored under `cache_dir`.
+    '''
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.objects_dir = os.path.join(self.cache_dir, 'objects')
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    # -----------------------------------------------------------------
+    # Index of URL -> object id and freshness information
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.cache_dir, INDEX_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        # Write to a temporary file and rename it so that readers never
+        # see a partially written index.
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.replace(tmp, os.path.join(self.cache_dir, INDEX_FILE))
+
+    def _object_dir(self, object_id):
+        return os.path.join(self.objects_dir, object_id)
+
+    def _has_object(self, object_id):
+        return os.path.isfile(os.path.join(self._object_dir(object_id), COLUMNS_FILE))
+
+    # -----------------------------------------------------------------
+    # Freshness checks
+
+    def _is_fresh(self, url, entry):
+        '''
+        Returns True if the cached entry for `url` still matches the
+        source.
+        '''
+        path = _local_path(url)
+        if path is not None:
+            st = os.stat(path)
+            if st.st_size == entry.get('size') and st.st_mtime == entry.get('mtime'):
+                return True
+            # The file was touched; only the checksum can tell if the
+            # content actually changed.
+            with open(path, 'rb') as f:
+                if _hash_stream(f, hashlib.sha256()) != entry.get('sha256'):
+                    return False
+            entry['size'], entry['mtime'] = st.st_size, st.st_mtime
+            return True
+
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        if not headers:
+            # Nothing to validate with, so assume the data is unchanged
+            # rather than downloading it on every run.
+            return True
+
+        try:
+            with urlopen(Request(url, headers=headers, method='HEAD')) as response:
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+        except HTTPError as ex:
+            if ex.code == 304:
+                return True
+            # Some servers do not allow HEAD; like being offline, this
+            # says nothing about whether the data changed
+            print('Unable to check {} for changes (HTTP {}); using cached data'.format(url, ex.code))
+            return True
+        except URLError:
+            # Offline: use whatever we already have
+            print('Unable to check {} for changes; using cached data'.format(url))
+            return True
+
+        if etag and etag != entry.get('etag'):
+            return False
+        if last_modified and last_modified != entry.get('last_modified'):
+            return False
+        return True
+
+    # -----------------------------------------------------------------
+    # Downloading and storing
+
+    def _fetch(self, url, tmp_file):
+        '''
+        Copies the data at `url` to `tmp_file` and returns the index
+        entry describing it.
+        '''
+        entry = {}
+        path = _local_path(url)
+        if path is not None:
+            st = os.stat(path)
+            with open(path, 'rb') as f:
+                entry['sha256'] = _hash_stream(f, hashlib.sha256(), tmp_file)
+            entry['size'], entry['mtime'] = st.st_size, st.st_mtime
+        else:
+            with urlopen(url) as response:
+                entry['etag'] = response.headers.get('ETag')
+                entry['last_modified'] = response.headers.get('Last-Modified')
+                entry['sha256'] = _hash_stream(response, hashlib.sha256(), tmp_file)
+        return entry
+
+    def _store(self, object_id, frame):
+        '''
+        Writes each column of `frame` to its own .npy file.
+        '''
+        import numpy as np
+
+        tmp_dir = tempfile.mkdtemp(dir=self.objects_dir, suffix='.tmp')
+        columns = []
+        for i, name in enumerate(frame.columns):
+            values = frame[name].to_numpy()
+            filename = 'col_{:05d}.npy'.format(i)
+            # Object columns (usually strings) cannot be memory-mapped,
+            # but are still much faster to load than to re-parse.
+            np.save(os.path.join(tmp_dir, filename), values, allow_pickle=values.dtype.hasobject)
+            if not isinstance(name, (int, float, str)):
+                name = str(name)
+            columns.append({'name': name, 'file': filename, 'object': bool(values.dtype.hasobject)})
+
+        with open(os.path.join(tmp_dir, COLUMNS_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'columns': columns, 'rows': len(frame.index)}, f)
+
+        target = self._object_dir(object_id)
+        try:
+            os.replace(tmp_dir, target)
+        except OSError:
+            # Another process stored the same object first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _load(self, object_id):
+        '''
+        Returns a DataFrame backed by the memory-mapped columns of a
+        stored object.
+        '''
+        import numpy as np
+        from pandas import DataFrame
+
+        obj_dir = self._object_dir(object_id)
+        with open(os.path.join(obj_dir, COLUMNS_FILE), 'r', encoding='utf-8') as f:
+            info = json.load(f)
+
+        data = {}
+        for col in info['columns']:
+            path = os.path.join(obj_dir, col['file'])
+            if col['object']:
+                data[col['name']] = np.load(path, allow_pickle=True)
+            else:
+                data[col['name']] = np.load(path, mmap_mode='r')
+
+        # copy=False keeps each column as its own block, so the columns
+        # stay memory-mapped rather than being consolidated into RAM.
+        return DataFrame(data, columns=[c['name'] for c in info['columns']], copy=False)
+
+    # -----------------------------------------------------------------
+
+    def load(self, url, parse):
+        '''
+        Returns the frame for `url`, calling `parse(path)` on a local
+        copy of the raw data only when the cache is missing or stale.
+        '''
+        parser_key = _parser_key(parse)
+        index = self._read_index()
+        entry = index.get(url)
+
+        if entry and entry.get('parser') == parser_key and self._has_object(entry['object']):
+            checked = dict(entry)
+            if self._is_fresh(url, checked):
+                # Only a touched local file updates the entry; otherwise
+                # a cache hit leaves the index alone
+                if checked != entry:
+                    index[url] = checked
+                    self._write_index(index)
+                return self._load(entry['object'])
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.download')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                entry = self._fetch(url, tmp_file)
+
+            object_id = hashlib.sha256('{}:{}'.format(entry['sha256'], parser_key).encode('ascii')).hexdigest()
+            if not self._has_object(object_id):
+                self._store(object_id, parse(tmp_path))
+        finally:
+            os.remove(tmp_path)
+
+        entry['object'] = object_id
+        entry['parser'] = parser_key
+        # Re-read the index in case another run updated it meanwhile
+        index = self._read_index()
+        index[url] = entry
+        self._write_index(index)
+        self.prune()
+
+        return self._load(object_id)
+
+    def local_copy(self, url):
+        '''
+        Returns the path of a local file containing the raw data at
+        `url`, downloading it into the cache only when it has changed.
+        Local paths and file:// URLs are returned without copying.
+        '''
+        path = _local_path(url)
+        if path is not None:
+            return path
+
+        raw_dir = os.path.join(self.cache_dir, 'raw')
+        os.makedirs(raw_dir, exist_ok=True)
+
+        key = 'raw:' + url
+        index = self._read_index()
+        entry = index.get(key)
+        if entry and os.path.isfile(os.path.join(raw_dir, entry['sha256'])):
+            if self._is_fresh(url, entry):
+                return os.path.join(raw_dir, entry['sha256'])
+
+        fd, tmp_path = tempfile.mkstemp(dir=raw_dir, suffix='.download')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                entry = self._fetch(url, tmp_file)
+            os.replace(tmp_path, os.path.join(raw_dir, entry['sha256']))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+        index = self._read_index()
+        index[key] = entry
+        self._write_index(index)
+        self.prune()
+
+        return os.path.join(raw_dir, entry['sha256'])
+
+    def prune(self, min_age=PRUNE_MIN_AGE):
+        '''
+        Removes the stored objects and raw downloads that the index no
+        longer refers to, and any left behind by interrupted runs, once
+        they are at least `min_age` seconds old. Returns the number of
+        items removed.
+        '''
+        index = self._read_index()
+        keep = set()
+        for key, entry in index.items():
+            keep.add(entry.get('object'))
+            if key.startswith('raw:'):
+                keep.add(entry.get('sha256'))
+
+        cutoff = time.time() - min_age
+        removed = 0
+        for directory in (self.objects_dir, os.path.join(self.cache_dir, 'raw')):
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    if name in keep or os.path.getmtime(path) >= cutoff:
+                        continue
+                except OSError:
+                    continue
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                removed += 1
+        return removed
+
+    def clear(self):
+        '''
+        Removes every cached object and the index.
+        '''
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+
+# =====================================================================
+
+
+def load_cached(url, parse, cache_dir):
+    '''
+    Returns the parsed frame for `url`, using the cache in `cache_dir`.
+
+    `parse` is called with the path of a local copy of the data and must
+    return a pandas DataFrame.
+    '''
+    return DataCache(cache_dir).load(url, parse)
+
+
+def local_copy(url, cache_dir):
+    '''
+    Returns the path of a local copy of the raw data at `url`. Remote
+    data is downloaded into `cache_dir` without being loaded into memory.
+    '''
+    return DataCache(cache_dir).local_copy(url)
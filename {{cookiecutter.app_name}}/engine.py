@@ -0,0 +1,336 @@
+'''
+Evaluation engines used by classifier.evaluate_classifier().
+
+An engine takes a list of (name, classifier) candidates and the
+training and test data (and optionally a modelstore.TrainedModels to
+reuse fitted models from), and yields an EvaluationResult holding the
+test set scores for each candidate as soon as it has been evaluated.
+Once scored with metrics.score_results(), results can be unpacked as
+    (title, precision, recall)
+tuples, with the timings and memory use available as attributes.
+
+Two engines are provided:
+   * SerialEngine evaluates each candidate in turn in this process
+   * ProcessPoolEngine evaluates the candidates in parallel worker
+     processes, so the total time is roughly that of the slowest one
+
+The process pool does not pickle the data for each worker. Instead the
+arrays are saved once to a temporary directory and every worker opens
+them with numpy memory-mapping, so all processes share the same pages
+of the operating system's file cache. Sparse matrices are shared the
+same way, as one file for each of their component arrays.
+'''
+
+import os
+import shutil
+import tempfile
+
+
+# =====================================================================
+
+
+class EvaluationResult(object):
+    '''
+    The outcome of evaluating one classifier.
+
+    Engines return the raw `scores` and `predictions` for the test set;
+    metrics.score_results() then fills in `score` (F1), `precision`,
+    `recall`, `average_precision` and `roc_auc` for all of the results
+    at once.
+
+    Iterating a scored result produces:
+        (title, precision, recall)
+    so results can be used anywhere those tuples are expected. The cost
+    of the classifier is recorded in `fit_time` and `predict_time` (in
+    seconds) and, when memory tracing was requested, `peak_memory` (in
+    bytes allocated through Python, including numpy arrays, while
+    fitting and predicting; otherwise None). When the model was loaded
+    from a model store, `reused` is True and `fit_time` is the time
+    taken to load it.
+    '''
+
+    # Spans recorded in a worker process, until they are replayed into
+    # this process's instrumentation sink
+    spans = None
+
+    def __init__(self, name, scores, predictions, fit_time, predict_time, peak_memory, reused=False):
+        self.name = name
+        self.scores = scores
+        self.predictions = predictions
+        self.score = None
+        self.precision = None
+        self.recall = None
+        self.average_precision = None
+        self.roc_auc = None
+        self.fit_time = fit_time
+        self.predict_time = predict_time
+        self.peak_memory = peak_memory
+        # True if the fitted model was loaded from a model store
+        self.reused = reused
+
+    @property
+    def title(self):
+        if self.score is None:
+            return self.name
+        # Include the score in the title
+        return '{} (F1 score={:.3f})'.format(self.name, self.score)
+
+    def __iter__(self):
+        return iter((self.title, self.precision, self.recall))
+
+    def __repr__(self):
+        return '<EvaluationResult {}: fit {:.3f}s, predict {:.3f}s{}>'.format(
+            self.title, self.fit_time, self.predict_time,
+            '' if self.peak_memory is None else ', peak {:.1f} MB'.format(self.peak_memory / 2**20))
+
+
+def _fit_and_predict(title, classifier, X_train, X_test, y_train, models=None):
+    '''
+    Fits (or loads) `classifier` and predicts `X_test`. Returns a tuple
+    containing:
+        (classifier, reused, y_pred, y_prob, fit_time, predict_time)
+    '''
+    from time import perf_counter
+
+    from instrument import span
+
+    # Fit the classifier
+    start = perf_counter()
+    fitted = None
+    if models is not None:
+        with span('load', classifier=title):
+            fitted = models.get(classifier)
+    if fitted is not None:
+        classifier = fitted
+    else:
+        with span('fit', classifier=title):
+            classifier.fit(X_train, y_train)
+        if models is not None:
+            models.put(title, classifier)
+    fit_time = perf_counter() - start
+
+    start = perf_counter()
+    with span('predict', classifier=title):
+        y_pred = classifier.predict(X_test)
+        # The P-R curve is generated from the decision function, or
+        # from the class probabilities for classifiers without one
+        if hasattr(classifier, 'decision_function'):
+            y_prob = classifier.decision_function(X_test)
+        else:
+            y_prob = classifier.predict_proba(X_test)[:, 1]
+    predict_time = perf_counter() - start
+
+    return classifier, fitted is not None, y_pred, y_prob, fit_time, predict_time
+
+
+def trace_peak(func, *args, **kwargs):
+    '''
+    Calls func(*args, **kwargs) while tracing allocations and returns a
+    tuple containing:
+        (result, peak bytes allocated during the call)
+    Tracing that is already running is left running.
+    '''
+    import tracemalloc
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    try:
+        result = func(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+    return result, peak
+
+
+def evaluate_one(title, classifier, X_train, X_test, y_train, y_test, models=None, trace_memory=False):
+    '''
+    Fits `classifier` and returns an EvaluationResult containing its
+    scores and predictions for `X_test` and timings. Pass the results to
+    metrics.score_results() with `y_test` to calculate the F1 score and
+    P-R curve.
+
+    If `models` (a modelstore.TrainedModels) is given, a previously
+    fitted copy of the classifier is loaded from it instead of fitting,
+    and newly fitted classifiers are saved to it.
+
+    Tracing allocations slows every allocation down, so the timings are
+    always measured without it. With `trace_memory`, the peak memory is
+    measured by fitting a fresh copy of the classifier (or predicting
+    again with a loaded one) in a second, traced pass, which roughly
+    doubles the time this takes.
+    '''
+
+    classifier, reused, y_pred, y_prob, fit_time, predict_time = _fit_and_predict(
+        title, classifier, X_train, X_test, y_train, models)
+
+    peak_memory = None
+    if trace_memory:
+        if reused:
+            _, peak_memory = trace_peak(_fit_and_predict, title, classifier, X_train, X_test, y_train,
+                                        _LoadedModel(classifier))
+        else:
+            from sklearn.base import clone
+            _, peak_memory = trace_peak(_fit_and_predict, title, clone(classifier), X_train, X_test, y_train)
+
+    return EvaluationResult(title, y_prob, y_pred, fit_time, predict_time, peak_memory, reused=reused)
+
+
+class _LoadedModel(object):
+    '''
+    Stands in for a model store holding one already loaded model, so a
+    traced pass does not fit it again.
+    '''
+
+    def __init__(self, fitted):
+        self.fitted = fitted
+
+    def get(self, estimator):
+        return self.fitted
+
+
+def _share(shared_dir, name, arr):
+    '''
+    Saves `arr` under `shared_dir` and returns what _open_shared() needs
+    to open it again: the path of a .npy file for an array, or a tuple of
+    the format, shape and component paths for a sparse matrix.
+    '''
+    import numpy as np
+
+    if hasattr(arr, 'tocsr'):
+        arr = arr.tocsr()
+        paths = []
+        for part in ('data', 'indices', 'indptr'):
+            path = os.path.join(shared_dir, '{}_{}.npy'.format(name, part))
+            np.save(path, getattr(arr, part))
+            paths.append(path)
+        return ('csr', arr.shape) + tuple(paths)
+
+    path = os.path.join(shared_dir, name + '.npy')
+    np.save(path, np.ascontiguousarray(arr))
+    return path
+
+
+def _open_shared(shared):
+    import numpy as np
+
+    if isinstance(shared, tuple):
+        from scipy import sparse
+        _, shape, data, indices, indptr = shared
+        return sparse.csr_matrix(
+            tuple(np.load(p, mmap_mode='r') for p in (data, indices, indptr)), shape=shape, copy=False)
+    return np.load(shared, mmap_mode='r')
+
+
+def _evaluate_shared(title, classifier, paths, models, trace_memory=False, instrumentation=None):
+    '''
+    Worker entry point for ProcessPoolEngine. Opens the shared arrays
+    at `paths` read-only with memory-mapping and evaluates `classifier`.
+
+    The spans recorded while doing so are returned in the result's
+    `spans`, since sinks configured in the parent (or flushed at exit)
+    do not work in worker processes.
+    '''
+    import instrument
+
+    with instrument.collect(instrumentation) as spans:
+        arrays = [_open_shared(p) for p in paths]
+        result = evaluate_one(title, classifier, *arrays, models=models, trace_memory=trace_memory)
+    result.spans = spans or None
+    return result
+
+
+# =====================================================================
+
+
+class SerialEngine(object):
+    '''
+    Evaluates each candidate in turn in the current process.
+    '''
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+
+    def run(self, candidates, X_train, X_test, y_train, y_test, models=None):
+        for title, classifier in candidates:
+            yield evaluate_one(title, classifier, X_train, X_test, y_train, y_test, models, self.trace_memory)
+
+
+class ProcessPoolEngine(object):
+    '''
+    Evaluates candidates in parallel worker processes that share the
+    data through memory-mapped files.
+
+    `max_workers` defaults to one process per candidate, limited to the
+    number of CPUs. `temp_dir` is where the shared arrays are written
+    while the engine runs; it defaults to the system temporary directory.
+    With `trace_memory`, each worker also measures the peak memory of
+    its classifier (see evaluate_one).
+    '''
+
+    def __init__(self, max_workers=None, temp_dir=None, trace_memory=False):
+        self.max_workers = max_workers
+        self.temp_dir = temp_dir
+        self.trace_memory = trace_memory
+
+    def run(self, candidates, X_train, X_test, y_train, y_test, models=None):
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        import instrument
+
+        candidates = list(candidates)
+        if not candidates:
+            return
+
+        max_workers = self.max_workers or min(len(candidates), os.cpu_count() or 1)
+
+        shared_dir = tempfile.mkdtemp(prefix='classifier-', dir=self.temp_dir)
+        try:
+            # Save each array once; workers memory-map these files rather
+            # than receiving their own pickled copy.
+            paths = [
+                _share(shared_dir, name, arr)
+                for name, arr in zip(('X_train', 'X_test', 'y_train', 'y_test'), (X_train, X_test, y_train, y_test))
+            ]
+
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                instrumentation = instrument.settings()
+                futures = [
+                    executor.submit(
+                        _evaluate_shared, title, classifier, paths, models, self.trace_memory, instrumentation)
+                    for title, classifier in candidates
+                ]
+                # Stream each result back as soon as its model finishes
+                for future in as_completed(futures):
+                    result = future.result()
+                    instrument.replay(result.spans)
+                    result.spans = None
+                    yield result
+        finally:
+            shutil.rmtree(shared_dir, ignore_errors=True)
+
+
+# =====================================================================
+
+
+ENGINES = {
+    'serial': SerialEngine,
+    'process': ProcessPoolEngine,
+}
+
+
+def get_engine(engine, trace_memory=False):
+    '''
+    Returns an engine instance for `engine`, which may be the name of a
+    registered engine or an object with a `run` method. `trace_memory`
+    is passed to registered engines.
+    '''
+    if hasattr(engine, 'run'):
+        return engine
+    try:
+        return ENGINES[engine](trace_memory=trace_memory)
+    except KeyError:
+        raise ValueError('unknown evaluation engine {!r}; expected one of {}'.format(
+            engine, ', '.join(sorted(ENGINES))))
@@ -0,0 +1,210 @@
+'''
+Out-of-core training for data sets that do not fit in memory.
+
+classifier.py needs all of the training data in memory to call fit()
+once. This script instead streams the data from URL in chunks (see
+CHUNK_SIZE in classifier.py) and trains learners that support
+partial_fit, one chunk at a time:
+   1. The first pass fits the scaler with partial_fit
+   2. The second pass scales each chunk and passes it to every learner
+Memory use depends on the chunk size and the holdout size, not on the
+size of the data set.
+
+A random fraction of rows is held out for testing and never trained on.
+A fixed-size reservoir sample of those rows is kept for the precision-
+recall evaluation, which is then plotted exactly like the results of
+classifier.py.
+
+The learners are listed in the "incremental" section of the registry
+file (classifiers.json), in the same format as the "classifiers"
+section. Add `"scale": false` to an entry to train it on the unscaled
+data, which MultinomialNB requires because it only accepts non-negative
+values.
+
+Example:
+    python incremental.py --chunk-size 100000 --holdout 50000 --epochs 2
+'''
+
+import argparse
+import sys
+import time
+
+DEFAULT_CHUNK_SIZE = 100000
+DEFAULT_HOLDOUT_SIZE = 100000
+DEFAULT_HOLDOUT_FRACTION = 0.2
+
+
+# =====================================================================
+
+
+class Reservoir(object):
+    '''
+    A uniform random sample of at most `size` rows from a stream of
+    rows of unknown length (Vitter's algorithm R).
+    '''
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self.seen = 0
+        self.X = None
+        self.y = None
+
+    def add(self, X, y):
+        import numpy as np
+
+        if self.X is None:
+            self.X = np.empty((self.size, X.shape[1]), dtype=X.dtype)
+            self.y = np.empty(self.size, dtype=y.dtype)
+
+        # Fill any free slots first
+        free = min(len(X), max(0, self.size - self.seen))
+        self.X[self.seen:self.seen + free] = X[:free]
+        self.y[self.seen:self.seen + free] = y[:free]
+        self.seen += free
+        X, y = X[free:], y[free:]
+        if not len(X):
+            return
+
+        # Row number t replaces a random slot with probability size/t
+        t = self.seen + 1 + np.arange(len(X))
+        slots = (self.rng.random_sample(len(X)) * t).astype(np.int64)
+        keep = slots < self.size
+        self.X[slots[keep]] = X[keep]
+        self.y[slots[keep]] = y[keep]
+        self.seen += len(X)
+
+    def rows(self):
+        n = min(self.seen, self.size)
+        return self.X[:n], self.y[:n]
+
+
+def _split_chunks(chunksize, holdout_fraction, seed):
+    '''
+    Streams the data and yields (X_train, y_train, X_holdout, y_holdout)
+    for each chunk. The same rows are held out on every pass.
+    '''
+    import numpy as np
+    import classifier
+
+    rng = np.random.RandomState(seed)
+    _, chunks = classifier.download_data(chunksize)
+    for chunk in chunks:
+        arr = chunk.to_numpy(dtype=classifier.DTYPE)
+        # Use the last column as the target value, as in classifier.py
+        X, y = arr[:, :-1], arr[:, -1]
+        holdout = rng.random_sample(len(arr)) < holdout_fraction
+        yield X[~holdout], y[~holdout], X[holdout], y[holdout]
+
+
+# =====================================================================
+
+
+def train_incremental(specs, chunksize=DEFAULT_CHUNK_SIZE, holdout_size=DEFAULT_HOLDOUT_SIZE,
+                      holdout_fraction=DEFAULT_HOLDOUT_FRACTION, epochs=1, seed=0, trace_memory=False):
+    '''
+    Trains the learners in `specs` out-of-core and returns a list of
+    engine.EvaluationResult, one per learner, evaluated on the holdout
+    reservoir.
+
+    With `trace_memory`, the peak memory of each learner is measured by
+    repeating every partial_fit on a copy of the learner while tracing
+    allocations, so the fit times are not slowed by the tracing.
+    '''
+    import copy
+    import numpy as np
+    import classifier
+    from engine import EvaluationResult, trace_peak
+    from metrics import score_results
+
+    # First pass: fit the scaler and find the class labels
+    print('Fitting scaler')
+    scaler = classifier.create_scaler()
+    classes = set()
+    rows = 0
+    for X, y, _, _ in _split_chunks(chunksize, holdout_fraction, seed):
+        if len(X):
+            scaler.partial_fit(X)
+        classes.update(np.unique(y).tolist())
+        rows += len(X)
+    classes = np.array(sorted(classes))
+    print('  {} training rows, classes {}'.format(rows, classes.tolist()))
+
+    learners = [(spec, spec.create()) for spec in specs]
+    fit_times = [0.0] * len(learners)
+    peaks = [0 if trace_memory else None] * len(learners)
+
+    reservoir = Reservoir(holdout_size, np.random.RandomState(seed + 1))
+    for epoch in range(epochs):
+        print('Training epoch {} of {}'.format(epoch + 1, epochs))
+        for X, y, X_holdout, y_holdout in _split_chunks(chunksize, holdout_fraction, seed):
+            if epoch == 0:
+                reservoir.add(X_holdout, y_holdout)
+            if not len(X):
+                continue
+
+            X_scaled = scaler.transform(X)
+            for i, (spec, learner) in enumerate(learners):
+                X_fit = X_scaled if spec.scale else X
+                if trace_memory:
+                    _, peak = trace_peak(copy.deepcopy(learner).partial_fit, X_fit, y, classes=classes)
+                    peaks[i] = max(peaks[i], peak)
+                start = time.perf_counter()
+                learner.partial_fit(X_fit, y, classes=classes)
+                fit_times[i] += time.perf_counter() - start
+
+    X_holdout, y_holdout = reservoir.rows()
+    print('Evaluating on {} holdout rows'.format(len(X_holdout)))
+    X_holdout_scaled = scaler.transform(X_holdout)
+
+    results = []
+    for i, (spec, learner) in enumerate(learners):
+        X_eval = X_holdout_scaled if spec.scale else X_holdout
+
+        start = time.perf_counter()
+        y_pred = learner.predict(X_eval)
+        if hasattr(learner, 'decision_function'):
+            y_prob = learner.decision_function(X_eval)
+        else:
+            y_prob = learner.predict_proba(X_eval)[:, 1]
+        predict_time = time.perf_counter() - start
+
+        results.append(EvaluationResult(spec.name, y_prob, y_pred, fit_times[i], predict_time, peaks[i]))
+
+    return score_results(results, y_holdout)
+
+
+def main(argv=None):
+    import classifier
+    from registry import load_registry
+
+    parser = argparse.ArgumentParser(description='Train classifiers out-of-core with partial_fit')
+    parser.add_argument('--chunk-size', type=int, default=classifier.CHUNK_SIZE or DEFAULT_CHUNK_SIZE,
+                        help='rows read and trained on at a time')
+    parser.add_argument('--holdout', type=int, default=DEFAULT_HOLDOUT_SIZE,
+                        help='largest number of held out rows kept for evaluation')
+    parser.add_argument('--holdout-fraction', type=float, default=DEFAULT_HOLDOUT_FRACTION,
+                        help='fraction of rows held out from training')
+    parser.add_argument('--epochs', type=int, default=1, help='passes over the data for each learner')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-plot', action='store_true', help='do not plot the results')
+    args = parser.parse_args(argv)
+
+    specs = load_registry(classifier.REGISTRY_FILE, section='incremental')
+
+    print("Streaming data from {} in chunks of {} rows".format(classifier.URL, args.chunk_size))
+    results = train_incremental(specs, args.chunk_size, args.holdout, args.holdout_fraction, args.epochs, args.seed,
+                                trace_memory=classifier.TRACE_MEMORY)
+    for result in results:
+        print("  {}: fit {:.2f}s, predict {:.2f}s{}".format(
+            result.title, result.fit_time, result.predict_time,
+            '' if result.peak_memory is None else ", peak memory {:.1f} MB".format(result.peak_memory / 2**20)))
+
+    if not args.no_plot:
+        print("Plotting the results")
+        classifier.plot(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
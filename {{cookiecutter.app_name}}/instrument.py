@@ -0,0 +1,412 @@
+'''
+Timing and profiling instrumentation for classifier.py.
+
+Each stage of the script, and the fit and predict steps of every
+classifier, are wrapped in a "span". When instrumentation is enabled,
+every span records its duration, the change in process memory and,
+optionally, a cProfile and/or tracemalloc capture, and sends the record
+to a sink. When it is disabled (the default) a span does nothing beyond
+a single check, so the instrumentation can stay in place permanently.
+
+Instrumentation is controlled with environment variables, so slow runs
+can be diagnosed without editing the script:
+
+    CLASSIFIER_TRACE=stdout             print a table of spans at exit
+    CLASSIFIER_TRACE=jsonl:trace.jsonl  append one JSON object per span
+    CLASSIFIER_PROFILE=cprofile         attach the top cProfile entries
+    CLASSIFIER_PROFILE=tracemalloc      attach peak traced memory
+    CLASSIFIER_PROFILE=cprofile,tracemalloc
+
+It can also be enabled from code with configure(), which additionally
+accepts any callable as a sink:
+
+    import instrument
+    instrument.configure(sink=lambda record: print(record['name']))
+
+Sinks only exist in the process that configured them. Code that runs
+spans in worker processes passes settings() to each worker, records the
+worker's spans with collect(), and sends them back to be passed to this
+process's sink with replay().
+'''
+
+import atexit
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+
+# Number of cProfile entries attached to each span
+PROFILE_ENTRIES = 20
+
+
+# =====================================================================
+# Sinks receive a dictionary for each completed span
+
+
+class StdoutSink(object):
+    '''
+    Collects spans and prints them as a table when flushed, which
+    happens automatically when the process exits.
+    '''
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.records = []
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def flush(self):
+        with self._lock:
+            records, self.records = self.records, []
+        if not records:
+            return
+
+        stream = self.stream or sys.stdout
+        print('{:<48} {:>10} {:>12} {:>12}'.format('span', 'seconds', 'memory (MB)', 'peak (MB)'), file=stream)
+        for r in records:
+            name = '  ' * r['depth'] + r['name']
+            if r.get('classifier'):
+                name += ' [{}]'.format(r['classifier'])
+            print('{:<48} {:>10.3f} {:>12} {:>12}'.format(
+                name[:48],
+                r['duration'],
+                _format_mb(r.get('memory_delta')),
+                _format_mb(r.get('traced_peak')),
+            ), file=stream)
+            if r.get('profile'):
+                print(r['profile'], file=stream)
+
+
+class JsonLinesSink(object):
+    '''
+    Appends each span to `path` as a line of JSON. Several processes
+    may write to the same file.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def flush(self):
+        pass
+
+
+class CallbackSink(object):
+    '''
+    Passes each span to `callback`.
+    '''
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def __call__(self, record):
+        self.callback(record)
+
+    def flush(self):
+        pass
+
+
+def _format_mb(value):
+    if value is None:
+        return '-'
+    return '{:.1f}'.format(value / 2**20)
+
+
+# =====================================================================
+
+
+_sink = None
+_profile = frozenset()
+_local = threading.local()
+
+
+def configure(sink=None, profile=()):
+    '''
+    Enables instrumentation, sending spans to `sink`, or disables it if
+    `sink` is None.
+
+    `sink` may be 'stdout', 'jsonl:<path>', a sink object or any
+    callable accepting a span dictionary. `profile` may include
+    'cprofile' and 'tracemalloc'.
+    '''
+    global _sink, _profile
+
+    if _sink is not None and hasattr(_sink, 'flush'):
+        _sink.flush()
+
+    if sink == 'stdout':
+        sink = StdoutSink()
+    elif isinstance(sink, str) and sink.startswith('jsonl:'):
+        sink = JsonLinesSink(sink[len('jsonl:'):])
+    elif isinstance(sink, str):
+        raise ValueError('unknown instrumentation sink {!r}'.format(sink))
+    elif sink is not None and not hasattr(sink, 'flush'):
+        sink = CallbackSink(sink)
+
+    profile = frozenset(p.strip().lower() for p in profile if p.strip())
+    unknown = profile - {'cprofile', 'tracemalloc'}
+    if unknown:
+        raise ValueError('unknown profile option(s): {}'.format(', '.join(sorted(unknown))))
+
+    _sink = sink
+    _profile = profile
+
+    if 'tracemalloc' in profile and sink is not None:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+def configure_from_environment():
+    '''
+    Configures instrumentation from the CLASSIFIER_TRACE and
+    CLASSIFIER_PROFILE environment variables.
+    '''
+    sink = os.environ.get('CLASSIFIER_TRACE') or None
+    profile = os.environ.get('CLASSIFIER_PROFILE', '').split(',')
+    if sink is None and any(p.strip() for p in profile):
+        # Profiling without a sink would be pointless; default to stdout
+        sink = 'stdout'
+    configure(sink, profile)
+
+
+def enabled():
+    '''
+    Returns True if spans are being recorded.
+    '''
+    return _sink is not None
+
+
+def flush():
+    '''
+    Writes out any spans held by the sink.
+    '''
+    if _sink is not None and hasattr(_sink, 'flush'):
+        _sink.flush()
+
+
+def settings():
+    '''
+    Returns the profile options if spans are being recorded, or None.
+    The value can be sent to worker processes and passed to collect().
+    '''
+    if _sink is None:
+        return None
+    return sorted(_profile)
+
+
+class collect(object):
+    '''
+    Context manager for worker processes that records the spans of the
+    code it wraps into a list, using the `settings` of the parent
+    process, instead of sending them to this process's sink. The list
+    is returned by __enter__; pass it to replay() in the parent.
+    '''
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    def __enter__(self):
+        global _sink, _profile
+        self.previous = _sink, _profile
+        self.records = []
+        if self.settings is not None:
+            _sink = self.records.append
+            _profile = frozenset(self.settings)
+            if 'tracemalloc' in _profile:
+                import tracemalloc
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+        return self.records
+
+    def __exit__(self, exc_type, exc_value, tb):
+        global _sink, _profile
+        _sink, _profile = self.previous
+        return False
+
+
+def replay(records):
+    '''
+    Sends span `records` collected in another process to the sink, as
+    children of the span that is currently open in this thread.
+    '''
+    sink = _sink
+    if sink is None or not records:
+        return
+    depth = len(getattr(_local, 'stack', None) or ())
+    for record in records:
+        record = dict(record)
+        record['depth'] += depth
+        sink(record)
+
+
+# =====================================================================
+
+
+def _current_rss():
+    '''
+    Returns the resident set size of this process in bytes, or None if
+    it cannot be determined cheaply.
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+class _NullSpan(object):
+    '''
+    The span returned while instrumentation is disabled.
+    '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.child_peak = 0
+        self.profiler = None
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.depth = len(stack)
+        stack.append(self)
+
+        if 'tracemalloc' in _profile:
+            import tracemalloc
+            self.traced_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+        # Only one profiler can be active at a time, so nested spans are
+        # included in their parent's profile.
+        if 'cprofile' in _profile and not any(s.profiler for s in stack[:-1]):
+            import cProfile
+            self.profiler = cProfile.Profile()
+
+        self.rss_start = _current_rss()
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        if self.profiler:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.profiler:
+            self.profiler.disable()
+        duration = time.perf_counter() - self.start
+        rss_end = _current_rss()
+
+        stack = _local.stack
+        stack.pop()
+
+        record = dict(self.attrs)
+        record.update({
+            'name': self.name,
+            'depth': self.depth,
+            'pid': os.getpid(),
+            'start': self.wall_start,
+            'duration': duration,
+            'memory_delta': None if rss_end is None or self.rss_start is None else rss_end - self.rss_start,
+        })
+        if exc_type is not None:
+            record['error'] = '{}: {}'.format(exc_type.__name__, exc_value)
+
+        if 'tracemalloc' in _profile:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            # reset_peak() in nested spans hides their peak from us, so
+            # children report theirs back to their parent.
+            peak = max(peak, self.child_peak)
+            record['traced_delta'] = current - self.traced_start
+            record['traced_peak'] = peak - self.traced_start
+            if stack:
+                stack[-1].child_peak = max(stack[-1].child_peak, peak)
+
+        if self.profiler:
+            import io
+            import pstats
+            out = io.StringIO()
+            pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_ENTRIES)
+            record['profile'] = out.getvalue()
+
+        sink = _sink
+        if sink is not None:
+            sink(record)
+        return False
+
+
+def span(name, **attrs):
+    '''
+    Returns a context manager that records the code it wraps as a span
+    called `name`. Keyword arguments are included in the record.
+    '''
+    if _sink is None:
+        return _NULL_SPAN
+    return _Span(name, attrs)
+
+
+def traced(name=None):
+    '''
+    Decorator that records each call to a function as a span. For
+    generator functions the span covers the whole iteration.
+    '''
+    def decorate(func):
+        span_name = name or func.__name__
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if _sink is None:
+                    return func(*args, **kwargs)
+                return _traced_generator(span_name, func(*args, **kwargs))
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if _sink is None:
+                    return func(*args, **kwargs)
+                with _Span(span_name, {}):
+                    return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _traced_generator(name, gen):
+    with _Span(name, {}):
+        for item in gen:
+            yield item
+
+
+# =====================================================================
+
+
+configure_from_environment()
+atexit.register(flush)
@@ -0,0 +1,447 @@
+'''
+Loaders for the data formats and sources that classifier.py can read.
+
+Each loader reads one file into a pandas DataFrame with the same
+interface, and is chosen from the file name:
+    .csv .data .txt     comma separated text (see classifier.read_data)
+    .tsv .tab           tab separated text
+    .gz .bz2            compressed text, for example data.csv.gz
+    .parquet .pq        Parquet (requires pyarrow or fastparquet)
+    .xlsx .xls          Excel (requires openpyxl or xlrd)
+    .svm .libsvm        svmlight/libsvm, read straight into a sparse
+                        matrix (see SvmlightLoader)
+Other names are read as comma separated text.
+
+A source may also name several files (shards), which are read in
+parallel threads and combined into one frame:
+    a directory          every file in the directory
+    a glob pattern       for example 'data/2019-*.csv.gz'
+    store://bucket/path  every object under a prefix in an object store
+The shards are counted first, so the combined array is allocated once
+and each shard is copied into its place as soon as it has been parsed,
+rather than being concatenated at the end.
+
+LocalObjectStore stands in for an object store such as Amazon S3 or
+Azure Blob Storage, using one subdirectory of a local directory per
+bucket. A client for a real store needs the same list() and get()
+methods.
+'''
+
+import glob
+import hashlib
+import os
+import threading
+from abc import ABCMeta, abstractmethod
+
+STORE_SCHEME = 'store://'
+
+TEXT_EXTENSIONS = {'.csv': ',', '.data': ',', '.txt': ',', '.tsv': '\t', '.tab': '\t'}
+COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2'}
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+SVMLIGHT_EXTENSIONS = ('.svm', '.svmlight', '.libsvm')
+
+
+def _code_key(func):
+    '''
+    Returns a short string that changes whenever `func` is edited.
+    '''
+    code = func.__code__
+    key = hashlib.sha256(code.co_code)
+    key.update(repr(code.co_consts).encode('utf-8'))
+    key.update(repr(code.co_names).encode('utf-8'))
+    return key.hexdigest()[:16]
+
+
+# =====================================================================
+
+
+class Loader(object, metaclass=ABCMeta):
+    '''
+    Reads files of one format into DataFrames, converting the values to
+    `dtype` if it is not None. Subclasses implement read(), and may
+    override count_rows() and read_chunks() when the format allows
+    counting or streaming rows without reading the whole file.
+
+    A loader can be passed to datacache.load_cached() as the parsing
+    function; cache_key() tells the cache when the parsing has changed.
+    Loaders with `sparse` set return an (inputs, targets) tuple instead
+    of a DataFrame, and cannot be cached or read in chunks.
+    '''
+
+    sparse = False
+
+    def __init__(self, dtype=None):
+        self.dtype = dtype
+
+    def __call__(self, path):
+        return self.read(path)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(k, v) for k, v in sorted(self._options().items())))
+
+    def _options(self):
+        return {'dtype': None if self.dtype is None else str(self.dtype)}
+
+    def cache_key(self):
+        '''
+        Returns a string that changes with the code and options used to
+        read files.
+        '''
+        return '{}:{}'.format(repr(self), _code_key(type(self).read))
+
+    @abstractmethod
+    def read(self, path):
+        '''
+        Returns the contents of `path` as a DataFrame.
+        '''
+
+    def count_rows(self, path, decompress=True):
+        '''
+        Returns an upper bound on the number of rows in `path` without
+        parsing it, or None if that is not possible. Without
+        `decompress`, None is also returned when counting would mean
+        decompressing the whole file.
+        '''
+        return None
+
+    def read_chunks(self, path, chunksize):
+        '''
+        Yields the rows of `path` as DataFrames of at most `chunksize`
+        rows. This loader reads the whole file first.
+        '''
+        frame = self.read(path)
+        for start in range(0, len(frame), chunksize):
+            yield frame.iloc[start:start + chunksize]
+
+
+class TextLoader(Loader):
+    '''
+    Reads delimited text files with classifier.read_data(), or with the
+    `parse` function if one is given.
+    '''
+
+    def __init__(self, dtype=None, sep=',', compression='infer', parse=None):
+        super(TextLoader, self).__init__(dtype)
+        self.sep = sep
+        self.compression = compression
+        self.parse = parse
+
+    def _options(self):
+        options = super(TextLoader, self)._options()
+        options.update(sep=self.sep, compression=self.compression)
+        return options
+
+    def _parse(self):
+        if self.parse is not None:
+            return self.parse
+        from classifier import read_data
+        return read_data
+
+    def cache_key(self):
+        # Editing the read options in classifier.read_data must also
+        # invalidate cached data
+        return '{}:{}'.format(super(TextLoader, self).cache_key(), _code_key(self._parse()))
+
+    def read(self, path, chunksize=None):
+        return self._parse()(path, chunksize=chunksize, dtype=self.dtype, sep=self.sep, compression=self.compression)
+
+    def count_rows(self, path, decompress=True):
+        if '://' in path:
+            return None
+        compression = self.compression
+        if compression == 'infer':
+            compression = COMPRESSION_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+        if compression and not decompress:
+            return None
+        from classifier import count_rows
+        return count_rows(path, self.compression)
+
+    def read_chunks(self, path, chunksize):
+        return self.read(path, chunksize=chunksize)
+
+
+class ParquetLoader(Loader):
+    '''
+    Reads Parquet files. Requires pyarrow or fastparquet.
+    '''
+
+    def read(self, path):
+        from pandas import read_parquet
+        frame = read_parquet(path)
+        if self.dtype is not None:
+            frame = frame.astype(self.dtype, copy=False)
+        return frame
+
+    def count_rows(self, path, decompress=True):
+        # The row count is in the file metadata
+        try:
+            from pyarrow.parquet import ParquetFile
+        except ImportError:
+            return None
+        return ParquetFile(path).metadata.num_rows
+
+
+class ExcelLoader(Loader):
+    '''
+    Reads the first sheet of Excel files. Requires openpyxl (or xlrd for
+    .xls files).
+    '''
+
+    def read(self, path):
+        from pandas import read_excel
+        return read_excel(path, header=None, dtype=self.dtype)
+
+
+class SvmlightLoader(Loader):
+    '''
+    Reads svmlight/libsvm files into a tuple containing:
+        (CSR matrix of inputs, array of targets)
+    so sparse data is never expanded into a dense frame. The targets
+    are converted to `dtype` as well.
+    '''
+
+    sparse = True
+
+    def __init__(self, dtype=None, compression=None):
+        super(SvmlightLoader, self).__init__(dtype)
+        self.compression = compression
+
+    def _options(self):
+        options = super(SvmlightLoader, self)._options()
+        options.update(compression=self.compression)
+        return options
+
+    def _open(self, path):
+        # load_svmlight_file detects compression from the file name,
+        # which local copies of downloaded files do not keep
+        if self.compression == 'gzip':
+            import gzip
+            return gzip.open(path, 'rb')
+        if self.compression == 'bz2':
+            import bz2
+            return bz2.open(path, 'rb')
+        return open(path, 'rb')
+
+    def read(self, path):
+        return self.read_files([path])
+
+    def read_files(self, paths):
+        '''
+        Returns the rows of all of `paths`, in order, as one tuple of
+        (inputs, targets). The files may use different numbers of
+        attributes; the inputs have as many columns as the widest one.
+        '''
+        import numpy as np
+        from scipy import sparse
+        from sklearn.datasets import load_svmlight_files
+
+        dtype = np.dtype(self.dtype or 'float64')
+        files = [self._open(path) for path in paths]
+        try:
+            loaded = load_svmlight_files(files, dtype=dtype)
+        finally:
+            for f in files:
+                f.close()
+
+        X = sparse.vstack(loaded[0::2], format='csr') if len(paths) > 1 else loaded[0]
+        y = np.concatenate(loaded[1::2]).astype(dtype, copy=False)
+        return X, y
+
+
+def get_loader(name, dtype=None):
+    '''
+    Returns the loader for the file or URL `name`, chosen by its
+    extension.
+    '''
+    base, ext = os.path.splitext(name.lower())
+    compression = COMPRESSION_EXTENSIONS.get(ext)
+    if compression:
+        base, ext = os.path.splitext(base)
+
+    if ext in PARQUET_EXTENSIONS:
+        return ParquetLoader(dtype)
+    if ext in EXCEL_EXTENSIONS:
+        return ExcelLoader(dtype)
+    if ext in SVMLIGHT_EXTENSIONS:
+        return SvmlightLoader(dtype, compression=compression)
+    # The compression is given explicitly because cached copies of
+    # downloaded files do not keep the original name
+    return TextLoader(dtype, sep=TEXT_EXTENSIONS.get(ext, ','), compression=compression)
+
+
+# =====================================================================
+
+
+class LocalObjectStore(object):
+    '''
+    An object store kept in the local directory `root`. Each bucket is a
+    subdirectory, and the keys of its objects are their paths relative
+    to the bucket, using '/' as the separator.
+    '''
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _bucket_dir(self, bucket):
+        path = os.path.join(self.root, bucket)
+        if not os.path.isdir(path):
+            raise FileNotFoundError('no bucket {!r} in {}'.format(bucket, self.root))
+        return path
+
+    def list(self, bucket, prefix=''):
+        '''
+        Returns the sorted keys in `bucket` that start with `prefix`.
+        '''
+        bucket_dir = self._bucket_dir(bucket)
+        keys = []
+        for dirpath, dirnames, filenames in os.walk(bucket_dir):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for filename in filenames:
+                if filename.startswith('.'):
+                    continue
+                key = os.path.relpath(os.path.join(dirpath, filename), bucket_dir).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    def get(self, bucket, key):
+        '''
+        Returns the path of a local file holding the object `key`. A
+        remote store would download the object to a temporary file.
+        '''
+        path = os.path.join(self._bucket_dir(bucket), *key.split('/'))
+        if not os.path.isfile(path):
+            raise FileNotFoundError('no object {!r} in bucket {!r}'.format(key, bucket))
+        return path
+
+
+def find_shards(source, store_dir=None):
+    '''
+    Returns the list of files named by `source`, which may be a single
+    file or URL, a directory, a glob pattern, or a store://bucket/prefix
+    URL for the LocalObjectStore in `store_dir`.
+    '''
+    if source.startswith(STORE_SCHEME):
+        if not store_dir:
+            raise ValueError('an object store directory is needed to read {}'.format(source))
+        bucket, _, prefix = source[len(STORE_SCHEME):].partition('/')
+        store = LocalObjectStore(store_dir)
+        paths = [store.get(bucket, key) for key in store.list(bucket, prefix)]
+    elif '://' in source:
+        return [source]
+    elif os.path.isdir(source):
+        paths = sorted(
+            os.path.join(source, name) for name in os.listdir(source)
+            # Skip hidden files and markers such as _SUCCESS
+            if not name.startswith(('.', '_')) and os.path.isfile(os.path.join(source, name))
+        )
+    elif glob.has_magic(source):
+        paths = sorted(glob.glob(source))
+    else:
+        return [source]
+
+    if not paths:
+        raise FileNotFoundError('no files found for {}'.format(source))
+    return paths
+
+
+# =====================================================================
+
+
+def _read_array(loader, path, dtype):
+    import numpy as np
+    return np.ascontiguousarray(loader.read(path).to_numpy(dtype=dtype))
+
+
+def read_shards(paths, dtype=None, max_workers=None, loader=None):
+    '''
+    Reads the files in `paths` in parallel and returns a DataFrame of
+    all their rows, in order. Every file must have the same number of
+    numeric columns, which are converted to `dtype` (float64 by default).
+
+    Each file is read with `loader`, or with the loader for its name.
+    '''
+    import numpy as np
+    from concurrent.futures import ThreadPoolExecutor
+    from pandas import DataFrame
+
+    dtype = np.dtype(dtype or 'float64')
+    loaders = [loader or get_loader(path, dtype) for path in paths]
+    arrays = None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Counting a compressed shard costs as much as parsing it, so
+        # only shards that can be counted cheaply are counted
+        counts = list(executor.map(lambda i: loaders[i].count_rows(paths[i], decompress=False), range(len(paths))))
+        if None in counts:
+            # Read the other shards first, once, and copy them into
+            # place with the rest
+            unknown = [i for i, count in enumerate(counts) if count is None]
+            arrays = [None] * len(paths)
+            for i, arr in zip(unknown, executor.map(lambda i: _read_array(loaders[i], paths[i], dtype), unknown)):
+                arrays[i] = arr
+                counts[i] = len(arr)
+
+        offsets = [0]
+        for count in counts:
+            offsets.append(offsets[-1] + count)
+        combined = []
+        lock = threading.Lock()
+
+        def fill(i):
+            arr = arrays[i] if arrays is not None else None
+            if arr is None:
+                arr = _read_array(loaders[i], paths[i], dtype)
+            else:
+                arrays[i] = None
+            if len(arr) > counts[i]:
+                raise ValueError('{} has more than the expected {} rows'.format(paths[i], counts[i]))
+            with lock:
+                # The first shard to finish decides the number of columns
+                if not combined:
+                    combined.append(np.empty((offsets[-1], arr.shape[1]), dtype=dtype))
+            out = combined[0]
+            if arr.shape[1] != out.shape[1]:
+                raise ValueError('{} has {} columns, not {}'.format(paths[i], arr.shape[1], out.shape[1]))
+            out[offsets[i]:offsets[i] + len(arr)] = arr
+            return len(arr)
+
+        rows = list(executor.map(fill, range(len(paths))))
+
+    if not combined:
+        return DataFrame()
+    out = combined[0]
+
+    # Row counts are upper bounds (blank lines are counted but not
+    # read), so close any gaps by moving the shards down in place
+    end = 0
+    for offset, n in zip(offsets, rows):
+        if offset != end:
+            out[end:end + n] = out[offset:offset + n]
+        end += n
+
+    return DataFrame(out[:end], copy=False)
+
+
+def iter_chunks(paths, chunksize, dtype=None, loader=None):
+    '''
+    Returns a tuple containing:
+        (max_rows, chunks)
+    where `chunks` yields the rows of every file in `paths`, in order, as
+    DataFrames of at most `chunksize` rows, and `max_rows` is an upper
+    bound on the total number of rows.
+    '''
+    loaders = [loader or get_loader(path, dtype) for path in paths]
+    counts = [l.count_rows(path) for l, path in zip(loaders, paths)]
+    if None in counts:
+        unknown = paths[counts.index(None)]
+        raise ValueError('cannot count the rows of {} without reading it; load it without a chunk size'.format(unknown))
+
+    def chunks():
+        for l, path in zip(loaders, paths):
+            for chunk in l.read_chunks(path, chunksize):
+                yield chunk
+
+    return sum(counts), chunks()
@@ -0,0 +1,182 @@
+'''
+Vectorized metrics for comparing many classifiers at once.
+
+Calling f1_score and precision_recall_curve separately for every model
+sorts and scans the test labels again each time, and keeps a full-length
+curve per model. Here the scores of all models are stacked into a
+single (samples x models) matrix, sorted once with one argsort, and the
+F1 score, average precision, ROC AUC and precision-recall curve of every
+model are computed from the same cumulative counts.
+
+The sort and the cumulative counts need several (samples x models)
+arrays, so the models are processed a block of columns at a time to
+keep the peak memory to a few copies of one block rather than of the
+whole matrix.
+
+Curves are downsampled to a fixed number of operating points (spaced
+evenly in recall), so the memory needed to plot them no longer grows
+with the size of the test set.
+
+F1, average precision and ROC AUC match scikit-learn's f1_score,
+average_precision_score and roc_auc_score, including the handling of
+tied scores. Each curve is a subset of the points returned by
+precision_recall_curve, not the full curve.
+'''
+
+# Number of points kept on each precision-recall curve
+DEFAULT_CURVE_POINTS = 200
+
+# Number of models whose metrics are computed together
+DEFAULT_BLOCK_COLUMNS = 16
+
+
+class Metrics(object):
+    '''
+    Metrics for several models. `f1`, `average_precision` and `roc_auc`
+    are arrays with one value per model, and `curves` is a list of
+    (precision, recall) arrays, one pair per model.
+    '''
+
+    def __init__(self, f1, average_precision, roc_auc, curves):
+        self.f1 = f1
+        self.average_precision = average_precision
+        self.roc_auc = roc_auc
+        self.curves = curves
+
+
+def compute_metrics(y_true, scores, predictions=None, curve_points=DEFAULT_CURVE_POINTS, pos_label=1,
+                    block_columns=DEFAULT_BLOCK_COLUMNS):
+    '''
+    Computes the metrics for every column of `scores` (and of the
+    matching column of `predictions`, which is needed for F1) against
+    the labels `y_true`, `block_columns` models at a time.
+    '''
+    import numpy as np
+
+    y = np.asarray(y_true) == pos_label
+    scores = np.asarray(scores)
+    if scores.ndim == 1:
+        scores = scores[:, None]
+    if predictions is not None:
+        predictions = np.asarray(predictions)
+        if predictions.ndim == 1:
+            predictions = predictions[:, None]
+    m = scores.shape[1]
+
+    f1, average_precision, roc_auc, curves = [], [], [], []
+    for start in range(0, m, max(1, block_columns)):
+        block = slice(start, start + max(1, block_columns))
+        metrics = _block_metrics(
+            y, scores[:, block], predictions[:, block] if predictions is not None else None,
+            curve_points, pos_label)
+        f1.append(metrics.f1)
+        average_precision.append(metrics.average_precision)
+        roc_auc.append(metrics.roc_auc)
+        curves.extend(metrics.curves)
+
+    if not curves:
+        return Metrics(np.empty(0), np.empty(0), np.empty(0), [])
+    return Metrics(np.concatenate(f1), np.concatenate(average_precision), np.concatenate(roc_auc), curves)
+
+
+def _block_metrics(y, scores, predictions, curve_points, pos_label):
+    '''
+    Computes the metrics of the models in the columns of `scores`
+    against the boolean labels `y`.
+    '''
+    import numpy as np
+
+    n, m = scores.shape
+    n_pos = int(y.sum())
+    n_neg = n - n_pos
+
+    # One sort for every model: highest score first. A stable sort keeps
+    # tied rows in their original order.
+    order = np.argsort(-scores, axis=0, kind='mergesort')
+    sorted_scores = np.take_along_axis(scores, order, axis=0)
+    sorted_y = y[order]
+    del order
+
+    tp = np.cumsum(sorted_y, axis=0, dtype=np.int64)
+    seen = np.arange(1, n + 1, dtype=np.int64)[:, None]
+
+    # A threshold only exists where the score changes; tied rows share
+    # the counts at the last row of their group.
+    rows = np.arange(n)[:, None]
+    is_last = np.ones((n, m), dtype=bool)
+    is_last[:-1] = sorted_scores[1:] != sorted_scores[:-1]
+    is_first = np.ones((n, m), dtype=bool)
+    is_first[1:] = is_last[:-1]
+    del sorted_scores
+
+    group_end = np.minimum.accumulate(np.where(is_last, rows, n)[::-1], axis=0)[::-1]
+    group_start = np.maximum.accumulate(np.where(is_first, rows, -1), axis=0)
+    del is_first
+
+    precision = tp / seen
+    precision_at_end = np.take_along_axis(precision, group_end, axis=0)
+
+    # Average precision: each positive adds 1/n_pos recall at the
+    # precision of its threshold
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average_precision = (sorted_y * precision_at_end).sum(axis=0) / n_pos
+    del precision_at_end
+
+    # ROC AUC from the average ascending rank of each positive
+    # (Mann-Whitney U), which counts ties as half
+    ranks = n - (group_start + group_end) / 2.0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        roc_auc = ((sorted_y * ranks).sum(axis=0) - n_pos * (n_pos + 1) / 2.0) / (n_pos * n_neg)
+    del ranks, group_start, group_end, sorted_y
+
+    # F1 from the predicted labels
+    if predictions is not None:
+        predicted = predictions == pos_label
+        true_pos = (predicted & y[:, None]).sum(axis=0)
+        predicted_pos = predicted.sum(axis=0)
+        del predicted
+        with np.errstate(invalid='ignore', divide='ignore'):
+            f1 = np.where(predicted_pos + n_pos > 0, 2.0 * true_pos / (predicted_pos + n_pos), 0.0)
+    else:
+        f1 = np.full(m, np.nan)
+
+    # Downsampled P-R curves: the operating points closest to evenly
+    # spaced recall values, in the order precision_recall_curve uses
+    # (decreasing recall, ending at recall 0 and precision 1)
+    curves = []
+    targets = np.linspace(0, n_pos, curve_points)
+    for j in range(m):
+        ends = np.flatnonzero(is_last[:, j])
+        tp_j = tp[ends, j]
+        idx = np.unique(np.minimum(np.searchsorted(tp_j, targets), len(ends) - 1))
+        p = np.r_[precision[ends[idx], j][::-1], 1.0]
+        r = np.r_[(tp_j[idx] / n_pos if n_pos else np.zeros(len(idx)))[::-1], 0.0]
+        curves.append((p, r))
+
+    return Metrics(f1, average_precision, roc_auc, curves)
+
+
+def score_results(results, y_true, curve_points=DEFAULT_CURVE_POINTS):
+    '''
+    Fills in the metrics of engine.EvaluationResult objects from their
+    `scores` and `predictions` in one pass, then releases those arrays.
+    Returns `results`.
+    '''
+    import numpy as np
+
+    results = list(results)
+    if not results:
+        return results
+
+    scores = np.column_stack([r.scores for r in results])
+    predictions = np.column_stack([r.predictions for r in results])
+    metrics = compute_metrics(y_true, scores, predictions, curve_points)
+
+    for j, result in enumerate(results):
+        result.score = float(metrics.f1[j])
+        result.average_precision = float(metrics.average_precision[j])
+        result.roc_auc = float(metrics.roc_auc[j])
+        result.precision, result.recall = metrics.curves[j]
+        result.scores = result.predictions = None
+
+    return results
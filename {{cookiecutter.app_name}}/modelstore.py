@@ -0,0 +1,203 @@
+'''
+A store of fitted models for classifier.py.
+
+Each fitted classifier is saved together with the scaler that prepared
+its data as a scikit-learn Pipeline. Models are keyed by a hash of the
+training data and of the classifier's class and parameters, so a model
+is only reused when it would have been trained identically.
+
+Models are saved with joblib without compression, which allows the
+numpy arrays inside them (such as NuSVC support vectors or the trees
+of an AdaBoost ensemble) to be memory-mapped when loaded. Loading a
+stored model therefore takes milliseconds regardless of its size, and
+several processes scoring with the same model share its memory.
+
+Layout of the store directory:
+    <key>/model.joblib   the fitted pipeline
+    <key>/model.json     the name, class, parameters and creation time
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+MODEL_FILE = 'model.joblib'
+METADATA_FILE = 'model.json'
+
+# Size of the blocks hashed at a time, so large arrays are not copied
+HASH_BLOCK_ROWS = 65536
+
+
+# =====================================================================
+
+
+def data_key(*arrays):
+    '''
+    Returns a hash of the shape, type and contents of `arrays`.
+    '''
+    import numpy as np
+
+    digest = hashlib.sha256()
+    for arr in arrays:
+        digest.update('{}:{}:'.format(arr.shape, arr.dtype.str).encode('ascii'))
+        if hasattr(arr, 'tocsr'):
+            # Hash the stored values and their positions of sparse matrices
+            arr = arr.tocsr()
+            digest.update(b'csr:')
+            digest.update(np.ascontiguousarray(arr.data).data)
+            # The index type depends on how the matrix was built
+            for part in (arr.indices, arr.indptr):
+                digest.update(np.ascontiguousarray(part, dtype=np.int64).data)
+            continue
+        for start in range(0, len(arr), HASH_BLOCK_ROWS):
+            digest.update(np.ascontiguousarray(arr[start:start + HASH_BLOCK_ROWS]).data)
+    return digest.hexdigest()
+
+
+def estimator_key(estimator):
+    '''
+    Returns a hash of the class and parameters of an unfitted estimator.
+    '''
+    cls = type(estimator)
+    params = estimator.get_params(deep=True)
+    text = json.dumps(
+        {'class': cls.__module__ + '.' + cls.__name__, 'params': params},
+        sort_keys=True,
+        default=repr,
+    )
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+# =====================================================================
+
+
+class ModelStore(object):
+    '''
+    Saves and loads fitted pipelines in `store_dir`.
+    '''
+
+    def __init__(self, store_dir):
+        self.store_dir = os.path.abspath(store_dir)
+
+    def key(self, data_key, estimator):
+        '''
+        Returns the key for `estimator` trained on the data identified
+        by `data_key`.
+        '''
+        return hashlib.sha256('{}:{}'.format(data_key, estimator_key(estimator)).encode('ascii')).hexdigest()[:32]
+
+    def exists(self, key):
+        return os.path.isfile(os.path.join(self.store_dir, key, METADATA_FILE))
+
+    def save(self, key, pipeline, **metadata):
+        '''
+        Saves a fitted `pipeline` under `key` with optional metadata.
+        '''
+        import joblib
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=self.store_dir, suffix='.tmp')
+        try:
+            # Compression must stay off for the arrays to be memory-mapped
+            joblib.dump(pipeline, os.path.join(tmp_dir, MODEL_FILE), compress=0)
+
+            metadata.setdefault('created', time.time())
+            metadata['key'] = key
+            with open(os.path.join(tmp_dir, METADATA_FILE), 'w', encoding='utf-8') as f:
+                json.dump(metadata, f, indent=2, sort_keys=True, default=repr)
+
+            target = os.path.join(self.store_dir, key)
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            os.replace(tmp_dir, target)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    def load(self, key, mmap_mode='r'):
+        '''
+        Returns the pipeline saved under `key`, with its arrays memory-
+        mapped (unless `mmap_mode` is None), or None if there is none.
+        '''
+        import joblib
+
+        if not self.exists(key):
+            return None
+        return joblib.load(os.path.join(self.store_dir, key, MODEL_FILE), mmap_mode=mmap_mode)
+
+    def metadata(self, key):
+        with open(os.path.join(self.store_dir, key, METADATA_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def list(self):
+        '''
+        Returns the metadata of every stored model, newest first.
+        '''
+        if not os.path.isdir(self.store_dir):
+            return []
+        models = [self.metadata(key) for key in os.listdir(self.store_dir) if self.exists(key)]
+        models.sort(key=lambda m: m.get('created', 0), reverse=True)
+        return models
+
+    def latest(self, name=None):
+        '''
+        Returns the key of the newest model, optionally only considering
+        models called `name`, or None if there are none.
+        '''
+        for meta in self.list():
+            if name is None or meta.get('name') == name:
+                return meta['key']
+        return None
+
+    def for_data(self, X_train, y_train, scaler):
+        '''
+        Returns a TrainedModels view of this store for classifiers
+        trained on `X_train` and `y_train` after scaling with `scaler`.
+        '''
+        return TrainedModels(self.store_dir, data_key(X_train, y_train), scaler)
+
+
+class TrainedModels(object):
+    '''
+    The models in a store that were trained on one particular data set.
+
+    This object is small and can be sent to worker processes, which
+    then load and save models directly.
+    '''
+
+    def __init__(self, store_dir, data_key, scaler):
+        self.store_dir = store_dir
+        self.data_key = data_key
+        self.scaler = scaler
+
+    def get(self, estimator):
+        '''
+        Returns the fitted equivalent of `estimator`, memory-mapped from
+        the store, or None if it has not been trained yet.
+        '''
+        store = ModelStore(self.store_dir)
+        pipeline = store.load(store.key(self.data_key, estimator))
+        if pipeline is None:
+            return None
+        return pipeline.steps[-1][1]
+
+    def put(self, name, classifier):
+        '''
+        Saves the fitted `classifier` together with the scaler.
+        '''
+        from sklearn.pipeline import Pipeline
+
+        store = ModelStore(self.store_dir)
+        pipeline = Pipeline([('scaler', self.scaler), ('classifier', classifier)])
+        cls = type(classifier)
+        store.save(
+            store.key(self.data_key, classifier),
+            pipeline,
+            name=name,
+            data_key=self.data_key,
+            estimator=cls.__module__ + '.' + cls.__name__,
+            params=classifier.get_params(),
+        )
@@ -0,0 +1,220 @@
+'''
+Scores new data with a model trained by classifier.py.
+
+The scaler and classifier are loaded from the model store (MODEL_DIR in
+classifier.py) with their arrays memory-mapped. The input file is read
+in batches, parsed with the same options as the training data (see
+classifier.read_data), and each batch is scaled and scored before the
+next one is read, so memory use depends on the batch size rather than
+the size of the input.
+
+For every input row the output file contains the classifier's score
+(from decision_function, or the probability of the positive class) and
+the predicted label, separated by a comma. Output is written as each
+batch completes.
+
+With --workers, the input is split into byte ranges at line boundaries
+and each range is scored by a separate process. Each process writes its
+own part of the output, and the parts are joined in order at the end.
+
+Examples:
+    python predict.py new_data.csv scores.csv
+    python predict.py new_data.csv scores.csv --model "Linear SVC" --workers 8
+'''
+
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Lines read from the input file at a time
+DEFAULT_BATCH_SIZE = 50000
+
+
+# =====================================================================
+
+
+def load_model(model_dir, name=None, key=None):
+    '''
+    Returns the (key, pipeline) of the stored model with `key`, or the
+    newest model called `name`, or the newest model if neither is given.
+    '''
+    from modelstore import ModelStore
+
+    store = ModelStore(model_dir)
+    if key is None:
+        key = store.latest(name)
+    if key is None:
+        raise LookupError('no trained model{} found in {}'.format(
+            ' called {!r}'.format(name) if name else '', model_dir))
+
+    pipeline = store.load(key)
+    if pipeline is None:
+        raise LookupError('model {} not found in {}'.format(key, model_dir))
+    return key, pipeline
+
+
+def score_batch(pipeline, X):
+    '''
+    Returns the scores and predicted labels for the rows of `X`.
+    '''
+    # Scale once and use the result for both scores and predictions
+    *transforms, (_, classifier) = pipeline.steps
+    for _, step in transforms:
+        X = step.transform(X)
+
+    if hasattr(classifier, 'decision_function'):
+        scores = classifier.decision_function(X)
+    else:
+        scores = classifier.predict_proba(X)[:, 1]
+    return scores, classifier.predict(X)
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        import gzip
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        import bz2
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _read_batches(path, start, end, batch_size):
+    '''
+    Yields lists of up to `batch_size` lines from `path`, starting at
+    the first full line at or after byte `start` and ending with the line
+    that contains byte `end - 1`. If `end` is None, reads to the end.
+    '''
+    with _open(path) as f:
+        if start > 0:
+            # Skip the partial line, which belongs to the previous range
+            f.seek(start - 1)
+            f.readline()
+
+        batch = []
+        while end is None or f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            batch.append(line)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def score_range(model_dir, key, input_path, start, end, output_path, batch_size, has_labels=False):
+    '''
+    Scores the rows of `input_path` in the byte range [start, end) and
+    writes the results to `output_path`. Returns the number of rows.
+
+    Pass start=0 and end=None to score the whole file, which is also
+    the only option for compressed files.
+    '''
+    import numpy as np
+    import classifier
+
+    _, pipeline = load_model(model_dir, key=key)
+
+    rows = 0
+    with open(output_path, 'wb') as out:
+        for lines in _read_batches(input_path, start, end, batch_size):
+            # Parse with the same options that were used for training
+            frame = classifier.read_data(io.BytesIO(b''.join(lines)), dtype=classifier.DTYPE)
+            X = frame.to_numpy(dtype=classifier.DTYPE)
+            if has_labels:
+                # Drop the label, as in get_features_and_labels()
+                X = X[:, :-1]
+
+            scores, labels = score_batch(pipeline, X)
+            np.savetxt(out, np.column_stack([scores, labels]), fmt=['%.6g', '%g'], delimiter=',')
+            out.flush()
+            rows += len(X)
+
+    return rows
+
+
+def _split_ranges(path, parts):
+    '''
+    Returns `parts` (start, end) byte ranges covering the file.
+    '''
+    size = os.path.getsize(path)
+    step = max(1, size // parts)
+    bounds = [min(i * step, size) for i in range(parts)] + [size]
+    return [(bounds[i], bounds[i + 1]) for i in range(parts) if bounds[i] < bounds[i + 1]]
+
+
+# =====================================================================
+
+
+def predict(input_path, output_path, model_dir, name=None, key=None,
+            batch_size=DEFAULT_BATCH_SIZE, workers=1, has_labels=False):
+    '''
+    Scores `input_path` into `output_path` and returns the number of
+    rows scored.
+    '''
+    key, _ = load_model(model_dir, name, key)
+
+    if input_path.endswith(('.gz', '.bz2')) and workers > 1:
+        # Compressed files cannot be split by byte ranges
+        print('Compressed input cannot be split; using one worker')
+        workers = 1
+
+    if workers <= 1:
+        return score_range(model_dir, key, input_path, 0, None, output_path, batch_size, has_labels)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    ranges = _split_ranges(input_path, workers)
+    part_dir = tempfile.mkdtemp(prefix='predict-', dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        parts = [os.path.join(part_dir, 'part{:04d}'.format(i)) for i in range(len(ranges))]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(score_range, model_dir, key, input_path, start, end, part, batch_size, has_labels)
+                for (start, end), part in zip(ranges, parts)
+            ]
+            rows = sum(f.result() for f in futures)
+
+        # Join the parts in input order
+        with open(output_path, 'wb') as out:
+            for part in parts:
+                with open(part, 'rb') as f:
+                    shutil.copyfileobj(f, out)
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
+
+    return rows
+
+
+def main(argv=None):
+    import classifier
+
+    parser = argparse.ArgumentParser(description='Score a data file with a trained model')
+    parser.add_argument('input', help='file containing the rows to score')
+    parser.add_argument('output', help='file to write the scores and predicted labels to')
+    parser.add_argument('--model', help='name of the classifier to use (default: the newest model)')
+    parser.add_argument('--key', help='key of a specific stored model')
+    parser.add_argument('--model-dir', default=classifier.MODEL_DIR, help='model store directory')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='rows scored at a time')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes to score with')
+    parser.add_argument('--has-labels', action='store_true',
+                        help='the input includes the label as its last column, which is ignored')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    rows = predict(args.input, args.output, args.model_dir, args.model, args.key,
+                   args.batch_size, args.workers, args.has_labels)
+    elapsed = time.perf_counter() - start
+
+    print('Scored {} rows in {:.2f}s ({:.0f} rows/sec)'.format(rows, elapsed, rows / elapsed if elapsed else 0))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+'''
+The registry of classifiers evaluated by classifier.py.
+
+Candidates are listed in a JSON file (classifiers.json by default), so
+classifiers can be added, removed or re-tuned without editing code:
+
+    {
+      "classifiers": [
+        {
+          "name": "Linear SVC",
+          "class": "sklearn.svm.LinearSVC",
+          "params": {"C": 1}
+        },
+        ...
+      ]
+    }
+
+`class` is the full import path of any scikit-learn compatible
+estimator, and `params` are passed to its constructor. Set `"enabled":
+false` to keep an entry in the file without evaluating it.
+
+Add `"sparse": false` to estimators that cannot be trained on a
+scipy.sparse matrix; they are skipped when classifier.SPARSE is set.
+
+The "incremental" section lists learners that support partial_fit for
+incremental.py, in the same format. `"scale": false` trains an entry on
+the unscaled data.
+
+An entry may also have a `search` section describing the range of each
+parameter for tuning.py to explore. Each parameter is one of
+    {"uniform": [low, high]}
+    {"log_uniform": [low, high]}
+    {"int_uniform": [low, high]}
+    {"choice": [value, value, ...]}
+'''
+
+import json
+from importlib import import_module
+
+
+class ClassifierSpec(object):
+    '''
+    A named estimator class and the parameters to construct it with.
+    '''
+
+    def __init__(self, name, class_path, params=None, enabled=True, search=None, scale=True, sparse=True):
+        self.name = name
+        self.class_path = class_path
+        self.params = dict(params or {})
+        self.enabled = enabled
+        self.search = dict(search or {})
+        # False for estimators that must see the unscaled data
+        self.scale = scale
+        # False for estimators that only accept dense inputs
+        self.sparse = sparse
+
+    def __repr__(self):
+        return 'ClassifierSpec({!r}, {!r}, {!r})'.format(self.name, self.class_path, self.params)
+
+    def get_class(self):
+        '''
+        Imports and returns the estimator class.
+        '''
+        module_name, _, class_name = self.class_path.rpartition('.')
+        if not module_name:
+            raise ValueError('{}: class must be a full import path, not {!r}'.format(self.name, self.class_path))
+        return getattr(import_module(module_name), class_name)
+
+    def create(self, **overrides):
+        '''
+        Returns a new, unfitted estimator. Keyword arguments replace the
+        parameters from the registry.
+        '''
+        params = dict(self.params)
+        params.update(overrides)
+        return self.get_class()(**params)
+
+    def sample(self, rng):
+        '''
+        Returns a dictionary of parameters drawn at random from the
+        `search` section using the numpy RandomState `rng`.
+        '''
+        import numpy as np
+
+        params = {}
+        for param, space in sorted(self.search.items()):
+            (kind, values), = space.items()
+            if kind == 'uniform':
+                params[param] = float(rng.uniform(*values))
+            elif kind == 'log_uniform':
+                params[param] = float(np.exp(rng.uniform(np.log(values[0]), np.log(values[1]))))
+            elif kind == 'int_uniform':
+                params[param] = int(rng.randint(values[0], values[1] + 1))
+            elif kind == 'choice':
+                params[param] = values[rng.randint(len(values))]
+            else:
+                raise ValueError('{}: unknown search space {!r} for {}'.format(self.name, kind, param))
+        return params
+
+
+def load_registry(path, include_disabled=False, section='classifiers'):
+    '''
+    Reads the classifier specs from `section` of the JSON file at `path`.
+    '''
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    specs = []
+    for entry in config.get(section, []):
+        try:
+            spec = ClassifierSpec(
+                entry['name'],
+                entry['class'],
+                entry.get('params'),
+                entry.get('enabled', True),
+                entry.get('search'),
+                entry.get('scale', True),
+                entry.get('sparse', True),
+            )
+        except KeyError as ex:
+            raise ValueError('{}: classifier entry is missing {}'.format(path, ex))
+        if spec.enabled or include_disabled:
+            specs.append(spec)
+
+    return specs
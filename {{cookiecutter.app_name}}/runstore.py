@@ -0,0 +1,376 @@
+'''
+A history of the results of classifier.py.
+
+Each run of classifier.py records, for every classifier, its F1 score,
+average precision, ROC AUC, fit and predict times, peak memory,
+parameters and (downsampled) precision-recall curve, together with a
+hash of the training data. Runs can then be listed, compared and
+followed over time without evaluating anything again:
+
+    python runstore.py list
+    python runstore.py show 12
+    python runstore.py diff 11 12          (or just "diff" for the last two)
+    python runstore.py trend "Linear SVC" --metric fit_time
+    python runstore.py plot 12 --output run12.png
+
+The store is a single SQLite database (RUN_STORE in classifier.py).
+Results are indexed by run and by classifier name, so these queries
+take milliseconds even with many thousands of runs. A change of data
+hash between runs is shown by "diff" and "trend", since it usually
+explains a change in the scores.
+
+When a classifier was loaded from the model store (MODEL_DIR in
+classifier.py) rather than fitted, its fit_time is the time taken to
+load it. Such results are marked "loaded", and no change in fit_time is
+given between a loaded and a fitted result, since the two measure
+different things.
+'''
+
+import argparse
+import json
+import sqlite3
+import sys
+import time
+
+METRICS = ('f1', 'average_precision', 'roc_auc', 'fit_time', 'predict_time', 'peak_memory')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    source TEXT,
+    data_key TEXT,
+    n_train INTEGER,
+    n_test INTEGER,
+    n_features INTEGER,
+    engine TEXT,
+    note TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_data_key ON runs (data_key);
+
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    class TEXT,
+    params TEXT,
+    f1 REAL,
+    average_precision REAL,
+    roc_auc REAL,
+    fit_time REAL,
+    predict_time REAL,
+    peak_memory INTEGER,
+    reused INTEGER,
+    precision BLOB,
+    recall BLOB,
+    PRIMARY KEY (run_id, name)
+);
+CREATE INDEX IF NOT EXISTS results_name ON results (name, run_id);
+'''
+
+
+# =====================================================================
+
+
+def _to_blob(values):
+    import numpy as np
+    if values is None:
+        return None
+    return np.asarray(values, dtype='<f4').tobytes()
+
+
+def _from_blob(blob):
+    import numpy as np
+    if blob is None:
+        return None
+    return np.frombuffer(blob, dtype='<f4')
+
+
+class RunStore(object):
+    '''
+    Records and queries evaluation runs in the SQLite database at `path`.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        # Several processes may record runs at once; wait for each other
+        # rather than failing
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def record(self, results, source=None, data_key=None, n_train=None, n_test=None, n_features=None,
+               engine=None, params=None, note=None):
+        '''
+        Saves the scored engine.EvaluationResult objects in `results` as
+        a new run and returns its id. `params` maps each classifier name
+        to a (class path, parameters) tuple.
+        '''
+        params = params or {}
+        with self.db:
+            run_id = self.db.execute(
+                'INSERT INTO runs (created, source, data_key, n_train, n_test, n_features, engine, note) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (time.time(), source, data_key, n_train, n_test, n_features, engine, note),
+            ).lastrowid
+            self.db.executemany(
+                'INSERT INTO results (run_id, name, class, params, f1, average_precision, roc_auc, '
+                'fit_time, predict_time, peak_memory, reused, precision, recall) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [
+                    (
+                        run_id,
+                        r.name,
+                        params.get(r.name, (None, None))[0],
+                        json.dumps(params.get(r.name, (None, None))[1], sort_keys=True, default=repr),
+                        r.score,
+                        r.average_precision,
+                        r.roc_auc,
+                        r.fit_time,
+                        r.predict_time,
+                        r.peak_memory,
+                        int(bool(r.reused)),
+                        _to_blob(r.precision),
+                        _to_blob(r.recall),
+                    )
+                    for r in results
+                ],
+            )
+        return run_id
+
+    # -----------------------------------------------------------------
+    # Queries
+
+    def runs(self, limit=20):
+        '''
+        Returns the newest `limit` runs, with the number of classifiers
+        and the best F1 score of each.
+        '''
+        return self.db.execute(
+            'SELECT r.*, COUNT(res.name) AS classifiers, MAX(res.f1) AS best_f1 '
+            'FROM (SELECT * FROM runs ORDER BY id DESC LIMIT ?) r '
+            'LEFT JOIN results res ON res.run_id = r.id '
+            'GROUP BY r.id ORDER BY r.id DESC',
+            (limit,),
+        ).fetchall()
+
+    def run(self, run_id):
+        return self.db.execute('SELECT * FROM runs WHERE id = ?', (run_id,)).fetchone()
+
+    def latest(self, count=2):
+        '''
+        Returns the ids of the newest `count` runs, oldest first.
+        '''
+        rows = self.db.execute('SELECT id FROM runs ORDER BY id DESC LIMIT ?', (count,)).fetchall()
+        return [row['id'] for row in reversed(rows)]
+
+    def results(self, run_id):
+        '''
+        Returns the results of one run, without their curves.
+        '''
+        return self.db.execute(
+            'SELECT name, class, params, {}, reused FROM results WHERE run_id = ? ORDER BY name'.format(
+                ', '.join(METRICS)),
+            (run_id,),
+        ).fetchall()
+
+    def curves(self, run_id):
+        '''
+        Returns a list of (name, precision, recall) tuples for one run.
+        '''
+        return [
+            (row['name'], _from_blob(row['precision']), _from_blob(row['recall']))
+            for row in self.db.execute(
+                'SELECT name, precision, recall FROM results WHERE run_id = ? ORDER BY name', (run_id,))
+        ]
+
+    def trend(self, name, limit=20):
+        '''
+        Returns the results of the classifier `name` in its newest
+        `limit` runs, oldest first.
+        '''
+        rows = self.db.execute(
+            'SELECT r.id, r.created, r.data_key, res.params, res.reused, {} '
+            'FROM results res JOIN runs r ON r.id = res.run_id '
+            'WHERE res.name = ? ORDER BY res.run_id DESC LIMIT ?'.format(
+                ', '.join('res.' + m for m in METRICS)),
+            (name, limit),
+        ).fetchall()
+        return rows[::-1]
+
+
+# =====================================================================
+
+
+def _when(created):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(created))
+
+
+def _value(metric, value):
+    if value is None:
+        return '-'
+    if metric == 'peak_memory':
+        return '{:.1f}MB'.format(value / 2**20)
+    if metric.endswith('_time'):
+        return '{:.3f}s'.format(value)
+    return '{:.4f}'.format(value)
+
+
+def _fitted(row):
+    return 'loaded' if row['reused'] else 'fitted'
+
+
+def _metric_change(metric, old_row, new_row):
+    '''
+    Returns the change in `metric` between two results, or a note
+    instead when the fit times of a loaded and a fitted model are
+    compared.
+    '''
+    if metric == 'fit_time' and bool(old_row['reused']) != bool(new_row['reused']):
+        return '({} -> {})'.format(_fitted(old_row), _fitted(new_row))
+    return _change(old_row[metric], new_row[metric])
+
+
+def _change(old, new):
+    if old is None or new is None:
+        return ''
+    if not old:
+        return '{:+.4f}'.format(new - old)
+    return '{:+.1%}'.format(new / old - 1)
+
+
+def cmd_list(store, args):
+    print('{:>5}  {:<16} {:>8} {:>8} {:>8}  {:<12} {}'.format(
+        'run', 'created', 'train', 'models', 'best F1', 'data', 'source'))
+    for run in store.runs(args.limit):
+        print('{:>5}  {:<16} {:>8} {:>8} {:>8}  {:<12} {}'.format(
+            run['id'], _when(run['created']), run['n_train'] or '-', run['classifiers'],
+            _value('f1', run['best_f1']), (run['data_key'] or '-')[:12],
+            (run['source'] or '') + ('  # ' + run['note'] if run['note'] else '')))
+
+
+def cmd_show(store, args):
+    run = store.run(args.run)
+    if run is None:
+        raise SystemExit('no run {}'.format(args.run))
+    print('Run {} at {} on {} ({} training rows, data {})'.format(
+        run['id'], _when(run['created']), run['source'], run['n_train'], (run['data_key'] or '-')[:12]))
+    for row in store.results(args.run):
+        print('  {:<24} {:<6}  {}  {}'.format(
+            row['name'], _fitted(row), '  '.join('{} {}'.format(m, _value(m, row[m])) for m in METRICS),
+            row['params']))
+
+
+def cmd_diff(store, args):
+    if args.runs:
+        old_id, new_id = args.runs
+    else:
+        latest = store.latest(2)
+        if len(latest) < 2:
+            raise SystemExit('need at least two runs to compare')
+        old_id, new_id = latest
+
+    old_run, new_run = store.run(old_id), store.run(new_id)
+    if old_run is None or new_run is None:
+        raise SystemExit('no run {}'.format(old_id if old_run is None else new_id))
+    print('Run {} -> run {}'.format(old_id, new_id))
+    if old_run['data_key'] != new_run['data_key']:
+        print('  the data changed: {} -> {}'.format(
+            (old_run['data_key'] or '-')[:12], (new_run['data_key'] or '-')[:12]))
+
+    old = {row['name']: row for row in store.results(old_id)}
+    new = {row['name']: row for row in store.results(new_id)}
+    for name in sorted(set(old) | set(new)):
+        if name not in new:
+            print('  {}: removed'.format(name))
+            continue
+        if name not in old:
+            print('  {}: added'.format(name))
+            continue
+        print('  {} ({} -> {}):'.format(name, _fitted(old[name]), _fitted(new[name])))
+        for m in METRICS:
+            print('    {:<18} {:>10} -> {:>10} {:>8}'.format(
+                m, _value(m, old[name][m]), _value(m, new[name][m]), _metric_change(m, old[name], new[name])))
+        if old[name]['params'] != new[name]['params']:
+            print('    params {} -> {}'.format(old[name]['params'], new[name]['params']))
+
+
+def cmd_trend(store, args):
+    rows = store.trend(args.name, args.limit)
+    if not rows:
+        raise SystemExit('no results for {!r}'.format(args.name))
+    print('{} over {} runs'.format(args.metric, len(rows)))
+    previous = None
+    for row in rows:
+        marks = []
+        if previous is not None and row['data_key'] != previous['data_key']:
+            marks.append('data changed')
+        if previous is not None and row['params'] != previous['params']:
+            marks.append('params changed')
+        print('{:>5}  {:<16} {:<6} {:>10} {:>18}  {}'.format(
+            row['id'], _when(row['created']), _fitted(row), _value(args.metric, row[args.metric]),
+            _metric_change(args.metric, previous, row) if previous is not None else '',
+            ', '.join(marks)))
+        previous = row
+
+
+def cmd_plot(store, args):
+    from plotting import write_report
+
+    curves = [(name, p, r) for name, p, r in store.curves(args.run) if p is not None]
+    if not curves:
+        raise SystemExit('no curves for run {}'.format(args.run))
+    write_report(args.output, curves, 'Precision-Recall Curves (run {})'.format(args.run))
+    print('Wrote {}'.format(args.output))
+
+
+def main(argv=None):
+    import classifier
+
+    parser = argparse.ArgumentParser(description='List and compare recorded runs of classifier.py')
+    parser.add_argument('--db', default=classifier.RUN_STORE, help='run store database')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    p = commands.add_parser('list', help='list the newest runs')
+    p.add_argument('--limit', type=int, default=20)
+    p.set_defaults(func=cmd_list)
+
+    p = commands.add_parser('show', help='show the results of one run')
+    p.add_argument('run', type=int)
+    p.set_defaults(func=cmd_show)
+
+    p = commands.add_parser('diff', help='compare two runs (default: the newest two)')
+    p.add_argument('runs', type=int, nargs='*', metavar='RUN')
+    p.set_defaults(func=cmd_diff)
+
+    p = commands.add_parser('trend', help="follow one classifier's results across runs")
+    p.add_argument('name')
+    p.add_argument('--metric', choices=METRICS, default='f1')
+    p.add_argument('--limit', type=int, default=20)
+    p.set_defaults(func=cmd_trend)
+
+    p = commands.add_parser('plot', help='plot the precision-recall curves of one run')
+    p.add_argument('run', type=int)
+    p.add_argument('--output', default='run.png', help='image file to write (.png, .svg or .pdf)')
+    p.set_defaults(func=cmd_plot)
+
+    args = parser.parse_args(argv)
+    if args.command == 'diff' and len(args.runs) not in (0, 2):
+        parser.error('diff takes two runs, or none to compare the newest two')
+    if not args.db:
+        parser.error('no run store; set RUN_STORE in classifier.py or pass --db')
+
+    store = RunStore(args.db)
+    try:
+        args.func(store, args)
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,351 @@
+'''
+A small HTTP prediction server for models trained by classifier.py.
+
+The scaler and classifier are loaded once at startup from the model
+store. Each request scores one row:
+
+    POST /predict
+    {"features": [0.0, 0.64, 0.64, ...]}
+
+    200 OK
+    {"score": 1.234, "label": 1.0}
+
+Calling scikit-learn once per row spends most of its time in Python
+overhead, so concurrent requests are collected into micro-batches and
+scored together. A batch is scored as soon as it holds --max-batch rows
+or the oldest request has waited --max-wait milliseconds, which bounds
+the latency that batching adds.
+
+GET /health returns the key and name of the loaded model and the
+number of features it expects.
+
+Run with --loadgen to send requests to a running server from many
+concurrent clients and report throughput and p50/p95/p99 latency. The
+rows sent have as many features as the server's /health reports, and
+responses other than 200 OK are counted separately rather than being
+included in the latency figures.
+
+Examples:
+    python server.py --port 8080 --model "Linear SVC"
+    python server.py --loadgen --port 8080 --requests 20000 --concurrency 64
+'''
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+DEFAULT_PORT = 8080
+DEFAULT_MAX_BATCH = 256
+DEFAULT_MAX_WAIT_MS = 2.0
+
+
+# =====================================================================
+
+
+class MicroBatcher(object):
+    '''
+    Collects single rows from concurrent callers and scores them in
+    batches with `pipeline`.
+    '''
+
+    def __init__(self, pipeline, max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT_MS / 1000.0):
+        self.pipeline = pipeline
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        # Rows are checked before queueing so that one bad request
+        # cannot cause a whole batch to fail
+        self.n_features = getattr(pipeline, 'n_features_in_', None)
+        self.batches = 0
+        self.rows = 0
+
+    async def predict(self, features):
+        '''
+        Returns the (score, label) for one row of features. Raises
+        ValueError if the row is not a flat list of finite numbers of the
+        length the pipeline expects.
+        '''
+        import numpy as np
+
+        try:
+            # Values too large for float32 become inf, which is rejected
+            # below
+            with np.errstate(over='ignore'):
+                row = np.asarray(features, dtype=np.float32)
+        except (TypeError, ValueError):
+            raise ValueError('features must be a list of numbers')
+        if row.ndim != 1:
+            raise ValueError('features must be a flat list, got {} dimensions'.format(row.ndim))
+        if self.n_features is not None and len(row) != self.n_features:
+            raise ValueError('expected {} features, got {}'.format(self.n_features, len(row)))
+        if not np.isfinite(row).all():
+            raise ValueError('features must be finite numbers')
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((row, future))
+        return await future
+
+    async def run(self):
+        '''
+        Scores batches until cancelled.
+        '''
+        from predict import score_batch
+        import numpy as np
+
+        loop = asyncio.get_running_loop()
+        while True:
+            # Wait for the first request, then collect more until the
+            # batch is full or the first one has waited long enough.
+            items = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(items) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Take anything else that is already waiting without blocking
+            while len(items) < self.max_batch and not self.queue.empty():
+                items.append(self.queue.get_nowait())
+
+            try:
+                X = np.stack([row for row, _ in items])
+                # Score in a thread so that the event loop keeps reading
+                # requests into the queue while this batch is running;
+                # they are collected into the next batch once it is done
+                scores, labels = await loop.run_in_executor(None, score_batch, self.pipeline, X)
+            except Exception as ex:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(ex)
+                continue
+
+            for (_, future), score, label in zip(items, scores, labels):
+                if not future.done():
+                    future.set_result((float(score), float(label)))
+
+            self.batches += 1
+            self.rows += len(items)
+
+
+# =====================================================================
+
+
+def _response(status, body):
+    data = json.dumps(body).encode('utf-8')
+    return (
+        'HTTP/1.1 {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n'.format(status, len(data))
+    ).encode('ascii') + data
+
+
+async def _handle(batcher, info, reader, writer):
+    '''
+    Serves HTTP/1.1 requests on one connection until it is closed.
+    '''
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+            length = 0
+            while True:
+                header = await reader.readline()
+                if header in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = header.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value.strip())
+            body = await reader.readexactly(length) if length else b''
+
+            if method == 'POST' and path == '/predict':
+                try:
+                    features = json.loads(body.decode('utf-8'))['features']
+                    score, label = await batcher.predict(features)
+                    writer.write(_response('200 OK', {'score': score, 'label': label}))
+                except (ValueError, KeyError, TypeError) as ex:
+                    writer.write(_response('400 Bad Request', {'error': str(ex)}))
+            elif method == 'GET' and path == '/health':
+                status = dict(info, batches=batcher.batches, rows=batcher.rows)
+                writer.write(_response('200 OK', status))
+            else:
+                writer.write(_response('404 Not Found', {'error': 'not found'}))
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(pipeline, info, host, port, max_batch, max_wait):
+    batcher = MicroBatcher(pipeline, max_batch, max_wait)
+    batch_task = asyncio.ensure_future(batcher.run())
+
+    server = await asyncio.start_server(
+        lambda r, w: _handle(batcher, info, r, w), host, port)
+    print('Serving {} on http://{}:{}/predict'.format(info['name'], host, port))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batch_task.cancel()
+
+
+# =====================================================================
+
+
+async def _read_response(reader):
+    '''
+    Reads one HTTP response and returns its status code and body.
+    '''
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('the server closed the connection')
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        header = await reader.readline()
+        if header in (b'\r\n', b''):
+            break
+        name, _, value = header.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value.strip())
+    return status, await reader.readexactly(length)
+
+
+async def _health(host, port):
+    '''
+    Returns the /health status of the server as a dict.
+    '''
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write('GET /health HTTP/1.1\r\nHost: {}\r\n\r\n'.format(host).encode('ascii'))
+        await writer.drain()
+        status, body = await _read_response(reader)
+    finally:
+        writer.close()
+    if status != 200:
+        raise RuntimeError('GET /health returned {}'.format(status))
+    return json.loads(body.decode('utf-8'))
+
+
+async def _client(host, port, rows, count, latencies, failures):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for i in range(count):
+            body = json.dumps({'features': rows[i % len(rows)]}).encode('utf-8')
+            start = time.perf_counter()
+            writer.write(
+                'POST /predict HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n'
+                .format(host, len(body)).encode('ascii') + body)
+            await writer.drain()
+
+            status, _ = await _read_response(reader)
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                # A rejected request is answered without being scored, so
+                # its latency says nothing about the model
+                failures[status] = failures.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def load_generator(host, port, rows, requests, concurrency):
+    '''
+    Sends `requests` predictions from `concurrency` connections and
+    returns a tuple containing:
+        (latencies, failures, elapsed)
+    where `latencies` are the seconds taken by each successful request,
+    `failures` maps the status of each other response to its count, and
+    `elapsed` is the total time.
+    '''
+    latencies = []
+    failures = {}
+    per_client = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, rows, n, latencies, failures) for n in per_client if n))
+    return latencies, failures, time.perf_counter() - start
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_load_generator(host, port, requests, concurrency, n_features=None):
+    '''
+    Sends requests to the server and prints the throughput and latency.
+    Rows have `n_features` values, or as many as the server expects.
+    '''
+    import numpy as np
+
+    if n_features is None:
+        n_features = asyncio.run(_health(host, port)).get('n_features')
+        if n_features is None:
+            raise ValueError('the server does not report its number of features; pass --features')
+
+    # Random rows are enough to measure latency
+    rows = np.random.RandomState(0).exponential(0.5, (1000, n_features)).round(3).tolist()
+    latencies, failures, elapsed = asyncio.run(load_generator(host, port, rows, requests, concurrency))
+    latencies.sort()
+
+    print('{} requests from {} connections in {:.2f}s ({:.0f} successful requests/sec)'.format(
+        len(latencies) + sum(failures.values()), concurrency, elapsed, len(latencies) / elapsed if elapsed else 0))
+    for status, count in sorted(failures.items()):
+        print('  {} responses with status {} (not included below)'.format(count, status))
+    for p in (50, 95, 99):
+        print('  p{}: {:.2f} ms'.format(p, _percentile(latencies, p) * 1000))
+
+
+def main(argv=None):
+    import classifier
+
+    parser = argparse.ArgumentParser(description='Serve predictions from a trained model over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--model', help='name of the classifier to serve (default: the newest model)')
+    parser.add_argument('--key', help='key of a specific stored model')
+    parser.add_argument('--model-dir', default=classifier.MODEL_DIR, help='model store directory')
+    parser.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH,
+                        help='largest number of rows scored together')
+    parser.add_argument('--max-wait', type=float, default=DEFAULT_MAX_WAIT_MS,
+                        help='milliseconds a request may wait for a batch to fill')
+    parser.add_argument('--loadgen', action='store_true', help='send requests to a running server')
+    parser.add_argument('--requests', type=int, default=10000, help='requests to send with --loadgen')
+    parser.add_argument('--concurrency', type=int, default=32, help='connections to use with --loadgen')
+    parser.add_argument('--features', type=int,
+                        help='features per row sent with --loadgen (default: what the server reports)')
+    args = parser.parse_args(argv)
+
+    if args.loadgen:
+        run_load_generator(args.host, args.port, args.requests, args.concurrency, args.features)
+        return 0
+
+    from predict import load_model
+    from modelstore import ModelStore
+
+    # Load the model once; every request shares it
+    key, pipeline = load_model(args.model_dir, args.model, args.key)
+    info = {
+        'key': key,
+        'name': ModelStore(args.model_dir).metadata(key).get('name'),
+        'n_features': getattr(pipeline, 'n_features_in_', None),
+    }
+
+    try:
+        asyncio.run(serve(pipeline, info, args.host, args.port, args.max_batch, args.max_wait / 1000.0))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
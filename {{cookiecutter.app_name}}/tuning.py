@@ -0,0 +1,224 @@
+'''
+Hyperparameter tuning for the classifiers in the registry.
+
+The parameters in classifiers.json are only a starting point. This
+script searches the ranges given in each entry's `search` section using
+successive halving:
+   1. draw --candidates random parameter sets
+   2. score every set with cross-validation on a small sample of rows
+   3. keep the best 1/--eta of the sets and multiply the rows by --eta
+   4. repeat until the sets are scored on all of the training data
+so poor configurations are dropped early and most of the time is spent
+on the promising ones. Each round runs all (parameters, fold) fits in
+parallel across cores.
+
+Only the training split from classifier.py is used, so the test set
+stays unseen. The folds are scaled once and saved as .npy files that
+every fit memory-maps, rather than refitting the scaler for every
+candidate (see crossval.prepare_folds). Every fit's score is memoized
+on disk, so an interrupted or repeated search picks up where it left
+off. Fit times are not kept, since a memoized time would describe an
+earlier run, possibly on another machine.
+
+Examples:
+    python tuning.py
+    python tuning.py --classifiers NuSVC --candidates 81 --update-registry
+'''
+
+import argparse
+import json
+import os
+import re
+import sys
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tuning_cache')
+
+
+# =====================================================================
+
+
+def score_config(class_path, params, fold_paths, n_rows):
+    '''
+    Fits the estimator `class_path` with `params` on the first `n_rows`
+    training rows of one fold and returns the F1 score on the fold's
+    validation rows.
+
+    All arguments are small, so memoizing this function is cheap.
+    '''
+    import numpy as np
+    from importlib import import_module
+    from sklearn.metrics import f1_score
+
+    X_train, y_train, X_valid, y_valid = [np.load(p, mmap_mode='r') for p in fold_paths]
+
+    module_name, _, class_name = class_path.rpartition('.')
+    estimator = getattr(import_module(module_name), class_name)(**params)
+
+    estimator.fit(X_train[:n_rows], y_train[:n_rows])
+    return f1_score(y_valid, estimator.predict(X_valid))
+
+
+# =====================================================================
+
+
+def successive_halving(spec, folds, n_candidates=27, eta=3, min_rows=500, n_jobs=-1, memory=None, seed=0):
+    '''
+    Searches the parameter ranges of `spec` and returns a tuple
+    containing:
+        (best params, best mean F1 score, history)
+    where history lists (rows, params, mean score) for every
+    configuration scored in every round.
+    '''
+    import numpy as np
+    from joblib import Parallel, delayed
+
+    score = memory.cache(score_config) if memory is not None else score_config
+
+    rng = np.random.RandomState(seed)
+    configs = []
+    for _ in range(n_candidates if spec.search else 1):
+        params = dict(spec.params)
+        params.update(spec.sample(rng))
+        configs.append(params)
+
+    n_train = min(len(np.load(paths[1], mmap_mode='r')) for paths in folds)
+    rows = min(min_rows, n_train)
+    history = []
+
+    while True:
+        jobs = [(params, paths) for params in configs for paths in folds]
+        results = Parallel(n_jobs=n_jobs)(
+            delayed(score)(spec.class_path, params, paths, rows) for params, paths in jobs
+        )
+
+        means = []
+        for i, params in enumerate(configs):
+            mean_score = float(np.mean(results[i * len(folds):(i + 1) * len(folds)]))
+            means.append(mean_score)
+            history.append((rows, params, mean_score))
+
+        order = np.argsort(means)[::-1]
+        print('  {} configurations on {} rows: best F1 {:.3f}'.format(len(configs), rows, means[order[0]]))
+
+        if rows >= n_train or len(configs) == 1:
+            return configs[order[0]], means[order[0]], history
+
+        # Keep the best configurations and give them more data
+        configs = [configs[i] for i in order[:max(1, len(configs) // eta)]]
+        rows = min(n_train, rows * eta)
+
+
+_WHITESPACE = re.compile(r'\s*')
+_DECODER = json.JSONDecoder()
+
+
+def _members(text, pos):
+    '''
+    Yields (key, start, end) for each member of the JSON object that
+    starts at `pos` in `text`, where text[start:end] is the member's
+    value. Arrays yield their indexes as keys.
+    '''
+    is_object = text[pos] == '{'
+    pos = _WHITESPACE.match(text, pos + 1).end()
+    index = 0
+    while text[pos] not in '}]':
+        if is_object:
+            key, pos = _DECODER.raw_decode(text, pos)
+            pos = _WHITESPACE.match(text, pos).end() + 1  # the colon
+            pos = _WHITESPACE.match(text, pos).end()
+        else:
+            key, index = index, index + 1
+        _, end = _DECODER.raw_decode(text, pos)
+        yield key, pos, end
+        pos = _WHITESPACE.match(text, end).end()
+        if text[pos] == ',':
+            pos = _WHITESPACE.match(text, pos + 1).end()
+
+
+def update_registry(path, best):
+    '''
+    Writes the best parameters found for each classifier name in `best`
+    back to the registry file at `path`. Only the "params" of those
+    entries are rewritten, each on one line, so the layout of the rest
+    of the file is kept.
+    '''
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+
+    # (start, end, replacement) for each change, applied from the end of
+    # the file so the earlier positions stay valid
+    changes = []
+    start = _WHITESPACE.match(text).end()
+    for section, section_start, _ in _members(text, start):
+        if section != 'classifiers':
+            continue
+        for _, entry_start, _ in _members(text, section_start):
+            values = {key: (s, e) for key, s, e in _members(text, entry_start)}
+            name = json.loads(text[slice(*values['name'])])
+            if name not in best:
+                continue
+            params = json.dumps(best[name])
+            if 'params' in values:
+                changes.append(values['params'] + (params,))
+            else:
+                # Add the parameters after the name, indented like it
+                name_end = values['name'][1]
+                line_start = text.rfind('\n', 0, values['name'][0]) + 1
+                indent = _WHITESPACE.match(text, line_start).group()
+                changes.append((name_end, name_end, ',\n{}"params": {}'.format(indent, params)))
+
+    for change_start, change_end, replacement in sorted(changes, reverse=True):
+        text = text[:change_start] + replacement + text[change_end:]
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def main(argv=None):
+    import classifier
+    from joblib import Memory
+    from crossval import prepare_folds
+    from registry import load_registry
+
+    parser = argparse.ArgumentParser(description='Tune the hyperparameters of the registry classifiers')
+    parser.add_argument('--classifiers', nargs='+', help='names of the classifiers to tune (default: all enabled)')
+    parser.add_argument('--candidates', type=int, default=27, help='random configurations to start with')
+    parser.add_argument('--eta', type=int, default=3, help='fraction of configurations kept in each round is 1/eta')
+    parser.add_argument('--min-rows', type=int, default=500, help='training rows used in the first round')
+    parser.add_argument('--folds', type=int, default=3, help='cross-validation folds')
+    parser.add_argument('--jobs', type=int, default=-1, help='parallel fits (-1 uses every core)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='where folds and fit results are kept')
+    parser.add_argument('--update-registry', action='store_true',
+                        help='write the best parameters back to the registry file')
+    args = parser.parse_args(argv)
+
+    print("Downloading data from {}".format(classifier.URL))
+    frame = classifier.download_data()
+    X_train, _, y_train, _ = classifier.split_features_and_labels(frame)
+    del frame
+
+    folds = prepare_folds(X_train, y_train, args.folds, args.cache_dir, args.seed)
+    memory = Memory(os.path.join(args.cache_dir, 'fits'), verbose=0)
+
+    specs = load_registry(classifier.REGISTRY_FILE, include_disabled=bool(args.classifiers))
+    if args.classifiers:
+        specs = [s for s in specs if s.name in args.classifiers]
+
+    best = {}
+    for spec in specs:
+        print('Tuning {}'.format(spec.name))
+        params, score, _ = successive_halving(
+            spec, folds, args.candidates, args.eta, args.min_rows, args.jobs, memory, args.seed)
+        best[spec.name] = params
+        print('  best F1 {:.3f} with {}'.format(score, json.dumps(params, sort_keys=True)))
+
+    if args.update_registry:
+        update_registry(classifier.REGISTRY_FILE, best)
+        print('Updated {}'.format(classifier.REGISTRY_FILE))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())